@@ -1,8 +1,12 @@
 import os
 import csv
 import json
+import signal
 import logging
+import threading
 import paho.mqtt.client as mqtt
+# Same bounded queue and workers as the rooms client of final/MQTT Client (a copy, so this client stays standalone)
+from ingest_pipeline import IngestPipeline
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
@@ -28,10 +32,9 @@ topics = [
     "envsensors/airQ/airQFOYER"
 ]
 
-# Callback when a message is received
-def on_message(client, userdata, message):
-    topic = message.topic
-    payload = message.payload.decode()
+# Decode and store one message (runs on the pipeline's worker thread)
+def process_message(topic, payload):
+    payload = payload.decode()
     logging.info(f"Received message on topic: {topic}")
     logging.debug(f"Payload: {payload}")
 
@@ -52,6 +55,14 @@ def on_message(client, userdata, message):
         writer.writerow(data.values())
         logging.info(f"Appended data to {filename}")
 
+# Bounded queue between paho's network thread and one writer thread; full puts are counted as
+# blocked, then dropped after put_timeout
+pipeline = IngestPipeline(process_message, maxsize=10000, workers=1, put_timeout=0.05)
+
+# Callback when a message is received: only enqueue
+def on_message(client, userdata, message):
+    pipeline.submit(message.topic, message.payload)
+
 # Callback when the client connects to the broker
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
@@ -83,13 +94,19 @@ logging.info(f"Attempting to connect to MQTT broker at {broker_address}:{port}")
 # Start the loop to process MQTT events
 client.loop_start()
 
-# Keep the main thread running
+# Keep the main thread blocked until SIGINT/SIGTERM
+stop_event = threading.Event()
+signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
 try:
-    while True:
-        pass
+    while not stop_event.wait(60):
+        logging.info(f"Ingest pipeline: {pipeline.stats()}")
 except KeyboardInterrupt:
-    logging.info("Exiting gracefully")
+    pass
 finally:
+    logging.info("Exiting gracefully")
     client.loop_stop()
     client.disconnect()
     logging.info("MQTT client disconnected and loop stopped")
+    # Let the writer drain what is already queued
+    pipeline.close()
+    logging.info(f"Queue drained: {pipeline.stats()}")
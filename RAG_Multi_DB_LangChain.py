@@ -1,4 +1,5 @@
 import os
+import sys
 import ast
 import datetime
 import pandas as pd
@@ -10,6 +11,9 @@ from sqlalchemy import DateTime
 from openai import OpenAI
 from langchain.schema import HumanMessage, AIMessage  # Use HumanMessage instead of UserMessage
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'final'))
+from air_quality import band_distribution
+
 
 def load_openai_key():
     with open('oaikey.txt') as keyfile:
@@ -191,7 +195,7 @@ class DescriberAgent:
         print(response.content) 
         return response.content
     
-def generate_dynamic_description(input_query, output):
+def generate_dynamic_description(input_query, output, df_output=None):
     """
     Generates a description of the upcoming visualization by feeding the input and output to an LLM,
     based on a predefined schema for the description.
@@ -199,6 +203,8 @@ def generate_dynamic_description(input_query, output):
     Args:
         input_query (str): The original query made by the user.
         output (str): The response generated from the query.
+        df_output (pd.DataFrame): The output as a DataFrame, whose measurement columns are classified
+            into the bands of measurement_ranges.csv.
     
     Returns:
         str: A dynamically generated explanation of what the image visualization will represent,
@@ -211,14 +217,10 @@ def generate_dynamic_description(input_query, output):
     # Create an instance of the describer_agent
     describer_agent = DescriberAgent(llm)
 
-    # Specify the file path
-    file_path = './measurement_ranges.csv'
-
-    # Load the CSV file into a DataFrame.
-    measurment_df = pd.read_csv(file_path)
-
-    # Display the DataFrame to check the data.
-    #print(measurment_df)
+    # Share of the values in each band (Hazardous, Unhealthy, Moderate, Good, Excellent), computed locally
+    # from the ranges compiled once per process, instead of pasting the whole ranges table in the prompt.
+    bands = band_distribution(df_output) if df_output is not None else []
+    bands = ' '.join(bands) if bands else 'not available for this output'
 
     # Predefined schema for the description
     schema = f"""
@@ -228,7 +230,7 @@ def generate_dynamic_description(input_query, output):
     2. **X-Axis Description**: Explain what the X-axis represents.
     3. **Y-Axis Description**: Explain what the Y-axis represents.
     4. **Key Metrics/Trends**: Mention any important metrics or trends that might be visualized.
-    5. **Data Analysis**: Based on the measurment dataframe containing the range for classifying measurments in Hazardous,Unhealthy,Moderate,Good,Excellent {measurment_df}, provide some insights on the metric, always related to the Hospital.
+    5. **Data Analysis**: Based on the share of the values in each air-quality band ({bands}), provide some insights on the metric, always related to the Hospital.
     6. **Insights**: Provide potential insights or conclusions that can be drawn from the data visualization.
     
     Use concise language and focus on what the user will be able to learn from this visualization.
@@ -379,7 +381,7 @@ def main():
         print(df_img_visualization)
         img_path = generate_img_visualization(df_img_visualization, oaikey, input_query)
         response = {
-        "response_message": generate_dynamic_description(input_query, query_result['output']),
+        "response_message": generate_dynamic_description(input_query, query_result['output'], df_img_visualization),
         "includes_image": True,
         "image_path": img_path
     }
@@ -0,0 +1,98 @@
+"""
+Offline stand-in for xarm.wrapper.XArmAPI, with the calls the window scripts and traj_streamer.py
+make. Every motion command takes a configurable time, like a call to the real arm over the
+network, and is recorded with the time it was received, so the streaming can be tested and
+measured without the robot.
+"""
+import time
+import random
+
+
+class FakeXArmAPI:
+    """
+    Records the commands sent to a pretend xArm.
+
+    Args:
+        port (str): IP of the robot, unused.
+        latency_s (float): Mean duration of a motion command.
+        jitter_s (float): Random extra duration of a motion command, uniform in [0, jitter_s].
+        seed (int): Seed of the random jitter.
+    """
+
+    def __init__(self, port=None, latency_s=0.001, jitter_s=0.0, seed=0, **kwargs):
+        self.port = port
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.connected = True
+        self.state = 0
+        self.mode = 0
+        self.error_code = 0
+        self.warn_code = 0
+        self.angles = None
+        # (time.perf_counter() when received, command name, angles) of every motion command
+        self.commands = []
+        self._random = random.Random(seed)
+        self._callbacks = {}
+
+    def _call(self):
+        time.sleep(self.latency_s + self._random.uniform(0, self.jitter_s))
+
+    def _move(self, name, angles):
+        received = time.perf_counter()
+        self._call()
+        if self.mode == 1 and name != 'set_servo_angle_j' or self.mode != 1 and name == 'set_servo_angle_j':
+            return 1  # Wrong mode for the command, as the controller rejects it
+        self.angles = list(angles)
+        self.commands.append((received, name, self.angles))
+        return 0
+
+    def motion_enable(self, enable=True, servo_id=None):
+        return 0
+
+    def set_mode(self, mode=0):
+        self.mode = mode
+        return 0
+
+    def set_state(self, state=0):
+        self.state = state
+        return 0
+
+    def clean_warn(self):
+        self.warn_code = 0
+        return 0
+
+    def clean_error(self):
+        self.error_code = 0
+        return 0
+
+    def get_state(self):
+        return 0, self.state
+
+    def get_err_warn_code(self):
+        return 0, [self.error_code, self.warn_code]
+
+    def set_servo_angle(self, servo_id=None, angle=None, speed=None, mvacc=None, mvtime=None, relative=False,
+                        is_radian=None, wait=False, timeout=None, radius=None, **kwargs):
+        return self._move('set_servo_angle', angle)
+
+    def set_servo_angle_j(self, angles, speed=None, mvacc=None, mvtime=None, is_radian=None, **kwargs):
+        return self._move('set_servo_angle_j', angles)
+
+    def register_error_warn_changed_callback(self, callback=None):
+        self._callbacks.setdefault('error_warn', []).append(callback)
+        return True
+
+    def release_error_warn_changed_callback(self, callback=None):
+        self._callbacks.get('error_warn', []).remove(callback)
+        return True
+
+    def register_state_changed_callback(self, callback=None):
+        self._callbacks.setdefault('state', []).append(callback)
+        return True
+
+    def release_state_changed_callback(self, callback=None):
+        self._callbacks.get('state', []).remove(callback)
+        return True
+
+    def disconnect(self):
+        self.connected = False
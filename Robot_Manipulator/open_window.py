@@ -1,45 +1,19 @@
-import time
+import os
 from xarm.wrapper import XArmAPI
+from traj_loader import load_trajectory
+from traj_streamer import TrajectoryStreamer, format_stats
 
-# Function to parse the .traj file
-def parse_traj_file(file_path):
-    trajectory_data = []
-    frequency = 250.0  # Default frequency in case it's missing
-
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-        # Extract the frequency from the header
-        if lines[0].startswith("# frequency="):
-            frequency = float(lines[0].split('=')[1].strip())
-
-        # Process the rest of the lines as trajectory data
-        for line in lines[1:]:
-            line = line.strip().rstrip(',')  # Remove any trailing whitespace and commas
-            if line:  # Skip empty lines
-                try:
-                    # Convert the line into a list of floats (joint angles)
-                    data_point = list(map(float, line.split(',')))
-                    trajectory_data.append(data_point)
-                except ValueError as e:
-                    print(f"Skipping invalid line: {line}. Error: {e}")
-
-    return trajectory_data, frequency
+# Playback of the trajectory: "position" queues set_servo_angle commands, "servo" streams set_servo_angle_j in servo mode
+STREAM_MODE = os.environ.get('XARM_STREAM_MODE', 'position')
 
 # Function to perform the movement on the xArm robot
 def perform_movement(arm, trajectory_data, frequency):
-    # Calculate the time step based on the frequency
-    time_step = 1.0 / frequency
-    
-    for data_point in trajectory_data:
-        # Send joint angles or positions to the robot
-        # Assuming the data points represent joint angles (adjust if needed)
-        arm.set_servo_angle(angle=data_point[:7], wait=False, is_radian=True)  # Sending the first 7 values as joint angles
-        
-        # Wait for the next step
-        time.sleep(time_step)
-    
-    print("Movement completed.")
+    # Each point is sent at its own deadline from the start (see traj_streamer.py), so the time of
+    # the SDK calls does not add up over the steps and the movement keeps the recorded rate
+    streamer = TrajectoryStreamer(arm, frequency, mode=STREAM_MODE)
+    stats = streamer.stream(trajectory_data)
+
+    print(f"Movement completed. {format_stats(stats)}")
 
 # Main function to execute the script
 def main(traj_file_path, robot_ip):
@@ -52,8 +26,8 @@ def main(traj_file_path, robot_ip):
     arm.clean_warn()
     arm.clean_error()
 
-    # Parse the .traj file and extract trajectory data and frequency
-    trajectory_data, frequency = parse_traj_file(traj_file_path)
+    # Load the (N, 7) joint angles and the frequency of the .traj file, from its cache after the first run
+    trajectory_data, frequency = load_trajectory(traj_file_path)
     
     # Perform the movement on the robot
     perform_movement(arm, trajectory_data, frequency)
@@ -1,7 +1,13 @@
+import os
 import time
 from xarm.wrapper import XArmAPI
+from traj_loader import load_trajectory
+from traj_streamer import TrajectoryStreamer, format_stats
 import traceback
 
+# Playback of the trajectory: "position" queues set_servo_angle commands, "servo" streams set_servo_angle_j in servo mode
+STREAM_MODE = os.environ.get('XARM_STREAM_MODE', 'position')
+
 class RobotMain(object):
     """Robot Main Class"""
     def __init__(self, robot, **kwargs):
@@ -79,41 +85,25 @@ class RobotMain(object):
         if not self._check_code(code, 'set_servo_angle'):
             return
 
-def parse_traj_file(file_path):
-    trajectory_data = []
-    frequency = 250.0  # Default frequency in case it's missing
-
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-        if lines[0].startswith("# frequency="):
-            frequency = float(lines[0].split('=')[1].strip())
-
-        for line in lines[1:]:
-            line = line.strip().rstrip(',')  # Remove trailing commas
-            if line:
-                try:
-                    data_point = list(map(float, line.split(',')))
-                    trajectory_data.append(data_point)
-                except ValueError as e:
-                    print(f"Skipping invalid line: {line}. Error: {e}")
-
-    return trajectory_data, frequency
+    def stream_trajectory(self, trajectory_data, frequency, mode='position'):
+        # Points are sent at their deadlines; the arm's health is checked every few points instead of before each one
+        streamer = TrajectoryStreamer(self._arm, frequency, mode=mode, speed=self._angle_speed, mvacc=self._angle_acc,
+                                      radius=0.0, should_continue=lambda: self.is_alive)
+        stats = streamer.stream(trajectory_data)
+        if stats['error_code'] != 0:
+            self._check_code(stats['error_code'], 'set_servo_angle_j' if mode == 'servo' else 'set_servo_angle')
+        return stats
 
 def perform_movement(robot_main, trajectory_data, frequency):
-    time_step = 1.0 / frequency
-
-    for data_point in trajectory_data:
-        robot_main.move_servo(angle=data_point[:7], wait=False)
-        time.sleep(time_step)
+    stats = robot_main.stream_trajectory(trajectory_data, frequency, mode=STREAM_MODE)
 
-    print("Movement completed.")
+    print(f"Movement completed. {format_stats(stats)}")
 
 def main(traj_file_path, robot_ip):
     arm = XArmAPI(robot_ip)
     robot_main = RobotMain(arm)
     
-    trajectory_data, frequency = parse_traj_file(traj_file_path)
+    trajectory_data, frequency = load_trajectory(traj_file_path)
     
     perform_movement(robot_main, trajectory_data, frequency)
     
@@ -0,0 +1,141 @@
+"""
+Loader of the .traj trajectory files: a "# frequency=<Hz>" header, then one line of comma-separated
+joint angles (radians, with a trailing comma) per step.
+
+The first load parses a file in one vectorized pass into a float64 (N, 7) array and writes two
+sidecars next to it: <file>.npy with the array, and <file>.json with the frequency and the size,
+modification time and SHA-1 of the .traj it was parsed from. Later loads memory-map the .npy
+instead of parsing, as long as the .traj is unchanged, so the arm can start moving right away.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+DEFAULT_FREQUENCY = 250.0  # In case the header is missing
+JOINTS = 7
+FREQUENCY_PREFIX = '# frequency='
+
+
+def _read_frequency(file_path):
+    with open(file_path, 'r') as file:
+        first_line = file.readline()
+    if first_line.startswith(FREQUENCY_PREFIX):
+        return float(first_line.split('=')[1].strip())
+    return DEFAULT_FREQUENCY
+
+
+def _parse_lines(file_path):
+    # Line by line, skipping the lines that are not JOINTS numbers, like the original parser did
+    rows = []
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.strip().rstrip(',')
+            if not line or line.startswith('#'):
+                continue
+            try:
+                values = [float(value) for value in line.split(',')]
+            except ValueError as e:
+                print(f"Skipping invalid line: {line}. Error: {e}")
+                continue
+            if len(values) < JOINTS:
+                print(f"Skipping invalid line: {line}. Error: expected {JOINTS} values, got {len(values)}")
+                continue
+            rows.append(values[:JOINTS])
+    return np.array(rows, dtype=np.float64).reshape(-1, JOINTS)
+
+
+def parse_traj_file(file_path):
+    """
+    Parses a .traj file, without the cache.
+
+    Args:
+        file_path (str): Path of the .traj file.
+
+    Returns:
+        tuple: (float64 array of shape (N, 7), one row of joint angles per step, frequency in Hz)
+    """
+    frequency = _read_frequency(file_path)
+    try:
+        # The trailing comma makes an empty 8th field, left out by usecols
+        trajectory = np.loadtxt(file_path, dtype=np.float64, delimiter=',', comments='#',
+                                usecols=range(JOINTS), ndmin=2)
+    except ValueError:
+        trajectory = _parse_lines(file_path)
+    return np.ascontiguousarray(trajectory), frequency
+
+
+def _sha1(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(file_path):
+    return file_path + '.npy', file_path + '.json'
+
+
+def _load_cache(file_path, stat):
+    array_path, meta_path = _cache_paths(file_path)
+    if not (os.path.exists(array_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if (meta['size'], meta['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            # Touched or copied but possibly unchanged: the content decides
+            if meta['size'] != stat.st_size or meta['sha1'] != _sha1(file_path):
+                return None
+            meta.update(mtime_ns=stat.st_mtime_ns)
+            _write_json(meta_path, meta)
+        trajectory = np.load(array_path, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None  # Unreadable cache, parsed again
+    if trajectory.ndim != 2 or trajectory.shape[1] != JOINTS:
+        return None
+    return trajectory, meta['frequency']
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(path + '.tmp', path)
+
+
+def _write_cache(file_path, stat, trajectory, frequency):
+    array_path, meta_path = _cache_paths(file_path)
+    with open(array_path + '.tmp', 'wb') as array_file:
+        np.save(array_file, trajectory)
+    os.replace(array_path + '.tmp', array_path)
+    # Written last, so the metadata never describes an older array
+    _write_json(meta_path, {'frequency': frequency, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                            'sha1': _sha1(file_path)})
+
+
+def load_trajectory(file_path, cache=True):
+    """
+    Loads a .traj file, from its sidecar cache when it is up to date.
+
+    Args:
+        file_path (str): Path of the .traj file.
+        cache (bool): Whether to use and write the .npy/.json sidecars next to the file.
+
+    Returns:
+        tuple: (float64 array of shape (N, 7), read-only and memory-mapped when it comes from the
+        cache, frequency in Hz)
+    """
+    if not cache:
+        return parse_traj_file(file_path)
+    stat = os.stat(file_path)
+    cached = _load_cache(file_path, stat)
+    if cached is not None:
+        return cached
+    trajectory, frequency = parse_traj_file(file_path)
+    try:
+        _write_cache(file_path, stat, trajectory, frequency)
+    except OSError as e:
+        # e.g. a read-only trajectories directory: the next load parses again
+        print(f"Could not write the trajectory cache of {file_path}: {e}")
+    return trajectory, frequency
@@ -0,0 +1,218 @@
+"""
+Real-time playback of a recorded trajectory on the xArm.
+
+Point i is sent at its own absolute deadline, start + i / frequency, on the monotonic
+perf_counter clock, rather than after a fixed sleep following the previous point: the time spent
+in the SDK call and in the health checks no longer adds up over the thousands of points, so the
+playback keeps the rate of the recording. When a call took so long that later points are
+already due, the points in between are dropped and the most recent due point is sent instead
+(the arm is heading for it anyway). The last point is always sent.
+
+Two ways of sending the points:
+    position: set_servo_angle(wait=False) in position mode (0), queued by the controller.
+    servo:    set_servo_angle_j in servo mode (1), executed as it arrives. The arm is first moved
+              to the first point in position mode, then switched to servo mode, and back afterwards.
+
+Offline demo with the stand-in arm (fake_xarm.py), run from Robot_Manipulator:
+    python traj_streamer.py trajectories/Opening_Window.traj --fake --latency-ms 2 [--mode servo]
+"""
+import time
+import argparse
+import numpy as np
+
+from traj_loader import load_trajectory
+
+POSITION_MODE = 0
+SERVO_MODE = 1
+
+
+def sleep_until(deadline, spin_s=0.002):
+    """
+    Waits until time.perf_counter() reaches the deadline. time.sleep can overshoot by a scheduler
+    tick, so the last spin_s are busy-waited.
+    """
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > spin_s:
+            time.sleep(remaining - spin_s)
+
+
+def playback_stats(send_times, indices, start, frequency, points):
+    """
+    Timing statistics of a playback.
+
+    Args:
+        send_times (list): time.perf_counter() when each point was sent.
+        indices (list): Index in the trajectory of each sent point.
+        start (float): time.perf_counter() of the deadline of point 0.
+        frequency (float): Rate of the recording, in Hz.
+        points (int): Number of points of the trajectory.
+
+    Returns:
+        dict: Points sent and skipped, duration vs the nominal one, achieved rate, and the
+        lateness (send time - deadline) and jitter (deviation of the interval between two sends
+        from the scheduled one) percentiles, in ms.
+    """
+    period = 1.0 / frequency
+    send_times, indices = np.asarray(send_times), np.asarray(indices)
+    lateness_ms = (send_times - (start + indices * period)) * 1000
+    jitter_ms = np.abs(np.diff(send_times) - np.diff(indices) * period) * 1000
+    duration = send_times[-1] - start if len(send_times) else 0.0
+    nominal = (points - 1) * period
+    stats = {
+        "points": points,
+        "sent": len(send_times),
+        "skipped": int(indices[-1] + 1 - len(indices)) if len(indices) else 0,
+        "duration_s": duration,
+        "nominal_s": nominal,
+        # Points per second, and how fast the trajectory was played (1.0 = as recorded)
+        "rate_hz": (len(send_times) - 1) / duration if duration > 0 else 0.0,
+        "playback_speed": nominal / duration if duration > 0 else 0.0,
+    }
+    for name, values in (("lateness", lateness_ms), ("jitter", jitter_ms)):
+        for q in (50, 95, 99):
+            stats[f"{name}_p{q}_ms"] = float(np.percentile(values, q)) if len(values) else 0.0
+        stats[f"{name}_max_ms"] = float(values.max()) if len(values) else 0.0
+    return stats
+
+
+def format_stats(stats):
+    return (f"{stats['sent']}/{stats['points']} points ({stats['skipped']} skipped) in {stats['duration_s']:.2f} s "
+            f"(nominal {stats['nominal_s']:.2f} s, {stats['rate_hz']:.1f} Hz, speed {stats['playback_speed']:.3f}); "
+            f"lateness p50 {stats['lateness_p50_ms']:.2f} / p99 {stats['lateness_p99_ms']:.2f} / "
+            f"max {stats['lateness_max_ms']:.2f} ms; jitter p50 {stats['jitter_p50_ms']:.2f} / "
+            f"p99 {stats['jitter_p99_ms']:.2f} ms")
+
+
+class TrajectoryStreamer:
+    """
+    Plays trajectories on an arm at the rate they were recorded at.
+
+    Args:
+        arm (XArmAPI): Connected arm (or fake_xarm.FakeXArmAPI).
+        frequency (float): Rate of the recording, in Hz.
+        mode (str): "position" or "servo", see the module docstring.
+        speed, mvacc, radius: Passed to set_servo_angle in position mode (and for the move to the
+            first point in servo mode), if not None.
+        drop_late (bool): Drop the points that are overdue when a later one is due too.
+        spin_s (float): Last part of each wait that is busy-waited, for precise deadlines.
+        check_every (int): Points between two calls of should_continue.
+        should_continue (callable): Health check of the arm, e.g. RobotMain.is_alive; the playback
+            stops when it returns False. Checked every few points, not before every point, as it
+            queries the arm.
+        settle_s (float): Pause after switching to servo mode.
+    """
+
+    def __init__(self, arm, frequency, mode='position', speed=None, mvacc=None, radius=None, drop_late=True,
+                 spin_s=0.002, check_every=25, should_continue=None, settle_s=0.1):
+        if mode not in ('position', 'servo'):
+            raise ValueError(f"Unknown mode {mode!r}, expected 'position' or 'servo'")
+        self.arm = arm
+        self.frequency = frequency
+        self.mode = mode
+        self.drop_late = drop_late
+        self.spin_s = spin_s
+        self.check_every = check_every
+        self.should_continue = should_continue
+        self.settle_s = settle_s
+        self._position_kwargs = {key: value for key, value in dict(speed=speed, mvacc=mvacc, radius=radius).items()
+                                 if value is not None}
+
+    def _send(self, point):
+        if self.mode == 'servo':
+            return self.arm.set_servo_angle_j(angles=point, is_radian=True)
+        return self.arm.set_servo_angle(angle=point, wait=False, is_radian=True, **self._position_kwargs)
+
+    def _enter_servo_mode(self, first_point):
+        # Servo commands are executed right away, so the stream has to start where the arm is
+        code = self.arm.set_servo_angle(angle=first_point, wait=True, is_radian=True, **self._position_kwargs)
+        if code == 0:
+            self.arm.set_mode(SERVO_MODE)
+            self.arm.set_state(0)
+            time.sleep(self.settle_s)
+        return code
+
+    def _leave_servo_mode(self):
+        self.arm.set_mode(POSITION_MODE)
+        self.arm.set_state(0)
+
+    def stream(self, trajectory):
+        """
+        Plays a trajectory, each point at its deadline.
+
+        Args:
+            trajectory (array-like): (N, 7) joint angles in radians, one row per step.
+
+        Returns:
+            dict: playback_stats, plus the "error_code" of the command that failed (0 if none)
+            and whether should_continue "stopped" the playback.
+        """
+        points = np.asarray(trajectory, dtype=np.float64).tolist()
+        if not points:
+            raise ValueError("The trajectory has no points")
+        period = 1.0 / self.frequency
+        error_code, stopped = 0, False
+        send_times, indices = [], []
+
+        if self.mode == 'servo':
+            error_code = self._enter_servo_mode(points[0])
+        start = time.perf_counter()
+        try:
+            i = 0
+            while i < len(points) and error_code == 0:
+                sleep_until(start + i * period, self.spin_s)
+                now = time.perf_counter()
+                if self.drop_late:
+                    # The latest point whose deadline has passed; the ones before it are dropped
+                    due = min(len(points) - 1, int((now - start) / period))
+                    i = max(i, due)
+                error_code = self._send(points[i])
+                send_times.append(now)
+                indices.append(i)
+                i += 1
+                if self.should_continue is not None and len(send_times) % self.check_every == 0 \
+                        and not self.should_continue():
+                    stopped = True
+                    break
+        finally:
+            if self.mode == 'servo':
+                self._leave_servo_mode()
+
+        stats = playback_stats(send_times, indices, start, self.frequency, len(points))
+        stats.update(error_code=error_code, stopped=stopped)
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traj_file')
+    parser.add_argument('--ip', default='192.168.1.209', help="IP of the robot, unless --fake")
+    parser.add_argument('--fake', action='store_true', help="play on the offline stand-in arm (fake_xarm.py)")
+    parser.add_argument('--latency-ms', type=float, default=1.0, help="duration of a command of the fake arm")
+    parser.add_argument('--jitter-ms', type=float, default=0.5, help="random extra duration of a fake command")
+    parser.add_argument('--mode', choices=['position', 'servo'], default='position')
+    parser.add_argument('--keep-late', action='store_true', help="send every point, even when behind schedule")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fake_xarm import FakeXArmAPI
+        arm = FakeXArmAPI(args.ip, latency_s=args.latency_ms / 1000, jitter_s=args.jitter_ms / 1000)
+    else:
+        from xarm.wrapper import XArmAPI
+        arm = XArmAPI(args.ip)
+        arm.motion_enable(True)
+        arm.set_mode(POSITION_MODE)
+        arm.set_state(0)
+        arm.clean_warn()
+        arm.clean_error()
+
+    trajectory, frequency = load_trajectory(args.traj_file)
+    streamer = TrajectoryStreamer(arm, frequency, mode=args.mode, drop_late=not args.keep_late)
+    print(format_stats(streamer.stream(trajectory)))
+    arm.disconnect()
+
+
+if __name__ == '__main__':
+    main()
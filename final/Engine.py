@@ -1,79 +1,288 @@
 import os
-import ast
+import json
+import time
+import logging
 import datetime
+import threading
+import contextvars
+import queue
+import concurrent.futures
 import pandas as pd
-import matplotlib.pyplot as plt
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, Float, text
+from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, Float, text, inspect
 from langchain_community.utilities import SQLDatabase
 from langchain_openai import ChatOpenAI  # Use ChatOpenAI for chat models
 from langchain_community.agent_toolkits import create_sql_agent
+from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX
+from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
+from langchain_core.prompts import PromptTemplate
 from sqlalchemy import DateTime
 from openai import OpenAI
 from langchain.schema import HumanMessage, AIMessage  # Use HumanMessage instead of UserMessage
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, send_file, abort
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from flask_cors import CORS
+from loader import discover_sources, load_incremental, loaded_tables, table_version, READINGS_TABLE
+from response_cache import ResponseCache
+from query_planner import plan_query, plan_cross_room, is_cross_room, run_plan
+from charts import chart_spec, render_line_chart, find_time_column
+from chart_store import ChartStore
+from downsample import downsample_dataframe
+from sql_capture import CapturingSQLDatabase, build_result_frame
+from air_quality import band_distribution
+from columnar import columnar_store_from_env
+from llm_clients import get_chat_llm, get_openai_client
+from metrics import (timed, request_trace, submit_in_context, observe_sql, observe_llm_usage,
+                     MetricsCallbackHandler, REQUESTS)
 app = Flask(__name__)
 CORS(app)
 
+# Paths of the files the engine state is derived from.
+OPENAI_KEY_PATH = './final/oaikey.txt'
+DATABASE_URI = 'sqlite:///./DataBase/CareConnect.db'
+ROOMS_DIR = 'final/data/rooms'
+ROOFTOP_FILE = 'final/data/roof/pivoted_data.csv'
+CHART_DIR = './final/saved_imgs/charts'
+DOWNSAMPLE_POINTS = int(os.environ.get('DOWNSAMPLE_POINTS', 2000))
+
+# Per-stage timeouts (seconds) of the description and chart stages that follow the query
+DESCRIPTION_TIMEOUT = float(os.environ.get('DESCRIPTION_TIMEOUT', 30))
+CHART_TIMEOUT = float(os.environ.get('CHART_TIMEOUT', 20))
+# Optional columnar copy of the tables (STORAGE_BACKEND=columnar), serving the series and latest fast paths.
+# It is synced after each load and in the background, never on a request.
+COLUMNAR_STORE = columnar_store_from_env()
+
 def load_openai_key():
-    with open('./final/oaikey.txt') as keyfile:
+    with open(OPENAI_KEY_PATH) as keyfile:
         oaikey = keyfile.read().strip()
     os.environ["OPENAI_API_KEY"] = oaikey
     return oaikey
 
 # Step 2: Create an SQLite database and load CSV data
-def create_and_load_database():
-    # Set up SQLite in memory
-    engine = create_engine('sqlite:///./DataBase/CareConnect.db')  # This will create the SQLite DB in the desired location
-    metadata_obj = MetaData()
-
-    # Define table schema for rooms with DateTime for timestamp
-    room_tables = {
-        'room_QRITA': 'final/data/rooms/airQRITA.csv',
-        'room_QFOYER': 'final/data/rooms/airQFOYER.csv',
-        'room_QDORO': 'final/data/rooms/airQDORO.csv',
-        'room_QHANS': 'final/data/rooms/airQHANS.csv',
-        'room_QMOMO': 'final/data/rooms/airQMOMO.csv',
-        'room_QROB': 'final/data/rooms/airQROB.csv'
-    }
-
-    # Load room data into SQLite
-    for room, file_path in room_tables.items():
-        room_table = Table(
-            room, metadata_obj,
-            Column('timestamp', DateTime, primary_key=True),  # Use DateTime instead of String
-            autoload_with=engine
-        )
-        metadata_obj.create_all(engine)
-        
-        # Load data from CSV and convert timestamp to DateTime
-        df_room = pd.read_csv(file_path)
-        df_room['timestamp'] = pd.to_datetime(df_room['timestamp'], unit='ms')  # Convert to datetime
+def create_and_load_database(engine=None, columnar_store=None):
+    # Set up SQLite, reusing the engine (and its connection pool) when one is given
+    if engine is None:
+        engine = create_engine(DATABASE_URI)  # This will create the SQLite DB in the desired location
 
-        # Save to the SQLite database
-        df_room.to_sql(room, con=engine, if_exists='replace', index=False)
+    # Append only the rows added to the room and rooftop CSVs since the previous load
+    load_report = load_incremental(engine, discover_sources(ROOMS_DIR, ROOFTOP_FILE))
 
-    # Load rooftop data into SQLite
-    rooftop_file = 'final/data/roof/pivoted_data.csv'
-    df_rooftop = pd.read_csv(rooftop_file)
-    df_rooftop['timestamp'] = pd.to_datetime(df_rooftop['timestamp'], unit='s')  # Convert to datetime
-    df_rooftop.to_sql('rooftop', con=engine, if_exists='replace', index=False)
+    # Then copy the new rows of every table into the columnar store, if there is one
+    if columnar_store is not None:
+        load_report["columnar"] = columnar_store.sync_tables(engine, loaded_tables(engine))
 
-    return engine
+    return engine, load_report
 
 def setup_langchain_sql_database(engine):
-    # Use ChatOpenAI for chat-based models
-    llm = ChatOpenAI(temperature=0.1, model="gpt-4o-mini")
+    # Use ChatOpenAI for chat-based models (shared, with a pooled HTTP client)
+    llm = get_chat_llm(model="gpt-4o-mini", temperature=0.1)
 
-    # Define the SQLDatabase to include all room tables and rooftop
-    sql_database = SQLDatabase(engine, include_tables=[
-        "room_QRITA", "room_QFOYER", "room_QDORO", "room_QHANS", "room_QMOMO", "room_QROB", "rooftop"
-    ])
+    # Define the SQLDatabase to include all loaded room tables and rooftop
+    # The capturing variant keeps the rows of the agent's queries for the visualization stage
+    sql_database = CapturingSQLDatabase(engine, include_tables=loaded_tables(engine))
 
     return llm, sql_database
 
 
-def query_room(room_choice, input_query, agent_executor, timestep_request=''):
+# Prompt of the room-scoped agents. The schema and sample rows of the room's table are part of
+# the prompt, so the agent writes its query right away instead of listing tables and fetching schemas.
+ROOM_AGENT_PROMPT = "\n\n".join([
+    SQL_PREFIX + """
+The question is about the {table_names} table. Its schema and a few sample rows are:
+
+{table_info}
+
+For averages, minimums and maximums over long periods, the rollup tables readings_5m, readings_1h and readings_1d \
+are much faster than the table above. Each row holds one 5-minute, hourly or daily bucket of one metric of one table: \
+source (the table name, e.g. rooftop or room_QRITA), metric (the column name), bucket_ms (bucket start, Unix epoch \
+milliseconds), value_count, value_sum, value_min, value_max. An average is SUM(value_sum) / SUM(value_count).""",
+    "{tools}",
+    FORMAT_INSTRUCTIONS,
+    """Begin!
+
+Question: {input}
+Thought: The schema of the {table_names} table is given above, so I can write the query directly.
+{agent_scratchpad}"""
+])
+
+
+def setup_room_agents(llm, engine, tables):
+    """
+    Builds one SQL agent per table, each seeing only its own table.
+
+    The schema and sample rows of the table are fetched once here and filled into the prompt;
+    since the prompt has them, create_sql_agent leaves out the list-tables and schema tools.
+
+    Args:
+        llm (object): The LLM of the agents.
+        engine (Engine): The SQLAlchemy engine.
+        tables (list): Tables to build an agent for.
+
+    Returns:
+        dict: table -> (agent executor, the CapturingSQLDatabase it queries through).
+    """
+    room_agents = {}
+    for table in tables:
+        sql_database = CapturingSQLDatabase(engine, include_tables=[table], sample_rows_in_table_info=3)
+        agent_executor = create_sql_agent(llm, db=sql_database, verbose=True,
+                                          prompt=PromptTemplate.from_template(ROOM_AGENT_PROMPT))
+        room_agents[table] = (agent_executor, sql_database)
+    return room_agents
+
+
+def _files_fingerprint(paths):
+    """
+    Builds a cheap fingerprint of a set of files from their size and modification time.
+
+    Args:
+        paths (list): Paths of the files to fingerprint. Missing files are recorded as None.
+
+    Returns:
+        tuple: One (path, mtime_ns, size) entry per file.
+    """
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+
+def _schema_version(engine):
+    # SQLite bumps the schema version whenever a table is created or altered
+    with engine.connect() as conn:
+        return conn.execute(text('PRAGMA schema_version')).scalar()
+
+
+class EngineState:
+    """
+    Application-scoped state shared by all requests: the SQLAlchemy engine, the LangChain
+    SQLDatabase (schema metadata), the LLM client and the SQL agent executors, one scoped
+    to each table plus one over all tables.
+
+    Everything is built once on the first refresh. Later refreshes only compare the
+    fingerprints of the OpenAI key file and of the CSV sources: new rows are appended to
+    the database, and the SQLDatabase and agent are rebuilt only when the key or the
+    table schemas change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config_fingerprint = None
+        self._data_fingerprint = None
+        self._schema_version = None
+        self.oaikey = None
+        self.engine = None
+        self.llm = None
+        self.sql_database = None
+        self.agent_executor = None
+        self.room_agents = {}
+        self.table_columns = {}
+
+    def refresh(self):
+        """
+        Makes sure the state reflects the current key file and data files.
+
+        Returns:
+            EngineState: The state itself, ready to serve a request.
+        """
+        config_fingerprint = _files_fingerprint([OPENAI_KEY_PATH])
+        sources = discover_sources(ROOMS_DIR, ROOFTOP_FILE)
+        data_fingerprint = _files_fingerprint([file_path for file_path, _ in sources.values()])
+        if self.engine is not None:
+            # Tables can also be created or altered by the rooms MQTT client writing to the database directly
+            data_fingerprint += (_schema_version(self.engine),)
+        if config_fingerprint == self._config_fingerprint and data_fingerprint == self._data_fingerprint:
+            return self
+
+        with self._lock:
+            config_changed = config_fingerprint != self._config_fingerprint
+            data_changed = data_fingerprint != self._data_fingerprint
+
+            if config_changed:
+                self.oaikey = load_openai_key()
+
+            if data_changed:
+                with timed("load_database"):
+                    self.engine, _ = create_and_load_database(self.engine, COLUMNAR_STORE)
+                if COLUMNAR_STORE is not None:
+                    # Picks up the rows the rooms MQTT client writes to the database between two loads
+                    engine = self.engine
+                    COLUMNAR_STORE.start_background_sync(
+                        engine, lambda: loaded_tables(engine),
+                        float(os.environ.get('COLUMNAR_SYNC_INTERVAL', 60)))
+            schema_version = _schema_version(self.engine)
+
+            if config_changed or schema_version != self._schema_version:
+                # New rows are appended in place; the schema metadata and the agent only change with the tables.
+                llm, sql_database = setup_langchain_sql_database(self.engine)
+                self.agent_executor = create_sql_agent(llm, db=sql_database, verbose=True)
+                self.llm, self.sql_database = llm, sql_database
+                self._schema_version = schema_version
+                # Column names per table, for the templated fast path
+                inspector = inspect(self.engine)
+                self.table_columns = {
+                    table: [column['name'] for column in inspector.get_columns(table)]
+                    for table in sql_database.get_usable_table_names()
+                }
+                # Agents that only see the table of the room asked about, and one for questions across rooms
+                self.room_agents = setup_room_agents(llm, self.engine, list(self.table_columns) + [READINGS_TABLE])
+
+            self._config_fingerprint = config_fingerprint
+            self._data_fingerprint = data_fingerprint
+
+        return self
+
+    def agent_for(self, table):
+        """
+        Returns the (agent executor, SQLDatabase) pair scoped to the table, or the one over
+        all tables if the table has no data yet.
+        """
+        return self.room_agents.get(table, (self.agent_executor, self.sql_database))
+
+
+# Process-wide engine state, built at startup and reused by every request.
+engine_state = EngineState()
+
+# Threads running the post-query stages (description and chart) side by side.
+post_query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='post-query')
+
+# Threads running the queries of streamed requests, kept apart from the post-query stages so
+# long agent runs never hold up stages whose timeouts are already running.
+stream_query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='stream-query')
+
+# Rendered charts, addressed by a hash of their data and spec and served on /images/<chart_id>.
+chart_store = ChartStore(CHART_DIR, max_bytes=int(os.environ.get('CHART_STORE_BYTES', 64 * 1024 * 1024)))
+
+# Responses to repeated questions, keyed on the data version of the room's table.
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_BYTES', 8 * 1024 * 1024)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+)
+
+
+def room_table(room_choice):
+    """
+    Maps a room choice of the frontend (e.g. "RITA", "ROOF") to its table (e.g. "room_QRITA", "rooftop").
+    """
+    if room_choice == 'ROOF':
+        return 'rooftop'
+    return 'room_Q' + room_choice
+
+
+def question_table(room_choice, input_query):
+    """
+    Table a question is answered from: the long-format readings table for questions across
+    rooms, the selected room's table otherwise.
+    """
+    if is_cross_room(input_query):
+        return READINGS_TABLE
+    return room_table(room_choice)
+
+
+def query_room(room_choice, input_query, agent_executor, timestep_request='', callbacks=None):
     """
     Queries a specific room using the provided input query and an optional timestep request.
     
@@ -82,6 +291,7 @@ def query_room(room_choice, input_query, agent_executor, timestep_request=''):
         input_query (str): The base query input string.
         agent_executor (obj): The LangChain agent executor object.
         timestep_request (str, optional): Additional query modifier (e.g., 'Please include the corresponding timestamps'). Defaults to an empty string.
+        callbacks (list, optional): LangChain callback handlers of the agent run.
     
     Returns:
         str: The query result or an error message if the data is not present.
@@ -95,88 +305,162 @@ def query_room(room_choice, input_query, agent_executor, timestep_request=''):
         input_query += f" {timestep_request}"
     
     # Execute the query using the agent executor
-    query_result = agent_executor.invoke({"input": input_query})
+    query_result = agent_executor.invoke({"input": input_query}, config={"callbacks": callbacks or []})
     
     # Handle cases where the result is empty
     return query_result
 
 
-def check_response_type(response_str):
-    try:
-        # Try converting the string to a Python object
-        response_obj = ast.literal_eval(response_str)
-        
-        # Check if it's a list
-        if isinstance(response_obj, list):
-            return "list"
-        else:
-            return "string"
-    except (ValueError, SyntaxError):
-        return "string"
-
-def build_dataframe_from_response(response_str):
-    
-    try:
-        # Convert the string to a Python object (list of tuples)
-        data = ast.literal_eval(response_str)
-        
-        # Extract column names from the first tuple
-        columns = data[0]
-        
-        # Extract the actual data (excluding the first tuple with column names)
-        data_values = data[1:]
-        
-        # Create a pandas DataFrame
-        df = pd.DataFrame(data_values, columns=columns)
-        
-        return df
-    except (ValueError, SyntaxError):
-        return "Invalid response format."
-    
-def generate_img_visualization(df_img_visualization, oaikey, input_query):
-    client = OpenAI(api_key=oaikey)
+def plan_answer(state, room_choice, input_query, timestep_request=''):
+    """
+    Returns the templated SQL plan of a formulaic question (an aggregate of one known column over
+    a relative time window, in the selected room or across all rooms), or None if the question
+    has to go to the SQL agent.
+    """
+    table = question_table(room_choice, input_query)
+    if table == READINGS_TABLE:
+        metrics = {column for columns in state.table_columns.values() for column in columns}
+        return plan_cross_room(input_query, metrics)
+    if table not in state.table_columns:
+        return None
+    return plan_query(input_query, table, state.table_columns[table], wants_series=bool(timestep_request))
+
+
+def execute_answer(state, room_choice, input_query, plan, timestep_request='', on_sql_executed=None):
+    """
+    Runs the plan returned by plan_answer, or the SQL agent through query_room if there is none.
+
+    Args:
+        on_sql_executed (callable, optional): Called with {"sql", "rows"} each time a query has run.
+
+    Returns:
+        tuple: (query result with the 'output' answer and the result rows as a 'frame' DataFrame (or None),
+        name of the path that served it: "fast_path" or "agent")
+    """
+    if plan is not None:
+        start = time.perf_counter()
+        with timed("fast_path"):
+            query_result = run_plan(state.engine, plan, input_query, store=COLUMNAR_STORE)
+        observe_sql(time.perf_counter() - start, len(query_result["rows"]))
+        query_result["frame"] = build_result_frame(query_result["columns"], query_result["rows"])
+        if on_sql_executed is not None:
+            on_sql_executed({"sql": query_result["sql"], "rows": len(query_result["rows"])})
+        return query_result, "fast_path"
+
+    on_execute = None
+    if on_sql_executed is not None:
+        on_execute = lambda captured: on_sql_executed({"sql": captured["sql"], "rows": len(captured["rows"])})
+    agent_executor, sql_database = state.agent_for(question_table(room_choice, input_query))
+    # Keep the rows of the last SQL query the agent runs, so they never have to be parsed back from its answer
+    with sql_database.capture(on_execute) as captured, timed("agent"):
+        query_result = query_room(room_choice, input_query, agent_executor, timestep_request,
+                                  callbacks=[MetricsCallbackHandler("agent")])
+    query_result["sql"] = captured["sql"]
+    query_result["frame"] = build_result_frame(captured["columns"], captured["rows"])
+    return query_result, "agent"
+
+
+def answer_query(state, room_choice, input_query, timestep_request=''):
+    """
+    Answers formulaic questions with templated SQL, and hands everything else to the SQL agent.
+
+    Returns:
+        tuple: (query result with the 'output' answer and the result rows as a 'frame' DataFrame (or None),
+        name of the path that served it: "fast_path" or "agent")
+    """
+    plan = plan_answer(state, room_choice, input_query, timestep_request)
+    return execute_answer(state, room_choice, input_query, plan, timestep_request)
+
+
+def summarize_result(output, df_result):
+    """
+    Compact summary of the result rows for the describer: the agent's answer, the number of rows,
+    the time range, min/mean/max of each numeric column and the share of the rows in each air-quality
+    band of measurement_ranges.csv, instead of the full table.
+    """
+    summary = [output, f"Rows returned: {len(df_result)}."]
+    time_column = find_time_column(df_result)
+    if time_column is not None:
+        summary.append(f"Time range: {df_result[time_column].min()} to {df_result[time_column].max()}.")
+    for column in df_result.columns:
+        if column != time_column and pd.api.types.is_numeric_dtype(df_result[column]):
+            values = df_result[column]
+            summary.append(f"{column}: min {values.min():.2f}, mean {values.mean():.2f}, max {values.max():.2f}.")
+    bands = band_distribution(df_result)
+    if bands:
+        summary.append("Air-quality bands (share of the rows): " + ' '.join(bands))
+    return '\n'.join(summary)
+
+
+def generate_chart_style_hints(df_img_visualization, oaikey, input_query):
+    """
+    Optionally asks the LLM for styling hints (title, y-axis label, line color) for the chart.
+    Only the question and the column names are sent; the hints never contain code.
+
+    Returns:
+        dict: The hints, or an empty dict if they are disabled or unusable.
+    """
+    if os.environ.get('CHART_STYLE_HINTS', 'off') != 'llm':
+        return {}
+
+    client = get_openai_client(oaikey)
     chat_completion = client.chat.completions.create(
         model='gpt-4o-mini',
-        messages=[{'role': 'user', 
-                   'content': f'Here it is the user query: {input_query}.'
-                              'Generate python code that prints a line chart of the full data. '
-                              'The chart should include timestamp on the x axis and the other value on the y-axis. '
-                              f'For the data use the following dataframe: {df_img_visualization}. '
-                              'Only print the python code. Do not include comments. '
-                              'Do not output any other text before or after the code.'}]
+        messages=[{'role': 'user',
+                   'content': f'Here it is the user query: {input_query}. '
+                              f'A line chart will show the columns {list(df_img_visualization.columns)}. '
+                              'Reply only with a JSON object with the keys "title", "y_label" and "color" '
+                              '(a matplotlib color name).'}],
+        response_format={'type': 'json_object'}
     )
-    
-    code = chat_completion.choices[0].message.content[9:-3]
-    
-    # Disable interactive mode to prevent GUI pop-up
-    plt.ioff()
-
-    # Get the current timestamp and format it
-    current_time = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    img_path = f"./final/saved_imgs/img_{current_time}.png"
-    
-    # Modify the generated code to save the plot and prevent using plt.show()
-    code = code.replace('plt.show()', f"plt.savefig('{img_path}')")
-    
+    if chat_completion.usage is not None:
+        observe_llm_usage("chart_style", chat_completion.usage.prompt_tokens, chat_completion.usage.completion_tokens)
     try:
-        # Execute the modified code
-        exec(code)
-    except Exception as e:
-        print(f"Error executing generated code: {e}")
+        hints = json.loads(chat_completion.choices[0].message.content)
+    except (ValueError, TypeError):
+        return {}
+    return hints if isinstance(hints, dict) else {}
+
+
+def render_line_chart_timed(df, spec, img_path):
+    # Only actual renders are timed as chart_render; charts found in the store are not rendered again
+    with timed("chart_render"):
+        return render_line_chart(df, spec, img_path)
+
+
+def generate_img_visualization(df_img_visualization, oaikey, input_query):
+    with timed("chart"):
+        return _generate_img_visualization(df_img_visualization, oaikey, input_query)
+
+
+def _generate_img_visualization(df_img_visualization, oaikey, input_query):
+    if not isinstance(df_img_visualization, pd.DataFrame) or df_img_visualization.empty:
         return None
 
-    return img_path
+    # Time column on the x axis, numeric columns on the y axis
+    spec = chart_spec(df_img_visualization, input_query, generate_chart_style_hints(df_img_visualization, oaikey, input_query))
+    if spec is None:
+        return None
+
+    # Identical data and spec map to the same stored chart, which is then not rendered again.
+    # A failed render raises, so it is reported as a chart stage error.
+    chart_id = chart_store.get_or_render(df_img_visualization, spec, render_line_chart_timed)
+
+    # URL of the chart on this server, so the frontend does not need access to our filesystem
+    return f"/images/{chart_id}"
 
 
 class DescriberAgent:
-    def __init__(self, llm):
+    def __init__(self, llm, callbacks=None):
         """
         Initialize the describer agent with an LLM instance.
         
         Args:
             llm (object): The LLM object (e.g., ChatOpenAI) used for generating descriptions.
+            callbacks (list, optional): LangChain callback handlers of the LLM calls.
         """
         self.llm = llm
+        self.callbacks = callbacks or []
     
     def invoke(self, prompt_data):
         """
@@ -195,30 +479,28 @@ class DescriberAgent:
         message = [HumanMessage(content=prompt)]
 
         # Generate the response using the LLM
-        response = self.llm.invoke(input=message)  # Using the correct method `invoke`
-        print(response.content) 
+        response = self.llm.invoke(input=message, config={"callbacks": self.callbacks})  # Using the correct method `invoke`
         return response.content
-    
-def generate_dynamic_description(input_query, output):
-    """
-    Generates a description of the upcoming visualization by feeding the input and output to an LLM,
-    based on a predefined schema for the description.
-    
-    Args:
-        input_query (str): The original query made by the user.
-        output (str): The response generated from the query.
-    
-    Returns:
-        str: A dynamically generated explanation of what the image visualization will represent,
-        following the predefined schema.
-    """
-    
-    # Set up the LLM (e.g., OpenAI or ChatOpenAI)
-    llm = ChatOpenAI(temperature=0.1, model="gpt-4o-mini")
 
-    # Create an instance of the describer_agent
-    describer_agent = DescriberAgent(llm)
+    def stream(self, prompt_data):
+        """
+        Like invoke, but yields the description piece by piece as the LLM generates it.
+
+        Args:
+            prompt_data (dict): Dictionary containing the input prompt with the key 'input'.
 
+        Yields:
+            str: The next chunk of the description.
+        """
+        message = [HumanMessage(content=prompt_data["input"])]
+        for chunk in self.llm.stream(input=message, config={"callbacks": self.callbacks}):
+            if chunk.content:
+                yield chunk.content
+
+def description_prompt(input_query, output):
+    """
+    Builds the describer prompt for the output obtained from the input query.
+    """
     # Predefined schema for the description
     schema = """
     Please generate a description for the upcoming visualization following this structure:
@@ -227,13 +509,14 @@ def generate_dynamic_description(input_query, output):
     2. **X-Axis Description**: Explain what the X-axis represents.
     3. **Y-Axis Description**: Explain what the Y-axis represents.
     4. **Key Metrics/Trends**: Mention any important metrics or trends that might be visualized.
-    5. **Insights**: Provide potential insights or conclusions that can be drawn from the data visualization.
+    5. **Data Analysis**: If the output lists air-quality bands (Hazardous, Unhealthy, Moderate, Good, Excellent), provide some insights on them, always related to the Hospital.
+    6. **Insights**: Provide potential insights or conclusions that can be drawn from the data visualization.
     
     Use concise language and focus on what the user will be able to learn from this visualization.
     """
 
     # Create the prompt for the LLM to explain what the output represents, using the schema
-    prompt = f"""
+    return f"""
     You are in charge of describing the output obtained from the following input query.
     
     Input query: {input_query}
@@ -242,12 +525,43 @@ def generate_dynamic_description(input_query, output):
     {schema}
     """
 
-    # Use the describer_agent to generate the description
-    explanation = describer_agent.invoke({"input": prompt})
-    print(explanation)
+def generate_dynamic_description(input_query, output):
+    """
+    Generates a description of the upcoming visualization by feeding the input and output to an LLM,
+    based on a predefined schema for the description.
+    
+    Args:
+        input_query (str): The original query made by the user.
+        output (str): The response generated from the query.
     
+    Returns:
+        str: A dynamically generated explanation of what the image visualization will represent,
+        following the predefined schema.
+    """
+    
+    # Reuse the process-wide LLM (e.g., OpenAI or ChatOpenAI) and its connections
+    llm = get_chat_llm(model="gpt-4o-mini", temperature=0.1)
+
+    # Create an instance of the describer_agent
+    describer_agent = DescriberAgent(llm, callbacks=[MetricsCallbackHandler("describer")])
+
+    # Use the describer_agent to generate the description
+    with timed("description"):
+        explanation = describer_agent.invoke({"input": description_prompt(input_query, output)})
+
     return explanation
 
+def stream_dynamic_description(input_query, output):
+    """
+    Streaming variant of generate_dynamic_description.
+
+    Yields:
+        str: The next chunk of the description, as soon as the LLM produces it.
+    """
+    llm = get_chat_llm(model="gpt-4o-mini", temperature=0.1)
+    yield from DescriberAgent(llm, callbacks=[MetricsCallbackHandler("describer")]).stream(
+        {"input": description_prompt(input_query, output)})
+
 def check_for_visual_content(user_message: str):
     """
     Checks if the user message contains keywords related to visual content.
@@ -269,54 +583,273 @@ def check_for_visual_content(user_message: str):
         return True
     return False
 
-# Main function to tie everything together
-def main(room_choice, input_query):
-    ##### 1: Set up OpenAI API key. #####
-    oaikey = load_openai_key()
+def run_post_query_stages(input_query, output, result_summary, df_plot, oaikey):
+    """
+    Runs the description and the chart generation concurrently, each with its own timeout.
 
-    ##### 2: Create an SQLite database and load CSV data. #####
-    engine = create_and_load_database()
+    If a stage raises or runs out of time, the response still comes back with what the other stage
+    produced: the agent's own answer instead of the description, or no image instead of the chart.
+    Such responses are flagged with "partial" and list the failed stages in "stage_errors".
 
-    ##### 3: Define the SQLDatabase in LangChain. #####
-    llm, sql_database = setup_langchain_sql_database(engine)
+    Returns:
+        dict: The /get_data response.
+    """
+    started = time.monotonic()
+    description_future = submit_in_context(post_query_executor, generate_dynamic_description, input_query, result_summary)
+    chart_future = submit_in_context(post_query_executor, generate_img_visualization, df_plot, oaikey, input_query)
+
+    stage_errors = {}
+
+    def stage_result(name, future, timeout):
+        # Both stages started together, so each timeout is measured from the common start
+        try:
+            return future.result(timeout=max(0.0, timeout - (time.monotonic() - started)))
+        except concurrent.futures.TimeoutError:
+            stage_errors[name] = f"timed out after {timeout:g}s"
+        except Exception as e:
+            stage_errors[name] = str(e)
+        return None
 
-    ##### 4: Creating the Agent Executor llm (ChatOpenAI) for chat-based models. #####
-    agent_executor = create_sql_agent(llm, db=sql_database, verbose=True)
+    description = stage_result("description", description_future, DESCRIPTION_TIMEOUT)
+    # None without an error means there was nothing to plot, which is not a failure
+    image_path = stage_result("chart", chart_future, CHART_TIMEOUT)
 
-    ##### 5: Querying the Agent Executor llm (ChatOpenAI). #####
-    timestep_request = 'Please include together also the corresponding timestamps and format the response as a list of tuples. The first tuple should contain the name of the columns we are returning.'
-    
-    # 5.5: ROOF Air Temperature data.
-    if(check_for_visual_content(input_query)):
-        query_result = query_room(room_choice, input_query, agent_executor, timestep_request)
-    else:
-        query_result = query_room(room_choice, input_query, agent_executor)
+    response = {
+        "response_message": description if description is not None else output,
+        "includes_image": image_path is not None,
+        "image_path": image_path if image_path is not None else False
+    }
+    if stage_errors:
+        logging.warning(f"Post-query stages incomplete: {stage_errors}")
+        response["partial"] = True
+        response["stage_errors"] = stage_errors
+    return response
 
+def cached_response(state, room_choice, input_query):
+    """
+    Looks the question up in the response cache, keyed on the current version of the room's table.
 
+    Returns:
+        tuple: (table, table version, the cached response or None)
+    """
+    table = question_table(room_choice, input_query)
+    version = table_version(state.engine, table)
+    cached = response_cache.get(input_query, room_choice, table, version)
+    # A cached chart may have been evicted from the chart store since
+    if cached is not None and cached["includes_image"] and not chart_store.path(cached["image_path"].rsplit('/', 1)[-1]):
+        cached = None
+    return table, version, cached
 
-    
-    response_type = check_response_type(query_result['output'])
 
-    if response_type == 'list':
-        response = {
-            "response_message": generate_dynamic_description(input_query, query_result['output']),
-            "includes_image": True,
-            "image_path": generate_img_visualization(build_dataframe_from_response(query_result['output']), oaikey, input_query)
-        }
-    elif response_type == 'string':
+def timestep_request_for(input_query):
+    """
+    Returns the instruction appended to questions asking for something visual, or '' for the others.
+    """
+    if check_for_visual_content(input_query):
+        return 'Please include together also the corresponding timestamps in the SQL query. The rows are charted for the user separately, so answer with a short prose summary instead of listing them.'
+    return ''
+
+
+def is_chartable(df_result):
+    """
+    A time series of several rows is described and charted; anything else is answered as text.
+    """
+    return df_result is not None and len(df_result) > 1 and find_time_column(df_result) is not None
+
+
+# Main function to tie everything together
+def main(room_choice, input_query, include_timings=False):
+    """
+    Answers a question about a room.
+
+    Args:
+        room_choice (str): The room (e.g. "RITA", "ROOF").
+        input_query (str): The question.
+        include_timings (bool): Add the time spent per stage and the SQL/LLM/agent counts
+            of this request to the response, under "timings".
+
+    Returns:
+        dict: The /get_data response.
+    """
+    with request_trace() as trace:
+        with timed("total"):
+            response = answer(room_choice, input_query)
+        REQUESTS.labels(response["served_by"]).inc()
+    if include_timings:
+        # A copy, so the breakdown never ends up in the response cache
+        response = dict(response, timings=trace)
+    return response
+
+
+def answer(room_choice, input_query):
+    ##### 1-4: Reuse the shared key, database, SQLDatabase and Agent Executor (rebuilt only on changes). #####
+    with timed("refresh"):
+        state = engine_state.refresh()
+    oaikey = state.oaikey
+
+    # Serve repeated questions from the cache while the room's table has no new rows
+    with timed("cache_lookup"):
+        table, version, cached = cached_response(state, room_choice, input_query)
+    if cached is not None:
+        cached["served_by"] = "cache"
+        return cached
+
+    ##### 5: Querying the Agent Executor llm (ChatOpenAI). #####
+    query_result, served_by = answer_query(state, room_choice, input_query, timestep_request_for(input_query))
+
+    df_result = query_result["frame"]
+    if is_chartable(df_result):
+        # Long series are reduced to the points that shape the line before they are plotted
+        with timed("downsample"):
+            df_plot = downsample_dataframe(df_result, DOWNSAMPLE_POINTS)
+        response = run_post_query_stages(input_query, query_result['output'], summarize_result(query_result['output'], df_result), df_plot, oaikey)
+    else:
         response = {
-            "response_message": query_result['output'],        
+            "response_message": query_result['output'],
             "includes_image": False,
             "image_path": False
         }
+
+    # Report which path answered the question
+    response["served_by"] = served_by
+
+    # Partial responses (a stage failed or timed out) are retried on the next request rather than cached
+    if not response.get("partial"):
+        response_cache.put(input_query, room_choice, table, version, response)
+    return response
+
+
+def main_events(room_choice, input_query, include_timings=False):
+    """
+    Streaming variant of main: yields (event, data) pairs as the pipeline progresses.
+
+    Events, in order:
+        planned       {"served_by"}: "cache", "fast_path" or "agent" will answer.
+        sql_executed  {"sql", "rows"}: a query has run (the agent may run several).
+        rows_ready    {"rows", "columns", "output"}: the result and the agent's answer.
+        token         {"text"}: the next chunk of the response message.
+        chart         {"includes_image", "image_path"}: sent once the chart is ready.
+        done          the complete response, as returned by /get_data (with "timings" if include_timings).
+    """
+    # The server may resume the stream on a different thread at every event, so each step runs in
+    # the same context to keep the request trace for the whole stream
+    context = contextvars.copy_context()
+    events = traced_answer_events(room_choice, input_query, include_timings)
+    try:
+        while True:
+            item = context.run(next, events, None)
+            if item is None:
+                return
+            yield item
+    finally:
+        context.run(events.close)
+
+
+def traced_answer_events(room_choice, input_query, include_timings):
+    with request_trace() as trace:
+        response = None
+        with timed("total"):
+            for event, data in answer_events(room_choice, input_query):
+                if event == "done":
+                    response = data
+                else:
+                    yield event, data
+        REQUESTS.labels(response["served_by"]).inc()
+    if include_timings:
+        # A copy, so the breakdown never ends up in the response cache
+        response = dict(response, timings=trace)
+    yield "done", response
+
+
+def answer_events(room_choice, input_query):
+    with timed("refresh"):
+        state = engine_state.refresh()
+
+    with timed("cache_lookup"):
+        table, version, cached = cached_response(state, room_choice, input_query)
+    if cached is not None:
+        cached["served_by"] = "cache"
+        yield "planned", {"served_by": "cache"}
+        yield "token", {"text": cached["response_message"]}
+        yield "chart", {"includes_image": cached["includes_image"], "image_path": cached["image_path"]}
+        yield "done", cached
+        return
+
+    timestep_request = timestep_request_for(input_query)
+    plan = plan_answer(state, room_choice, input_query, timestep_request)
+    yield "planned", {"served_by": "fast_path" if plan is not None else "agent"}
+
+    # The query runs on a worker thread, so the SQL progress of the agent can be forwarded while it works
+    events = queue.Queue()
+    query_future = submit_in_context(
+        stream_query_executor, execute_answer, state, room_choice, input_query, plan, timestep_request,
+        lambda executed: events.put(("sql_executed", executed)))
+    while not query_future.done() or not events.empty():
+        try:
+            yield events.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    query_result, served_by = query_future.result()
+
+    df_result = query_result["frame"]
+    yield "rows_ready", {
+        "rows": 0 if df_result is None else len(df_result),
+        "columns": [] if df_result is None else [str(column) for column in df_result.columns],
+        "output": query_result["output"]
+    }
+
+    if not is_chartable(df_result):
+        response = {"response_message": query_result["output"], "includes_image": False, "image_path": False}
+        yield "token", {"text": response["response_message"]}
     else:
+        # The chart renders in the background while the description is streamed
+        started = time.monotonic()
+        with timed("downsample"):
+            df_plot = downsample_dataframe(df_result, DOWNSAMPLE_POINTS)
+        chart_future = submit_in_context(post_query_executor, generate_img_visualization, df_plot, state.oaikey, input_query)
+        stage_errors = {}
+
+        chunks = []
+        # Timed until the last chunk is sent, as the client reads the description while it is generated
+        with timed("description"):
+            try:
+                for chunk in stream_dynamic_description(input_query, summarize_result(query_result['output'], df_result)):
+                    chunks.append(chunk)
+                    yield "token", {"text": chunk}
+                    if time.monotonic() - started > DESCRIPTION_TIMEOUT:
+                        stage_errors["description"] = f"timed out after {DESCRIPTION_TIMEOUT:g}s"
+                        break
+            except Exception as e:
+                stage_errors["description"] = str(e)
+        if not chunks:
+            # Nothing was streamed, so fall back to the agent's own answer
+            yield "token", {"text": query_result["output"]}
+            chunks = [query_result["output"]]
+
+        try:
+            image_path = chart_future.result(timeout=max(0.0, CHART_TIMEOUT - (time.monotonic() - started)))
+        except concurrent.futures.TimeoutError:
+            image_path = None
+            stage_errors["chart"] = f"timed out after {CHART_TIMEOUT:g}s"
+        except Exception as e:
+            image_path = None
+            stage_errors["chart"] = str(e)
+
         response = {
-            "response_message": "Error: Invalid response type",
-            "includes_image": False,
-            "image_path": False
+            "response_message": ''.join(chunks),
+            "includes_image": image_path is not None,
+            "image_path": image_path if image_path is not None else False
         }
-    
-    return response
+        if stage_errors:
+            logging.warning(f"Post-query stages incomplete: {stage_errors}")
+            response["partial"] = True
+            response["stage_errors"] = stage_errors
+    yield "chart", {"includes_image": response["includes_image"], "image_path": response["image_path"]}
+
+    response["served_by"] = served_by
+    if not response.get("partial"):
+        response_cache.put(input_query, room_choice, table, version, response)
+    yield "done", response
 
 app = Flask(__name__)
 
@@ -326,12 +859,53 @@ def get_data():
         # here we want to get the value of user (i.e. ?user=some-value)
         room_choice = request.args.get('room_choice')
         input_query = request.args.get('input_query')
+        # ?timings=1 adds the per-stage timing breakdown of the request to the response
+        include_timings = request.args.get('timings') == '1'
     
-        result = main(room_choice, input_query)
+        result = main(room_choice, input_query, include_timings)
         return jsonify(result)
     except Exception as e:
         return jsonify({"response_message": str(e), "includes_image": False, "image_path": False})
 
+@app.route('/get_data/stream', methods=['GET'])
+def get_data_stream():
+    # Same parameters as /get_data, answered as server-sent events (see main_events)
+    room_choice = request.args.get('room_choice')
+    input_query = request.args.get('input_query')
+    include_timings = request.args.get('timings') == '1'
+
+    def generate():
+        try:
+            for event, data in main_events(room_choice, input_query, include_timings):
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'response_message': str(e)})}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus exposition of the stage latencies, SQL, LLM token and agent metrics
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"responses": response_cache.stats(), "charts": chart_store.stats()})
+
+@app.route('/images/<chart_id>', methods=['GET'])
+def get_image(chart_id):
+    path = chart_store.path(chart_id)
+    if path is None:
+        abort(404)
+    # A chart id is a hash of its content, so the image never changes and can be cached forever
+    response = send_file(os.path.abspath(path), mimetype='image/png', conditional=True, etag=chart_id)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5001)  # Use a different port if 5000 is in use
+    # Build the engine state once at startup instead of on the first request
+    engine_state.refresh()
+    # Development server; see asgi_app.py for the production serving mode
+    app.run(debug=True, port=5001, threaded=True)  # Use a different port if 5000 is in use
     # app.run(debug=True)
\ No newline at end of file
@@ -1,7 +1,36 @@
+import os
+import json
 import streamlit as st
 import pandas as pd
 import requests
 
+# Base URL of the engine (Engine.py); the frontend may run on a different host
+API_BASE = os.environ.get("CARECONNECT_API", "http://127.0.0.1:5001")
+
+# Progress messages shown while the engine works on the answer
+PROGRESS = {
+    "cache": "Answering from the cache...",
+    "fast_path": "Running the query...",
+    "agent": "The SQL agent is working on your question...",
+}
+
+
+def sse_events(response):
+    """
+    Parses a server-sent event stream into (event, data) pairs, data being decoded from JSON.
+    """
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            # A blank line ends the event
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 # Streamlit app configuration
 st.set_page_config(page_title="Talk to Your Data", page_icon="🦾", layout="centered")
 st.title("Talk to JUNO 🦾")
@@ -58,8 +87,8 @@ if prompt:
     # Use the selected room or default to "ROOF"
     selected_room = options[0] if options else "ROOF"
 
-    # Make the GET request to your local service
-    url = "http://127.0.0.1:5001/get_data"
+    # Stream the answer from your local service, so it is shown while it is being generated
+    url = f"{API_BASE}/get_data/stream"
     params = {
         "room_choice": selected_room,
         "input_query": prompt
@@ -67,20 +96,38 @@ if prompt:
 
     try:
         # Send request
-        response = requests.get(url, params=params)
-        print(response.json())
+        response = requests.get(url, params=params, stream=True)
         if response.status_code == 200:
-            # Process and display the response
-            msg = response.json().get("response_message", "No data returned.")
-            # add image to the body of msg
-            path = response.json().get("image_path")
-            if not isinstance(path, bool):
-                print("the path is: ", path)
-                new_path = path.replace("final/", "").replace("'", "")
-                print("the new path is:", new_path)
-                st.image(new_path, use_column_width=True)
+            status = st.empty()
+            text = st.empty()
+            msg = ""
+            for event, data in sse_events(response):
+                if event == "planned":
+                    status.caption(PROGRESS.get(data["served_by"], "Working..."))
+                elif event == "sql_executed":
+                    status.caption(f"Query executed, {data['rows']} rows returned...")
+                elif event == "rows_ready" and data["rows"] > 1:
+                    status.caption(f"Describing {data['rows']} rows...")
+                elif event == "token":
+                    # Render the message incrementally as the describer generates it
+                    msg += data["text"]
+                    text.write(f"**Assistant:** {msg}")
+                elif event == "chart":
+                    status.empty()
+                    path = data.get("image_path")
+                    if isinstance(path, str):
+                        # Charts are served by the engine on /images/<chart_id>
+                        image = requests.get(f"{API_BASE}{path}")
+                        if image.status_code == 200:
+                            st.image(image.content, use_column_width=True)
+                elif event == "done":
+                    msg = data.get("response_message") or msg or "No data returned."
+                    text.write(f"**Assistant:** {msg}")
+                elif event == "error":
+                    status.empty()
+                    msg = data.get("response_message", "No data returned.")
+                    text.write(f"**Assistant:** {msg}")
             st.session_state.messages.append({"role": "assistant", "content": msg})
-            st.write(f"**Assistant:** {msg}")
         else:
             st.error(f"Request failed with status code {response.status_code}")
     
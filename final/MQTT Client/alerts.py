@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import math
+import sqlite3
+import logging
+import datetime
+from bisect import bisect_right
+import requests
+from ingest_pipeline import IngestPipeline
+
+# The bands are compiled by the engine's classifier (final/air_quality.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from air_quality import load_bands, MEASUREMENT_RANGES_FILE  # noqa: E402
+
+# Alert levels of the bands of measurement_ranges.csv; every other band is level 0 (no alert)
+ALERT_LEVELS = {'Unhealthy': 1, 'Hazardous': 2}
+LEVEL_NAMES = {0: 'Normal', 1: 'Unhealthy', 2: 'Hazardous'}
+
+ALERTS_TABLE = 'alerts'
+
+# Factors converting the units sources report into the units of measurement_ranges.csv
+UNIT_FACTORS = {('kPa', 'hPa'): 10.0, ('Pa', 'hPa'): 0.01, ('mbar', 'hPa'): 1.0}
+
+
+class AlertRule:
+    """
+    Alert level of one metric as a function of its value: the bin edges of its bands and one
+    level per bin, so a reading is classified with one bisect on a handful of edges.
+    """
+
+    def __init__(self, bands, hysteresis=0.05):
+        """
+        Args:
+            bands (air_quality.MeasurementBands): Compiled bands of the metric.
+            hysteresis (float): Fraction of the mean band width a value must move back past
+                an edge before a lower level is considered.
+        """
+        self.metric = bands.measurement
+        self.unit = bands.unit
+        self.edges = bands.edges.tolist()
+        # bands.labels has a trailing label for NaN, which never reaches the rule
+        self.levels = [ALERT_LEVELS.get(label, 0) for label in bands.labels[:-1]]
+        width = (self.edges[-1] - self.edges[0]) / (len(self.edges) - 1) if len(self.edges) > 1 else abs(self.edges[0])
+        self.margin = hysteresis * width
+
+    def level(self, value):
+        return self.levels[bisect_right(self.edges, value)]
+
+    def lenient_level(self, value):
+        # The highest level within the margin around the value: a lower level only counts once
+        # the value is clearly past the edge, whichever side of it is the worse one
+        return max(self.level(value - self.margin), self.level(value), self.level(value + self.margin))
+
+
+class AlertEngine:
+    """
+    Evaluates every ingested reading against the Unhealthy/Hazardous bands of its metric.
+
+    Each (source, metric) has a state: its current alert level. A reading proposing another level
+    changes it only after `debounce` consecutive readings propose the same level, and a lower level
+    is only proposed once the value is past the band edge by the hysteresis margin, so a value
+    oscillating at an edge does not flood the sinks. Only the changes of level are emitted: raised
+    to Unhealthy/Hazardous, lowered, or cleared back to Normal.
+
+    The evaluation is a few bisects and dict lookups per metric. The alerts are handed to the
+    sinks through a bounded queue and delivered on a separate thread, so a slow sink (e.g. the
+    webhook) never delays ingestion; if the queue stays full, alerts are dropped and counted.
+    """
+
+    def __init__(self, sinks, ranges_path=MEASUREMENT_RANGES_FILE, debounce=3, hysteresis=0.05, queue_size=10000):
+        self.debounce = debounce
+        self.rules = {metric: AlertRule(bands, hysteresis) for metric, bands in load_bands(ranges_path).items()}
+        self.sinks = sinks
+        # (source, metric) -> [level, pending level, pending count]
+        self._states = {}
+        self._dispatcher = IngestPipeline(self._deliver, maxsize=queue_size, workers=1, put_timeout=0)
+
+    def evaluate(self, source, reading, timestamp_ms=None, units=None):
+        """
+        Evaluates one reading and queues the alerts it triggers.
+
+        Args:
+            source (str): Table of the reading, e.g. room_QRITA or rooftop.
+            reading (dict): Metric name -> value; fields without a rule are ignored.
+            timestamp_ms (int): Time of the reading, by default its 'timestamp' field.
+            units (dict): Metric name -> unit of the value, when the source reports them (e.g. the
+                rooftop pressure in kPa). Without it, values are taken in the units of the bands.
+
+        Returns:
+            list: The alerts triggered by the reading (usually none).
+        """
+        if timestamp_ms is None:
+            timestamp_ms = reading.get('timestamp')
+        alerts = []
+        for metric, value in reading.items():
+            rule = self.rules.get(metric)
+            if rule is None or isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+                continue
+            unit = units.get(metric) if units else None
+            if unit and unit != rule.unit:
+                factor = UNIT_FACTORS.get((unit, rule.unit))
+                if factor is None:
+                    # Comparing values in another unit would raise false alerts
+                    continue
+                value = value * factor
+            alert = self._update(rule, source, value, timestamp_ms)
+            if alert is not None:
+                alerts.append(alert)
+                self._dispatcher.submit(source, alert)
+        return alerts
+
+    def _update(self, rule, source, value, timestamp_ms):
+        state = self._states.get((source, rule.metric))
+        if state is None:
+            state = self._states[(source, rule.metric)] = [0, None, 0]
+        current = state[0]
+
+        proposed = rule.level(value)
+        if proposed < current:
+            proposed = rule.lenient_level(value)
+            proposed = proposed if proposed < current else current
+        if proposed == current:
+            state[1], state[2] = None, 0
+            return None
+        if proposed == state[1]:
+            state[2] += 1
+        else:
+            state[1], state[2] = proposed, 1
+        if state[2] < self.debounce:
+            return None
+
+        state[0], state[1], state[2] = proposed, None, 0
+        kind = 'raised' if proposed > current else 'cleared' if proposed == 0 else 'lowered'
+        return {"source": source, "metric": rule.metric, "ts_epoch_ms": timestamp_ms, "value": value,
+                "unit": rule.unit, "level": LEVEL_NAMES[proposed], "previous_level": LEVEL_NAMES[current],
+                "kind": kind}
+
+    def levels(self):
+        """
+        Returns the current alert level of every (source, metric) above Normal.
+        """
+        return {key: LEVEL_NAMES[state[0]] for key, state in list(self._states.items()) if state[0]}
+
+    def states(self, source):
+        """
+        Returns the state (level, pending level, pending count) of every metric of a source, as
+        JSON-serializable lists, so a later run can continue from it with restore_states.
+        """
+        return {metric: list(state) for (state_source, metric), state in list(self._states.items())
+                if state_source == source}
+
+    def restore_states(self, source, states):
+        """
+        Sets the state of the metrics of a source, as returned by states.
+        """
+        for metric, state in states.items():
+            self._states[(source, metric)] = list(state)
+
+    def stats(self):
+        """
+        Returns the counters of the delivery queue.
+        """
+        return self._dispatcher.stats()
+
+    def close(self):
+        """
+        Delivers the queued alerts, then closes the sinks.
+        """
+        self._dispatcher.close()
+        for sink in self.sinks:
+            sink.close()
+
+    def _deliver(self, source, alert):
+        # Runs on the delivery thread; a failing sink does not keep the others from getting the alert
+        for sink in self.sinks:
+            try:
+                sink.send(alert)
+            except Exception:
+                logging.exception(f"Alert sink {type(sink).__name__} failed")
+
+
+class LogAlertSink:
+    """
+    Writes the alerts to the log, as warnings while a level is raised.
+    """
+
+    def send(self, alert):
+        level = logging.WARNING if alert["kind"] == 'raised' else logging.INFO
+        logging.log(level, f"Alert {alert['kind']}: {alert['metric']} in {alert['source']} is {alert['level']} "
+                           f"({alert['value']} {alert['unit']}, was {alert['previous_level']})")
+
+    def close(self):
+        pass
+
+
+class SQLiteAlertSink:
+    """
+    Stores the alerts in the alerts table of the CareConnect database, next to the readings.
+    """
+
+    def __init__(self, db_path):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ALERTS_TABLE} (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                ts_epoch_ms INTEGER,
+                value REAL,
+                unit TEXT,
+                level TEXT NOT NULL,
+                previous_level TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {ALERTS_TABLE}_source_metric ON {ALERTS_TABLE} (source, metric, ts_epoch_ms)")
+        self._conn.commit()
+
+    def send(self, alert):
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO {ALERTS_TABLE} (source, metric, ts_epoch_ms, value, unit, level, previous_level, kind, created_at) "
+                f"VALUES (:source, :metric, :ts_epoch_ms, :value, :unit, :level, :previous_level, :kind, :created_at)",
+                dict(alert, created_at=datetime.datetime.now(datetime.timezone.utc).isoformat()))
+
+    def close(self):
+        self._conn.close()
+
+
+class WebhookAlertSink:
+    """
+    POSTs each alert as JSON to a webhook, e.g. a chat channel or a paging service.
+
+    A file:// URL appends the JSON lines to a local file instead, as a stand-in for the
+    receiving service.
+    """
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def send(self, alert):
+        if self.url.startswith('file://'):
+            with open(self.url[len('file://'):], 'a') as alerts_file:
+                alerts_file.write(json.dumps(alert) + '\n')
+            return
+        self._session.post(self.url, json=alert, timeout=self.timeout).raise_for_status()
+
+    def close(self):
+        self._session.close()
+
+
+def alert_engine_from_env(db_path=None):
+    """
+    Builds the alert engine of the ingestion clients, or None if ALERTS is "off".
+
+    The log sink is always on; the SQLite sink when a database path is given, and the webhook
+    sink when ALERT_WEBHOOK_URL is set. ALERT_DEBOUNCE and ALERT_HYSTERESIS tune the engine.
+    """
+    if os.environ.get('ALERTS', 'on') == 'off':
+        return None
+    sinks = [LogAlertSink()]
+    if db_path is not None:
+        sinks.append(SQLiteAlertSink(db_path))
+    if os.environ.get('ALERT_WEBHOOK_URL'):
+        sinks.append(WebhookAlertSink(os.environ['ALERT_WEBHOOK_URL']))
+    return AlertEngine(sinks,
+                       debounce=int(os.environ.get('ALERT_DEBOUNCE', 3)),
+                       hysteresis=float(os.environ.get('ALERT_HYSTERESIS', 0.05)))
@@ -0,0 +1,108 @@
+import time
+import queue
+import logging
+import threading
+import zlib
+
+# Marker telling a worker to stop once everything queued before it is processed
+_STOP = object()
+
+
+class IngestPipeline:
+    """
+    Moves message handling off paho's network thread.
+
+    The MQTT callback only calls submit(), which puts the raw topic and payload into a
+    bounded queue. Worker threads take the messages off the queues and run the handler
+    (JSON decode, storage, logging). Messages of the same topic always go to the same
+    worker, so per-room ordering is kept with any number of workers.
+
+    When a queue is full, submit() waits up to put_timeout seconds (backpressure on the
+    network thread) and then drops the message. Both cases are counted in stats().
+    """
+
+    def __init__(self, handler, maxsize=10000, workers=1, put_timeout=0.05):
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in range(workers)]
+        self._counters = {"enqueued": 0, "processed": 0, "failed": 0, "blocked": 0, "dropped": 0, "max_depth": 0}
+        self._counters_lock = threading.Lock()
+        self._last_drop_log = 0.0
+        self._workers = [
+            threading.Thread(target=self._run, args=(q,), name=f"ingest-worker-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, topic, payload):
+        """
+        Queues a raw message for the workers. Safe to call from the MQTT network thread.
+
+        Args:
+            topic (str): Topic the message was received on.
+            payload (bytes): Raw, undecoded message payload.
+
+        Returns:
+            bool: False if the message was dropped because the queue stayed full.
+        """
+        q = self._queues[zlib.crc32(topic.encode()) % len(self._queues)]
+        try:
+            q.put_nowait((topic, payload))
+        except queue.Full:
+            self._count("blocked")
+            try:
+                q.put((topic, payload), timeout=self.put_timeout)
+            except queue.Full:
+                self._count("dropped")
+                self._log_drop()
+                return False
+
+        depth = q.qsize()
+        with self._counters_lock:
+            self._counters["enqueued"] += 1
+            if depth > self._counters["max_depth"]:
+                self._counters["max_depth"] = depth
+        return True
+
+    def stats(self):
+        """
+        Returns the pipeline counters together with the current total queue depth.
+        """
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats["depth"] = sum(q.qsize() for q in self._queues)
+        return stats
+
+    def close(self):
+        """
+        Stops the workers after they have processed everything already queued.
+        """
+        for q in self._queues:
+            q.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                break
+            topic, payload = item
+            try:
+                self.handler(topic, payload)
+                self._count("processed")
+            except Exception:
+                self._count("failed")
+                logging.exception(f"Failed to process message on topic {topic}")
+
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def _log_drop(self):
+        # At most one warning per second, so a saturated queue does not also flood the log
+        now = time.monotonic()
+        if now - self._last_drop_log >= 1.0:
+            self._last_drop_log = now
+            logging.warning(f"Ingest queue full, dropping messages: {self.stats()}")
@@ -0,0 +1,195 @@
+"""
+Streaming conversion of Zentra long-format readings (one row per measurement) into the wide
+rooftop CSV (one row per timestamp and sensor, one column per measurement).
+
+Usage, to convert a multi-year export such as final/assets/Precipitation.csv:
+    python roof_pivot.py <export.csv> [--output data/roof/pivoted_data.csv] [--chunksize 100000]
+"""
+import os
+import csv
+import sqlite3
+import argparse
+import tempfile
+import pandas as pd
+
+# Columns of the Zentra export used by the pivot
+LONG_COLUMNS = ['timestamp_utc', 'sensor_sn', 'measurement', 'units', 'value']
+KEY_COLUMNS = ['timestamp', 'sensor_sn']
+
+
+def column_name(measurement):
+    # "Air Temperature" -> "Air_Temperature", the column names of the rooftop table
+    return measurement.strip().replace(' ', '_')
+
+
+def last_timestamp(path):
+    """
+    Returns the timestamp of the last row of a wide CSV sorted by timestamp, reading only its tail.
+    """
+    with open(path, 'rb') as wide_file:
+        wide_file.seek(0, os.SEEK_END)
+        wide_file.seek(max(0, wide_file.tell() - 65536))
+        lines = wide_file.read().splitlines()
+    for line in reversed(lines):
+        try:
+            return int(float(line.split(b',', 1)[0]))
+        except ValueError:
+            continue  # The header, or a partial first line
+    return None
+
+
+class RooftopPivot:
+    """
+    Pivots long-format readings into the wide rooftop CSV with memory bounded by the chunk size.
+
+    Each chunk of readings (a page of the API, or a chunk of an export file, in any order) is
+    summed per (timestamp, sensor, measurement) and pivoted on its own, then upserted into a
+    temporary SQLite staging table keyed by (timestamp, sensor). A timestamp whose measurements
+    are split over two chunks is merged there into one row. finish() streams the staged rows,
+    already in key order, to the end of the CSV. Readings not newer than the last row of the CSV
+    are skipped. Only when new measurements appear is the CSV rewritten (also in chunks) with
+    the extra columns.
+    """
+
+    def __init__(self, output_path, chunksize=100_000, tmp_dir=None):
+        self.output_path = output_path
+        self.chunksize = chunksize
+        # Measurement column -> unit, filled from the measurements not seen in earlier chunks
+        self.units = {}
+        self._names = {}  # Measurement as exported -> column name
+        self.last_ts = last_timestamp(output_path) if os.path.exists(output_path) else None
+        self.staged = 0
+
+        self._tmp = tempfile.NamedTemporaryFile(suffix='.db', dir=tmp_dir, delete=False)
+        self._tmp.close()
+        self._conn = sqlite3.connect(self._tmp.name)
+        self._conn.execute('PRAGMA journal_mode=OFF')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute(
+            "CREATE TABLE staging (timestamp INTEGER, sensor_sn TEXT, PRIMARY KEY (timestamp, sensor_sn)) WITHOUT ROWID")
+
+    def add(self, df):
+        """
+        Pivots and stages a chunk of long-format readings.
+
+        Args:
+            df (pd.DataFrame): Readings with at least the columns of LONG_COLUMNS.
+
+        Returns:
+            int: Number of wide rows (timestamps and sensors) staged from the chunk.
+        """
+        if df.empty:
+            return 0
+        df = df[LONG_COLUMNS]
+        if self.last_ts is not None:
+            df = df[df['timestamp_utc'] > self.last_ts]
+            if df.empty:
+                return 0
+        for measurement, unit in df[['measurement', 'units']].drop_duplicates('measurement').itertuples(index=False):
+            if measurement not in self._names:
+                self._names[measurement] = column_name(measurement)
+                self.units.setdefault(self._names[measurement], str(unit).strip())
+                self._conn.execute(f'ALTER TABLE staging ADD COLUMN "{self._names[measurement]}" REAL')
+
+        # Same aggregation as before: the sum per timestamp, sensor and measurement
+        wide = df.groupby(['timestamp_utc', 'sensor_sn', 'measurement'])['value'].sum(min_count=1) \
+            .unstack('measurement')
+        columns = [self._names[measurement] for measurement in wide.columns]
+        wide = wide.astype(object).where(wide.notna(), None)
+        keys = wide.index.to_frame(index=False)
+        rows = zip(keys['timestamp_utc'].astype('int64').tolist(), keys['sensor_sn'].astype(str).tolist(),
+                   *(wide[column].tolist() for column in wide.columns))
+
+        quoted = ', '.join(f'"{column}"' for column in columns)
+        # A row already staged by an earlier chunk gets the measurements of this one added
+        updates = ', '.join(f'"{column}" = COALESCE("{column}" + excluded."{column}", "{column}", excluded."{column}")'
+                            for column in columns)
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO staging (timestamp, sensor_sn, {quoted}) VALUES (?, ?{', ?' * len(columns)}) "
+                f"ON CONFLICT (timestamp, sensor_sn) DO UPDATE SET {updates}", rows)
+        self.staged += len(wide)
+        return len(wide)
+
+    def add_csv(self, path_or_buffer):
+        """
+        Stages a long-format export file, read in chunks of `chunksize` rows.
+        """
+        for chunk in pd.read_csv(path_or_buffer, usecols=LONG_COLUMNS, chunksize=self.chunksize):
+            self.add(chunk)
+
+    def finish(self, on_chunk=None):
+        """
+        Appends the staged readings to the CSV, in timestamp order, and drops the staging table.
+
+        Args:
+            on_chunk (callable): Called with each chunk of new wide rows, e.g. to check them for alerts.
+
+        Returns:
+            int: Number of rows (timestamps and sensors) appended.
+        """
+        try:
+            if not self.staged:
+                return 0
+            header = self._read_header()
+            measurements = sorted(self.units)
+            columns = header + [m for m in measurements if m not in header] if header else KEY_COLUMNS + measurements
+            selected = ', '.join(f'"{column}"' if column in self.units else 'NULL' for column in columns[len(KEY_COLUMNS):])
+            # The primary key already orders the rows, so this is a plain scan
+            cursor = self._conn.execute(f"SELECT timestamp, sensor_sn, {selected} FROM staging ORDER BY timestamp, sensor_sn")
+
+            rewrite = bool(header) and columns != header
+            target = self.output_path + '.tmp' if rewrite else self.output_path
+            appended = 0
+            with open(target, 'w' if rewrite or not header else 'a', newline='') as wide_file:
+                if rewrite:
+                    # New measurements: copy the existing rows with the extra (empty) columns first
+                    for chunk in pd.read_csv(self.output_path, chunksize=self.chunksize):
+                        chunk.reindex(columns=columns).to_csv(wide_file, index=False, header=wide_file.tell() == 0)
+                elif not header:
+                    pd.DataFrame(columns=columns).to_csv(wide_file, index=False)
+                while True:
+                    rows = cursor.fetchmany(self.chunksize)
+                    if not rows:
+                        break
+                    chunk = pd.DataFrame(rows, columns=columns)
+                    chunk.to_csv(wide_file, index=False, header=False)
+                    appended += len(chunk)
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+            if rewrite:
+                os.replace(target, self.output_path)
+            return appended
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Removes the staging database.
+        """
+        self._conn.close()
+        if os.path.exists(self._tmp.name):
+            os.remove(self._tmp.name)
+
+    def _read_header(self):
+        if not os.path.exists(self.output_path) or os.path.getsize(self.output_path) == 0:
+            return []
+        with open(self.output_path, newline='') as wide_file:
+            return next(csv.reader(wide_file), [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('export', help='long-format Zentra CSV export')
+    parser.add_argument('--output', default='data/roof/pivoted_data.csv')
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    args = parser.parse_args()
+
+    pivot = RooftopPivot(args.output, args.chunksize)
+    pivot.add_csv(args.export)
+    appended = pivot.finish()
+    print(f"Appended {appended} rows to {args.output}; units: {pivot.units}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,15 @@
 import os
 import csv
 import json
+import signal
 import logging
+import threading
 import paho.mqtt.client as mqtt
 import ast  # This will be used to safely evaluate string literals that represent lists
 import re  # This will be used to extract the first value from a list-like string
+from sqlite_writer import SQLiteBatchWriter, room_table_name
+from alerts import alert_engine_from_env
+from ingest_pipeline import IngestPipeline
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
@@ -20,6 +25,21 @@ if not os.path.exists(data_dir):
     os.makedirs(data_dir)
     logging.info(f"Created directory {data_dir}")
 
+# Storage mode: "csv" appends every reading to data/rooms/<device>.csv, "sqlite" buffers the
+# readings and writes them in batches straight into the room_Q* tables of the engine database
+storage_mode = os.environ.get("ROOMS_STORAGE_MODE", "csv")
+db_path = os.environ.get("CARECONNECT_DB", "../DataBase/CareConnect.db")
+writer = None
+if storage_mode == "sqlite":
+    writer = SQLiteBatchWriter(db_path,
+                               batch_size=int(os.environ.get("ROOMS_BATCH_SIZE", 500)),
+                               flush_interval=float(os.environ.get("ROOMS_FLUSH_INTERVAL", 5.0)))
+    logging.info(f"Writing readings in batches to {db_path}")
+
+# Evaluates every reading against the Unhealthy/Hazardous bands; alerts go to the log, the
+# alerts table of the database (in sqlite mode) and ALERT_WEBHOOK_URL if set
+alert_engine = alert_engine_from_env(db_path if storage_mode == "sqlite" else None)
+
 # List of topics to subscribe to
 topics = [
     "envsensors/airQ/airQROB",
@@ -30,10 +50,9 @@ topics = [
     "envsensors/airQ/airQFOYER"
 ]
 
-# Callback when a message is received
-def on_message(client, userdata, message):
-    topic = message.topic
-    payload = message.payload.decode()
+# Runs on an ingest worker thread for every queued message
+def process_message(topic, payload):
+    payload = payload.decode()
     logging.info(f"Received message on topic: {topic}")
     logging.debug(f"Payload: {payload}")
 
@@ -53,16 +72,33 @@ def on_message(client, userdata, message):
     # Apply the function to all values in the data
     processed_data = {key: extract_first_value(value) for key, value in data.items()}
 
+    # Check the reading for dangerous values; the alerts are delivered on their own thread
+    if alert_engine is not None:
+        alert_engine.evaluate(room_table_name(topic.split("/")[-1]), processed_data)
+
+    # Buffer the reading for the next batched database write
+    if writer is not None:
+        writer.add(topic.split("/")[-1], processed_data)
+        return
+
     # Check if file exists and append data or write header
     file_exists = os.path.exists(filepath)
     with open(filepath, 'a', newline='') as file:
-        writer = csv.writer(file)
+        csv_writer = csv.writer(file)
         if not file_exists:
-            writer.writerow(processed_data.keys())
+            csv_writer.writerow(processed_data.keys())
             logging.info(f"Created new file {filename} and wrote header")
-        writer.writerow(processed_data.values())
+        csv_writer.writerow(processed_data.values())
         logging.info(f"Appended processed data to {filename}")
 
+# Decode and store messages on worker threads, fed through a bounded queue
+pipeline = IngestPipeline(process_message,
+                          maxsize=int(os.environ.get("ROOMS_QUEUE_SIZE", 10000)),
+                          workers=int(os.environ.get("ROOMS_WORKERS", 1)))
+
+# Callback when a message is received: runs on paho's network thread, so it only enqueues
+def on_message(client, userdata, message):
+    pipeline.submit(message.topic, message.payload)
         
 
 # Callback when the client connects to the broker
@@ -96,13 +132,27 @@ logging.info(f"Attempting to connect to MQTT broker at {broker_address}:{port}")
 # Start the loop to process MQTT events
 client.loop_start()
 
-# Keep the main thread running
+# Keep the main thread blocked until SIGINT/SIGTERM, logging the pipeline counters now and then
+stop_event = threading.Event()
+signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
 try:
-    while True:
-        pass
+    while not stop_event.wait(60):
+        logging.info(f"Ingest pipeline: {pipeline.stats()}")
 except KeyboardInterrupt:
-    logging.info("Exiting gracefully")
+    pass
 finally:
+    logging.info("Exiting gracefully")
     client.loop_stop()
     client.disconnect()
     logging.info("MQTT client disconnected and loop stopped")
+    # Process everything still queued before the final flush
+    pipeline.close()
+    logging.info(f"Ingest queue drained: {pipeline.stats()}")
+    if writer is not None:
+        # Write whatever is still buffered before exiting
+        writer.close()
+        logging.info("Final flush to the database done")
+    if alert_engine is not None:
+        # Deliver the alerts still queued
+        alert_engine.close()
+        logging.info(f"Alerts delivered: {alert_engine.stats()}")
@@ -0,0 +1,201 @@
+import sqlite3
+import logging
+import datetime
+import threading
+
+# Same high-water mark table as the engine's CSV loader (final/loader.py)
+STATE_TABLE = '_ingest_state'
+
+# Same long-format table as the engine's CSV loader: one row per (source table, metric, epoch ms)
+READINGS_TABLE = 'readings'
+
+# Payload fields that are not sensor metrics
+NON_METRIC_FIELDS = {'timestamp', 'Status', 'DeviceID'}
+
+
+def room_table_name(device):
+    """
+    Maps an airQ device name (e.g. airQRITA) to its table name (e.g. room_QRITA).
+    """
+    return 'room_' + device[3:]
+
+
+def to_sql_timestamp(timestamp_ms):
+    # Same text layout pandas' to_sql uses for the DATETIME columns loaded by the engine
+    return datetime.datetime.fromtimestamp(timestamp_ms / 1000, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _sql_type(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 'TEXT'
+    return 'BIGINT' if isinstance(value, int) else 'FLOAT'
+
+
+class SQLiteBatchWriter:
+    """
+    Buffers decoded room readings in memory and writes them to the room_Q* tables of the
+    CareConnect database in batches.
+
+    A flush happens when batch_size readings are buffered or every flush_interval seconds,
+    whichever comes first, and once more on close. Each flush is a single transaction with
+    one executemany per table, on a connection in WAL mode so the engine can keep reading
+    while the client writes.
+    """
+
+    def __init__(self, db_path, batch_size=500, flush_interval=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = {}
+        self._pending = 0
+        self._columns = {}
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                table_name TEXT PRIMARY KEY,
+                file_path TEXT,
+                file_id TEXT,
+                byte_offset INTEGER,
+                tail_hash TEXT,
+                header TEXT,
+                last_ts INTEGER,
+                row_count INTEGER
+            )
+        """)
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {READINGS_TABLE} (
+                source TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                ts_epoch_ms INTEGER NOT NULL,
+                value REAL,
+                PRIMARY KEY (source, metric, ts_epoch_ms)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {READINGS_TABLE}_metric_ts ON {READINGS_TABLE} (metric, ts_epoch_ms)")
+        self._conn.commit()
+
+        self._timer = threading.Thread(target=self._flush_periodically, name='sqlite-writer-flush', daemon=True)
+        self._timer.start()
+
+    def add(self, device, reading):
+        """
+        Buffers one reading of a room sensor.
+
+        Args:
+            device (str): Name of the airQ device, taken from the MQTT topic (e.g. airQRITA).
+            reading (dict): Decoded payload, with a millisecond 'timestamp' field.
+        """
+        with self._buffer_lock:
+            self._buffer.setdefault(room_table_name(device), []).append(reading)
+            self._pending += 1
+            full = self._pending >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered readings in one transaction. If the transaction fails, the readings
+        stay buffered for the next flush and the error is raised.
+
+        Returns:
+            int: Number of readings written.
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch, self._buffer, self._pending = self._buffer, {}, 0
+            if not batch:
+                return 0
+
+            written = 0
+            try:
+                with self._conn:
+                    for table, readings in batch.items():
+                        written += self._write_table(table, readings)
+            except sqlite3.Error:
+                # Nothing was committed: the readings go back in front of the buffer for the next
+                # flush, and the columns are read again as the rollback may have undone new ones
+                with self._buffer_lock:
+                    for table, readings in batch.items():
+                        self._buffer[table] = readings + self._buffer.get(table, [])
+                        self._pending += len(readings)
+                        self._columns.pop(table, None)
+                raise
+            logging.info(f"Flushed {written} readings to {len(batch)} tables")
+            return written
+
+    def close(self):
+        """
+        Stops the periodic flush, writes what is left in the buffer and closes the connection.
+        """
+        self._stop.set()
+        self._timer.join()
+        self.flush()
+        self._conn.close()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logging.error(f"Periodic flush failed, the readings stay buffered: {e}")
+
+    def _ensure_columns(self, table, readings):
+        # Creates the table on the first reading of a new room, and adds any new sensor field as a column
+        if table not in self._columns:
+            rows = self._conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            self._columns[table] = [row[1] for row in rows]
+
+        columns = self._columns[table]
+        missing = {}
+        for reading in readings:
+            for key, value in reading.items():
+                if key not in columns and key not in missing:
+                    missing[key] = 'DATETIME' if key == 'timestamp' else _sql_type(value)
+
+        if not missing:
+            return columns
+        if not columns:
+            definition = ', '.join(f'"{name}" {sql_type}' for name, sql_type in missing.items())
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({definition})')
+        else:
+            for name, sql_type in missing.items():
+                self._conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {sql_type}')
+        columns.extend(missing)
+        return columns
+
+    def _write_table(self, table, readings):
+        columns = self._ensure_columns(table, readings)
+        placeholders = ', '.join('?' for _ in columns)
+        column_list = ', '.join(f'"{name}"' for name in columns)
+
+        rows = []
+        long_rows = []
+        last_ts = None
+        for reading in readings:
+            timestamp_ms = reading.get('timestamp')
+            if timestamp_ms is not None:
+                last_ts = timestamp_ms if last_ts is None else max(last_ts, timestamp_ms)
+                long_rows.extend(
+                    (table, name, int(timestamp_ms), float(value)) for name, value in reading.items()
+                    if name not in NON_METRIC_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool)
+                )
+            rows.append(tuple(
+                to_sql_timestamp(reading[name]) if name == 'timestamp' and reading.get(name) is not None else reading.get(name)
+                for name in columns
+            ))
+        self._conn.executemany(f'INSERT INTO "{table}" ({column_list}) VALUES ({placeholders})', rows)
+        self._conn.executemany(f'INSERT OR IGNORE INTO {READINGS_TABLE} VALUES (?, ?, ?, ?)', long_rows)
+
+        # Keep the engine's high-water mark in step so the table is listed and its data version moves
+        self._conn.execute(f"""
+            INSERT INTO {STATE_TABLE} (table_name, last_ts, row_count) VALUES (?, ?, ?)
+            ON CONFLICT(table_name) DO UPDATE SET
+                last_ts = MAX(COALESCE(last_ts, 0), COALESCE(excluded.last_ts, 0)),
+                row_count = COALESCE(row_count, 0) + excluded.row_count
+        """, (table, last_ts, len(rows)))
+        return len(rows)
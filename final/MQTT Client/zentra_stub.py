@@ -0,0 +1,142 @@
+"""
+Local stand-in for the Zentra Cloud get_readings endpoint, for testing roof_mqtt.py offline.
+
+It serves a synthetic weather station (one record every 5 minutes, one CSV row per
+measurement) with the query parameters roof_mqtt.py uses: start_mrid, sort_by, page_num and
+per_page. Requests can be slowed down and made to fail, to exercise the concurrency and the
+retries of the sync.
+
+Run from the MQTT Client directory, then point the sync to it:
+    python zentra_stub.py [--records 5000] [--latency-s 0.05] [--fail-rate 0.1]
+    ZENTRA_URL=http://127.0.0.1:8765/api/v3/get_readings/ python roof_mqtt.py
+"""
+import math
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# (measurement, units, value of record i) of the stand-in station
+MEASUREMENTS = [
+    ('Air Temperature', ' °C', lambda i: round(20 + 8 * math.sin(2 * math.pi * i / 288), 1)),
+    ('Atmospheric Pressure', ' kPa', lambda i: round(98.5 + 0.3 * math.sin(2 * math.pi * i / 2016), 2)),
+    ('Solar Radiation', ' W/m²', lambda i: max(0.0, round(800 * math.sin(2 * math.pi * i / 288), 1))),
+    ('Precipitation', ' mm', lambda i: 0.0),
+    ('Wind Speed', ' m/s', lambda i: round(1 + abs(math.sin(i / 7)), 2)),
+    ('Gust Speed', ' m/s', lambda i: round(2 + abs(math.sin(i / 7)), 2)),
+    ('VPD', ' kPa', lambda i: round(1 + 0.5 * math.sin(2 * math.pi * i / 288), 2)),
+]
+
+HEADER = 'timestamp_utc,tz_offset,datetime,mrid,measurement,value,units,port_num,sensor_sn,sensor_name'
+
+
+class ZentraStub:
+    """
+    The synthetic readings and the request counters of the stand-in server.
+    """
+
+    def __init__(self, records=5000, device_sn='A4100209', start_ts=1_725_055_200, latency_s=0.0,
+                 fail_rate=0.0, seed=0):
+        self.device_sn = device_sn
+        self.start_ts = start_ts
+        self.latency_s = latency_s
+        self.fail_rate = fail_rate
+        self.records = records
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def add_records(self, count):
+        # New readings arriving at the station, for testing resumed syncs
+        with self._lock:
+            self.records += count
+
+    def rows(self, start_mrid=1, descending=False, first=0, last=None):
+        """
+        Returns the CSV rows first..last (one per measurement of each record) from start_mrid on,
+        and the total number of rows.
+        """
+        with self._lock:
+            records = max(self.records - max(start_mrid, 1) + 1, 0)
+        total = records * len(MEASUREMENTS)
+        rows = []
+        for index in range(first, min(total, total if last is None else last)):
+            offset, port = divmod(index, len(MEASUREMENTS))
+            mrid = self.records - offset if descending else max(start_mrid, 1) + offset
+            ts = self.start_ts + (mrid - 1) * 300
+            measurement, units, value = MEASUREMENTS[port]
+            rows.append(f"{ts},7200,{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))},{mrid},{measurement},"
+                        f"{value(mrid)},{units},{port + 1},{self.device_sn},ATMOS 41")
+        return rows, total
+
+    def page(self, params):
+        """
+        Returns (status, body) of a get_readings request.
+        """
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.fail_rate
+            if fail:
+                self.failures += 1
+        time.sleep(self.latency_s)
+        if fail:
+            return 503, 'Service temporarily unavailable'
+
+        per_page = int(params.get('per_page', 1000))
+        page_num = int(params.get('page_num', 1))
+        page_rows, total = self.rows(int(params.get('start_mrid', 1)), params.get('sort_by') == 'descending',
+                                     (page_num - 1) * per_page, page_num * per_page)
+        # A few lines of device metadata precede the readings, like the real CSV output
+        preamble = [f"device_sn,{self.device_sn}", "device_name,Rooftop", "site_name,CareConnect",
+                    "latitude,48.3", "longitude,14.3", f"page_num,{page_num}", f"per_page,{per_page}",
+                    f"total_rows,{total}"]
+        return 200, '\n'.join(preamble + [HEADER] + page_rows) + '\n'
+
+
+def serve(stub, host='127.0.0.1', port=8765):
+    """
+    Starts serving the stub on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: The server; its URL is http://host:server.server_port/api/v3/get_readings/.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            status, body = stub.page(params)
+            payload = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/csv; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--latency-s', type=float, default=0.0)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(ZentraStub(args.records, latency_s=args.latency_s, fail_rate=args.fail_rate), port=args.port)
+    print(f"Serving http://127.0.0.1:{server.server_port}/api/v3/get_readings/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
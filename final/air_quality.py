@@ -0,0 +1,140 @@
+import os
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+MEASUREMENT_RANGES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'measurement_ranges.csv')
+
+# Label of the values outside every band of their measurement (e.g. air temperature below 10°C)
+UNCLASSIFIED = 'Unclassified'
+
+# Result columns of the fast path carry the aggregate as a prefix (avg_co2, max_Wind_Speed)
+AGGREGATE_PREFIX = re.compile(r'^(?:avg|min|max|latest)_')
+
+NUMBER = r'(-?\d+(?:\.\d+)?)'
+BAND_PATTERNS = [
+    (re.compile(rf'^Above\s+{NUMBER}\s*(.*)$', re.IGNORECASE), lambda m: (float(m[1]), np.inf, m[2])),
+    (re.compile(rf'^Below\s+{NUMBER}\s*(.*)$', re.IGNORECASE), lambda m: (-np.inf, float(m[1]), m[2])),
+    (re.compile(rf'^{NUMBER}\s*(.*?)\s+to\s+{NUMBER}\s*(.*)$', re.IGNORECASE), lambda m: (float(m[1]), float(m[3]), m[4])),
+]
+
+
+def parse_band(band):
+    """
+    Parses a human-readable band of measurement_ranges.csv.
+
+    Args:
+        band (str): e.g. "Above 40°C", "600 ppm to 1000 ppm" or "Below 15 µg/m³".
+
+    Returns:
+        tuple: (lower bound, upper bound, unit), open ends being -inf/inf.
+
+    Raises:
+        ValueError: If the band is not in one of these forms.
+    """
+    band = band.strip()
+    for pattern, bounds in BAND_PATTERNS:
+        match = pattern.match(band)
+        if match:
+            return bounds(match)
+    raise ValueError(f"Unrecognized measurement band: {band!r}")
+
+
+class MeasurementBands:
+    """
+    The bands of one measurement compiled into sorted bin edges, so that a whole column is
+    labeled with one np.searchsorted.
+
+    A value on an edge gets the band above it: with "35°C to 40°C" and "Above 40°C", 40°C is
+    Hazardous. Values in no band (and NaN) are Unclassified.
+    """
+
+    def __init__(self, measurement, bands):
+        """
+        Args:
+            measurement (str): Measurement (column) name.
+            bands (dict): Label -> band text, e.g. {"Hazardous": "Above 40°C", ...}.
+        """
+        self.measurement = measurement
+        # Labels in the order of the file, from the worst to the best
+        self.order = list(bands) + [UNCLASSIFIED]
+        intervals = [(label, *parse_band(band)) for label, band in bands.items() if isinstance(band, str)]
+        units = {unit.strip() for _, _, _, unit in intervals if unit.strip()}
+        if len(units) > 1:
+            raise ValueError(f"Bands of {measurement} mix units: {sorted(units)}")
+        self.unit = units.pop() if units else ''
+
+        self.edges = np.unique([bound for _, low, high, _ in intervals for bound in (low, high) if np.isfinite(bound)])
+        # One label per bin: below the first edge, between consecutive edges, above the last edge
+        probes = np.concatenate([[self.edges[0] - 1], (self.edges[:-1] + self.edges[1:]) / 2, [self.edges[-1] + 1]])
+        self.labels = np.array([next((label for label, low, high, _ in intervals if low <= probe < high), UNCLASSIFIED)
+                                for probe in probes] + [UNCLASSIFIED], dtype=object)
+
+    def classify(self, values):
+        """
+        Labels the values with their band.
+
+        Args:
+            values (array-like): Numeric values of the measurement.
+
+        Returns:
+            np.ndarray: One label per value.
+        """
+        values = np.asarray(values, dtype=float)
+        bins = np.searchsorted(self.edges, values, side='right')
+        # NaN sorts after every edge; point it to the trailing Unclassified label instead
+        bins[np.isnan(values)] = len(self.labels) - 1
+        return self.labels[bins]
+
+
+@lru_cache(maxsize=None)
+def load_bands(path=MEASUREMENT_RANGES_FILE):
+    """
+    Compiles measurement_ranges.csv, once per process.
+
+    Returns:
+        dict: Measurement name -> MeasurementBands. The band labels, from the worst to the best,
+        are the columns of the file (Hazardous, Unhealthy, Moderate, Good, Excellent).
+    """
+    ranges_df = pd.read_csv(path, encoding='utf-8')
+    return {row['Measurement']: MeasurementBands(row['Measurement'], row.drop('Measurement').to_dict())
+            for _, row in ranges_df.iterrows()}
+
+
+def bands_for(column, path=MEASUREMENT_RANGES_FILE):
+    """
+    Returns the MeasurementBands of a result column (e.g. "co2" or "avg_co2"), or None.
+    """
+    bands = load_bands(path)
+    return bands.get(column) or bands.get(AGGREGATE_PREFIX.sub('', str(column)))
+
+
+def classify_column(column, values, path=MEASUREMENT_RANGES_FILE):
+    """
+    Labels the values of a result column with their band, or returns None if the column is not
+    a measurement with bands.
+    """
+    bands = bands_for(column, path)
+    return bands.classify(values) if bands is not None else None
+
+
+def band_distribution(df, path=MEASUREMENT_RANGES_FILE):
+    """
+    Share of the rows in each band, per measurement column of the result.
+
+    Returns:
+        list: One line per classified column, e.g. "co2 (ppm): Good 75%, Excellent 25%.", the
+        bands being listed from the worst to the best.
+    """
+    lines = []
+    for column in df.columns:
+        bands = bands_for(column, path)
+        if bands is None or not pd.api.types.is_numeric_dtype(df[column]) or df[column].empty:
+            continue
+        labels, counts = np.unique(bands.classify(df[column].to_numpy()), return_counts=True)
+        shares = dict(zip(labels, counts / counts.sum()))
+        parts = ', '.join(f"{label} {shares[label]:.0%}" for label in bands.order if label in shares)
+        unit = f" ({bands.unit})" if bands.unit else ''
+        lines.append(f"{column}{unit}: {parts}.")
+    return lines
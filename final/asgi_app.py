@@ -0,0 +1,95 @@
+"""
+Production serving mode of the engine on an async stack (Starlette + uvicorn).
+
+The question endpoints run on the event loop and offload the blocking agent, SQL and LLM work
+to worker threads, at most MAX_CONCURRENCY requests at a time; further requests wait for a free
+slot instead of queueing behind a single worker. Every other route (/images, /cache_stats) is
+served by the Flask app of Engine.py, mounted as WSGI.
+
+Run from the repository root:
+    python final/asgi_app.py
+or
+    uvicorn asgi_app:app --app-dir final --port 5001
+"""
+import os
+import json
+from contextlib import asynccontextmanager
+import anyio
+import anyio.to_thread
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from Engine import app as flask_app, engine_state, main, main_events
+
+# Number of questions answered at the same time
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', 8))
+
+# Admission of requests, and the worker threads their blocking work runs on
+request_limiter = anyio.CapacityLimiter(MAX_CONCURRENCY)
+thread_limiter = anyio.CapacityLimiter(MAX_CONCURRENCY)
+
+
+async def get_data(request):
+    room_choice = request.query_params.get('room_choice')
+    input_query = request.query_params.get('input_query')
+    # ?timings=1 adds the per-stage timing breakdown of the request to the response
+    include_timings = request.query_params.get('timings') == '1'
+    try:
+        async with request_limiter:
+            result = await anyio.to_thread.run_sync(main, room_choice, input_query, include_timings,
+                                                    limiter=thread_limiter)
+        return JSONResponse(result)
+    except Exception as e:
+        return JSONResponse({"response_message": str(e), "includes_image": False, "image_path": False})
+
+
+async def get_data_stream(request):
+    room_choice = request.query_params.get('room_choice')
+    input_query = request.query_params.get('input_query')
+    include_timings = request.query_params.get('timings') == '1'
+
+    async def generate():
+        async with request_limiter:
+            events = main_events(room_choice, input_query, include_timings)
+            try:
+                while True:
+                    # Each step of the pipeline blocks, so it runs on a worker thread
+                    item = await anyio.to_thread.run_sync(next, events, None, limiter=thread_limiter)
+                    if item is None:
+                        break
+                    event, data = item
+                    yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'response_message': str(e)})}\n\n"
+            finally:
+                # Also stops the pipeline when the client disconnects
+                await anyio.to_thread.run_sync(events.close, limiter=thread_limiter)
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the engine state once at startup instead of on the first request
+    await anyio.to_thread.run_sync(engine_state.refresh)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/get_data', get_data, methods=['GET']),
+        Route('/get_data/stream', get_data_stream, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=MAX_CONCURRENCY)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'])],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 5001)))
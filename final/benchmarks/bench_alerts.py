@@ -0,0 +1,90 @@
+"""
+Throughput and per-reading latency of the alert engine on synthetic airQ readings.
+
+Every reading carries all the metrics of an airQ payload. co2 oscillates around the
+Unhealthy edge (2000 ppm) with noise, the case hysteresis and debounce are for; the other
+metrics stay in their normal bands. The alerts go to a sink sleeping --sink-ms per alert,
+standing in for a slow webhook, to show that delivery does not slow down evaluation.
+
+Run from the repository root:
+    python final/benchmarks/bench_alerts.py [--readings 200000] [--sink-ms 5]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+
+FINAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(FINAL_DIR, 'MQTT Client'))
+from alerts import AlertEngine  # noqa: E402
+
+DEVICES = ['room_QROB', 'room_QRITA', 'room_QMOMO', 'room_QHANS', 'room_QDORO', 'room_QFOYER']
+
+# A message every 2 s per device, the airQ default
+AIRQ_RATE = len(DEVICES) / 2.0
+
+
+class SlowSink:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.received = 0
+
+    def send(self, alert):
+        time.sleep(self.seconds)
+        self.received += 1
+
+    def close(self):
+        pass
+
+
+def synthetic_readings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    co2 = 2000 + 40 * np.sin(np.arange(n) / 50) + rng.normal(0, 25, n)
+    for i in range(n):
+        yield DEVICES[i % len(DEVICES)], {
+            'timestamp': 1_725_000_000_000 + i * 2000, 'DeviceID': 'airQ', 'Status': 'OK',
+            'co2': float(co2[i]), 'humidity': 45.0, 'dewpt': 12.0, 'tvoc': 150.0, 'pm1': 3.0, 'pm2_5': 8.0,
+            'pm10': 12.0, 'o3': 40.0, 'no2': 10.0, 'co': 1.0, 'h2s': 2.0, 'oxygen': 20.9, 'temperature': 22.5,
+            'pressure': 1013.0, 'sound': 45.0, 'health': 900.0, 'performance': 800.0}
+
+
+def run(readings, debounce, hysteresis, sink_ms):
+    sink = SlowSink(sink_ms / 1000)
+    engine = AlertEngine([sink], debounce=debounce, hysteresis=hysteresis)
+    latencies = np.empty(len(readings))
+    alerts = 0
+    start = time.perf_counter()
+    for i, (device, reading) in enumerate(readings):
+        t0 = time.perf_counter()
+        alerts += len(engine.evaluate(device, reading))
+        latencies[i] = time.perf_counter() - t0
+    evaluate_s = time.perf_counter() - start
+    engine.close()
+    return evaluate_s, latencies * 1e6, alerts, engine.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=200_000)
+    parser.add_argument('--sink-ms', type=float, default=5.0)
+    args = parser.parse_args()
+    # The dropped-alert warnings of a saturated delivery queue are expected with a slow sink
+    logging.getLogger().setLevel(logging.ERROR)
+
+    readings = list(synthetic_readings(args.readings))
+    header = f"{'debounce':>8} {'hysteresis':>10} {'readings/s':>11} {'x airQ rate':>11} {'p50 us':>7} " \
+             f"{'p99 us':>7} {'alerts':>7} {'dropped':>7}"
+    print(header)
+    print('-' * len(header))
+    for debounce, hysteresis in [(1, 0.0), (3, 0.0), (3, 0.05), (5, 0.1)]:
+        evaluate_s, latencies_us, alerts, stats = run(readings, debounce, hysteresis, args.sink_ms)
+        rate = args.readings / evaluate_s
+        print(f"{debounce:>8} {hysteresis:>10.2f} {rate:>11.0f} {rate / AIRQ_RATE:>11.0f} "
+              f"{np.percentile(latencies_us, 50):>7.1f} {np.percentile(latencies_us, 99):>7.1f} "
+              f"{alerts:>7} {stats['dropped']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Reads of one column of a room over a time window: the wide SQLite table, the long-format readings
+table and the columnar store (columnar.py).
+
+A synthetic room history with the columns of the airQ CSVs, one row every 5 minutes, is loaded
+into a temporary SQLite database the way the loader does (wide table + readings table), then
+copied into a columnar store. For each window the report shows the best of --repeat reads of the
+co2 series and of its average, and whether every backend returned the same values.
+
+Run from the repository root:
+    python final/benchmarks/bench_columnar.py [--years 3] [--repeat 5] [--partition month]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from loader import READINGS_TABLE, _ensure_readings_table, _backfill_readings  # noqa: E402
+from columnar import ColumnarStore  # noqa: E402
+
+TABLE = 'room_QBENCH'
+STEP_MS = 300_000
+DAY_MS = 86_400_000
+START_MS = 1_640_995_200_000  # 2022-01-01
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Numeric columns of an airQ room CSV, besides the timestamp, Status and DeviceID
+METRICS = ['oxygen', 'health', 'dewpt', 'no2', 'h2s', 'humidity', 'sound', 'temperature', 'sound_max', 'pm10', 'co',
+           'co2', 'pressure', 'performance', 'pm2_5', 'TypPS', 'pm1', 'humidity_abs', 'tvoc', 'o3']
+
+WINDOWS = [('day', DAY_MS), ('week', 7 * DAY_MS), ('month', 30 * DAY_MS), ('year', 365 * DAY_MS)]
+
+
+def synthetic_room(n, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({metric: rng.normal(100, 10, n).round(3) for metric in METRICS})
+    frame['co2'] = (600 + 150 * np.sin(2 * np.pi * np.arange(n) / 288) + rng.normal(0, 10, n)).round(1)
+    frame['Status'] = 'OK'
+    frame['DeviceID'] = '61c61e378e5095bf25c28a285822f338'
+    frame['timestamp'] = pd.to_datetime(START_MS + np.arange(n, dtype=np.int64) * STEP_MS, unit='ms')
+    return frame
+
+
+def best_seconds(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--partition', choices=['month', 'day'], default='month')
+    args = parser.parse_args()
+
+    n = int(args.years * 365 * DAY_MS / STEP_MS)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            synthetic_room(n).to_sql(TABLE, con=conn, index=False, chunksize=50_000)
+            _ensure_readings_table(conn)
+            _backfill_readings(conn, TABLE)
+        print(f"{n} rows x {len(METRICS)} metrics loaded into SQLite in {time.perf_counter() - start:.1f} s")
+
+        store = ColumnarStore(os.path.join(tmp, 'columnar'), args.partition)
+        start = time.perf_counter()
+        store.sync_tables(engine, [TABLE])
+        print(f"copied into {len(store.partitions(TABLE))} {args.partition} partitions in "
+              f"{time.perf_counter() - start:.1f} s; {directory_bytes(store.root) / 1e6:.0f} MB columnar vs "
+              f"{os.path.getsize(os.path.join(tmp, 'bench.db')) / 1e6:.0f} MB SQLite (wide + readings)\n")
+
+        header = f"{'window':>6} {'read':>6} {'wide ms':>9} {'readings ms':>11} {'columnar ms':>11} {'vs best':>8} {'same':>5}"
+        print(header)
+        print('-' * len(header))
+        end_ms = START_MS + n * STEP_MS
+        with engine.connect() as conn:
+            for name, size in WINDOWS:
+                lo_ms = end_ms - size
+                lo, hi = (pd.Timestamp(ms, unit='ms').strftime(TIMESTAMP_FORMAT) for ms in (lo_ms, end_ms))
+                wide_sql = {
+                    'series': f'SELECT "timestamp", co2 FROM {TABLE} WHERE co2 IS NOT NULL AND "timestamp" >= :lo '
+                              f'AND "timestamp" < :hi ORDER BY "timestamp"',
+                    'avg': f'SELECT COUNT(co2), AVG(co2) FROM {TABLE} WHERE "timestamp" >= :lo AND "timestamp" < :hi'}
+                readings_sql = {
+                    'series': f"SELECT ts_epoch_ms, value FROM {READINGS_TABLE} WHERE source = :t AND metric = 'co2' "
+                              f"AND ts_epoch_ms >= :lo AND ts_epoch_ms < :hi ORDER BY ts_epoch_ms",
+                    'avg': f"SELECT COUNT(value), AVG(value) FROM {READINGS_TABLE} WHERE source = :t AND metric = 'co2' "
+                           f"AND ts_epoch_ms >= :lo AND ts_epoch_ms < :hi"}
+                columnar = {
+                    'series': lambda: store.read(TABLE, ['co2'], lo_ms, end_ms),
+                    'avg': lambda: store.aggregate(TABLE, 'co2', lo_ms, end_ms)}
+                for read in ('series', 'avg'):
+                    wide_s, wide = best_seconds(
+                        lambda: conn.execute(text(wide_sql[read]), {"lo": lo, "hi": hi}).all(), args.repeat)
+                    readings_s, readings = best_seconds(
+                        lambda: conn.execute(text(readings_sql[read]), {"t": TABLE, "lo": lo_ms, "hi": end_ms}).all(),
+                        args.repeat)
+                    columnar_s, result = best_seconds(columnar[read], args.repeat)
+                    if read == 'series':
+                        same = len(wide) == len(readings) == len(result) and \
+                            np.allclose([row[1] for row in wide], result['co2']) and \
+                            np.allclose([row[1] for row in readings], result['co2'])
+                    else:
+                        count, total = result[0], result[1]
+                        same = wide[0][0] == readings[0][0] == count and \
+                            np.allclose([wide[0][1], readings[0][1]], total / count)
+                    print(f"{name:>6} {read:>6} {wide_s * 1000:>9.1f} {readings_s * 1000:>11.1f} {columnar_s * 1000:>11.2f} "
+                          f"{min(wide_s, readings_s) / columnar_s:>7.1f}x {str(same):>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Render time and payload size of long time series, raw vs downsampled.
+
+Run from the repository root:
+    python final/benchmarks/bench_downsample.py [--target 2000] [--sizes 10000 100000 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from charts import chart_spec, render_line_chart  # noqa: E402
+from downsample import downsample_dataframe  # noqa: E402
+
+
+def synthetic_series(n, seed=0):
+    # Daily cycle + noise + a few isolated spikes, at a 5 s cadence like the airQ sensors
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2024-01-01', periods=n, freq='5s')
+    t = np.arange(n)
+    values = 600 + 150 * np.sin(2 * np.pi * t / 17280) + rng.normal(0, 10, n)
+    spikes = rng.choice(n, size=5, replace=False)
+    values[spikes] += 1500
+    return pd.DataFrame({'timestamp': timestamps, 'co2': values})
+
+
+def render_seconds(df, path):
+    start = time.perf_counter()
+    render_line_chart(df, chart_spec(df, 'co2'), path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', type=int, default=2000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--method', choices=['lttb', 'minmax'], default='lttb')
+    args = parser.parse_args()
+
+    header = f"{'points':>9} {'downsample s':>12} {'render raw s':>12} {'render ds s':>11} " \
+             f"{'payload raw':>12} {'payload ds':>10} {'max kept':>8}"
+    print(header)
+    print('-' * len(header))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'chart.png')
+        for n in args.sizes:
+            df = synthetic_series(n)
+
+            start = time.perf_counter()
+            small = downsample_dataframe(df, args.target, args.method)
+            downsample_s = time.perf_counter() - start
+
+            raw_s = render_seconds(df, path)
+            small_s = render_seconds(small, path)
+            raw_bytes = len(df.to_json(orient='split', date_format='iso'))
+            small_bytes = len(small.to_json(orient='split', date_format='iso'))
+            peak_kept = small['co2'].max() == df['co2'].max()
+
+            print(f"{n:>9} {downsample_s:>12.4f} {raw_s:>12.3f} {small_s:>11.3f} "
+                  f"{raw_bytes / 1e6:>10.2f}MB {small_bytes / 1e3:>8.1f}kB {str(peak_kept):>8}")
+
+
+if __name__ == '__main__':
+    main()
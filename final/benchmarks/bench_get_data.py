@@ -0,0 +1,123 @@
+"""
+End-to-end latency and throughput of /get_data, with the LLM replayed from a cassette.
+
+Unless --url is given, the engine is served in-process with the "replay" LLM backend (see
+fake_llm.py), so the numbers do not depend on the OpenAI API. The response cache is disabled
+unless --cache is given, so every request runs the whole pipeline.
+
+Run from the repository root:
+    python final/benchmarks/bench_get_data.py [--requests 200] [--concurrency 8] [--per-token-s 0.01]
+"""
+import os
+import sys
+import json
+import time
+import resource
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+FINAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (room, question): fast path series and aggregate, agent text answer and agent chart
+DEFAULT_QUERIES = [
+    ("ROOF", "Please provide me the entire set of wind speed values."),
+    ("ROOF", "What was the average air temperature in the last 24 hours?"),
+    ("ROOF", "When was the highest wind speed and how strong were the gusts?"),
+    ("RITA", "Plot when the co2 and temperature changed in RITA"),
+]
+
+
+def serve_in_process(args):
+    # The backend and the cache are configured through the environment, before the engine is imported
+    os.environ['CARECONNECT_LLM_BACKEND'] = 'replay'
+    os.environ['CARECONNECT_REPLAY_FILE'] = args.cassette
+    if args.first_token_s is not None:
+        os.environ['REPLAY_FIRST_TOKEN_S'] = str(args.first_token_s)
+    if args.per_token_s is not None:
+        os.environ['REPLAY_PER_TOKEN_S'] = str(args.per_token_s)
+    if not args.cache:
+        os.environ['RESPONSE_CACHE_ENTRIES'] = '0'
+
+    sys.path.insert(0, FINAL_DIR)
+    from werkzeug.serving import make_server
+    from Engine import app, engine_state
+
+    engine_state.refresh()
+    # One access log line per request would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='benchmark a running engine instead of serving one in-process')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=4)
+    parser.add_argument('--queries', help='JSON file with a list of [room, question] pairs')
+    parser.add_argument('--cassette', default=os.path.join(FINAL_DIR, 'benchmarks', 'cassettes', 'get_data.json'))
+    parser.add_argument('--first-token-s', type=float, help='override the latency to the first token of the cassette')
+    parser.add_argument('--per-token-s', type=float, help='override the latency per token of the cassette')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as queries_file:
+            queries = [tuple(pair) for pair in json.load(queries_file)]
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        base_url, server = serve_in_process(args)
+
+    sessions = threading.local()
+
+    def get_data(i):
+        # One keep-alive session per client thread
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        room_choice, input_query = queries[i % len(queries)]
+        start = time.perf_counter()
+        try:
+            response = sessions.session.get(f"{base_url}/get_data",
+                                            params={"room_choice": room_choice, "input_query": input_query})
+            body = response.json()
+            ok = response.status_code == 200 and "served_by" in body
+            served_by = body.get("served_by", "error")
+        except (requests.RequestException, ValueError):
+            ok, served_by = False, "error"
+        return time.perf_counter() - start, ok, served_by
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(get_data, range(args.warmup)))
+        start = time.perf_counter()
+        results = list(pool.map(get_data, range(args.requests)))
+        wall_s = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+
+    latencies_ms = np.array([seconds for seconds, _, _ in results]) * 1000
+    errors = sum(1 for _, ok, _ in results if not ok)
+    print(f"requests     {args.requests} (concurrency {args.concurrency}, errors {errors})")
+    print(f"throughput   {args.requests / wall_s:.2f} req/s")
+    print(f"latency ms   p50 {np.percentile(latencies_ms, 50):.1f}  p95 {np.percentile(latencies_ms, 95):.1f}  "
+          f"p99 {np.percentile(latencies_ms, 99):.1f}  max {latencies_ms.max():.1f}")
+    for served_by, count in sorted(Counter(served_by for _, _, served_by in results).items()):
+        path_ms = np.array([seconds for seconds, _, path in results if path == served_by]) * 1000
+        print(f"  {served_by:<11} {count:>5} requests, p50 {np.percentile(path_ms, 50):.1f} ms")
+    if server is not None:
+        # ru_maxrss is in kB on Linux; it covers the in-process engine and the clients
+        print(f"peak RSS     {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Latency of window aggregates (avg/min/max per source) on the raw readings vs the rollups.
+
+A synthetic multi-year history at a 5-minute cadence is written to a temporary SQLite database
+with the schema of the engine (loader.py, rollups.py). The rollups are first built from the
+bulk-loaded readings, then a batch of extra readings measures the insert cost of the trigger.
+
+Run from the repository root:
+    python final/benchmarks/bench_rollups.py [--years 3] [--sources 7] [--repeat 5]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from loader import READINGS_TABLE, _ensure_readings_table  # noqa: E402
+from rollups import ensure_rollups, aggregate_range  # noqa: E402
+
+STEP_MS = 300_000
+DAY_MS = 86_400_000
+START_MS = 1_640_995_200_000  # 2022-01-01
+
+WINDOWS = [('day', DAY_MS), ('week', 7 * DAY_MS), ('month', 30 * DAY_MS), ('year', 365 * DAY_MS), ('all', None)]
+
+
+def synthetic_readings(sources, n, seed=0):
+    # Daily cycle + noise per source, one co2 reading every 5 minutes
+    rng = np.random.default_rng(seed)
+    ts = START_MS + np.arange(n, dtype=np.int64) * STEP_MS
+    for i in range(sources):
+        values = 600 + 50 * i + 150 * np.sin(2 * np.pi * np.arange(n) / 288) + rng.normal(0, 10, n)
+        yield from zip([f"room_Q{i}"] * n, ['co2'] * n, ts.tolist(), values.round(3).tolist())
+
+
+def raw_aggregate(conn, start_ms, end_ms):
+    return conn.execute(text(
+        f"SELECT source, COUNT(value), SUM(value), MIN(value), MAX(value) FROM {READINGS_TABLE} "
+        f"WHERE metric = 'co2' AND ts_epoch_ms >= :lo AND ts_epoch_ms < :hi GROUP BY source"),
+        {"lo": start_ms, "hi": end_ms}).all()
+
+
+def best_seconds(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def same(raw_rows, rollup_rows):
+    raw = {row[0]: row[1:] for row in raw_rows}
+    rollup = {row[0]: row[1:] for row in rollup_rows}
+    return raw.keys() == rollup.keys() and all(
+        raw[source][0] == rollup[source][0] and np.allclose(raw[source][1:], rollup[source][1:])
+        for source in raw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--sources', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--append', type=int, default=10_000, help='readings inserted to time the trigger')
+    args = parser.parse_args()
+
+    n = int(args.years * 365 * DAY_MS // STEP_MS)
+    end_ms = START_MS + n * STEP_MS
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        with engine.begin() as conn:
+            _ensure_readings_table(conn)
+            start = time.perf_counter()
+            conn.exec_driver_sql(f"INSERT INTO {READINGS_TABLE} VALUES (?, ?, ?, ?)",
+                                 list(synthetic_readings(args.sources, n)))
+            load_s = time.perf_counter() - start
+            start = time.perf_counter()
+            ensure_rollups(conn, READINGS_TABLE)
+            build_s = time.perf_counter() - start
+        print(f"readings     {args.sources * n} ({args.sources} sources x {args.years:g} years), "
+              f"loaded in {load_s:.1f} s, rollups built in {build_s:.1f} s")
+
+        with engine.connect() as conn:
+            # Raw vs rollup inserts of the same batch, on a fresh time range of one source
+            extra = [('room_Qextra', 'co2', end_ms + i * STEP_MS, 600.0) for i in range(args.append)]
+            for label, table in [('raw', '_readings_bench'), ('rollups', READINGS_TABLE)]:
+                if table != READINGS_TABLE:
+                    # Same keys and index as the readings table, without the trigger
+                    conn.exec_driver_sql(f"CREATE TEMP TABLE {table} (source TEXT, metric TEXT, ts_epoch_ms INTEGER, "
+                                         f"value REAL, PRIMARY KEY (source, metric, ts_epoch_ms)) WITHOUT ROWID")
+                    conn.exec_driver_sql(f"CREATE INDEX temp.{table}_metric_ts ON {table} (metric, ts_epoch_ms)")
+                start = time.perf_counter()
+                conn.exec_driver_sql(f"INSERT INTO {table} VALUES (?, ?, ?, ?)", extra)
+                print(f"insert {label:<8} {(time.perf_counter() - start) / args.append * 1e6:.1f} us/reading")
+            conn.rollback()
+
+            header = f"{'window':>7} {'raw ms':>9} {'rollup ms':>9} {'speedup':>8} {'equal':>6}"
+            print(header)
+            print('-' * len(header))
+            for label, length_ms in WINDOWS:
+                # Unaligned bounds, so every level of the decomposition is exercised
+                hi = end_ms - 7 * 60_000
+                lo = START_MS if length_ms is None else hi - length_ms
+                raw_s, raw_rows = best_seconds(lambda: raw_aggregate(conn, lo, hi), args.repeat)
+                rollup_s, (_, _, rollup_rows) = best_seconds(lambda: aggregate_range(conn, 'co2', lo, hi), args.repeat)
+                print(f"{label:>7} {raw_s * 1000:>9.2f} {rollup_s * 1000:>9.2f} {raw_s / rollup_s:>7.1f}x "
+                      f"{str(same(raw_rows, rollup_rows)):>6}")
+
+
+if __name__ == '__main__':
+    main()
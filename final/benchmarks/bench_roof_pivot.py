@@ -0,0 +1,109 @@
+"""
+Time and peak memory of pivoting a multi-year Zentra long-format export into the wide rooftop
+CSV: the former in-memory groupby + pivot_table + per-column unit lookup, vs the streaming
+RooftopPivot (roof_pivot.py).
+
+The export is written and each method run in its own process, so that the peak RSS of a method
+is its own (on Linux, a child starts from the peak RSS of its parent).
+
+Run from the repository root:
+    python final/benchmarks/bench_roof_pivot.py [--years 3] [--chunksize 100000]
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MQTT Client'))
+from roof_pivot import RooftopPivot  # noqa: E402
+
+MEASUREMENTS = [('Air Temperature', ' °C'), ('Atmospheric Pressure', ' kPa'), ('Solar Radiation', ' W/m²'),
+                ('Precipitation', ' mm'), ('Wind Speed', ' m/s'), ('Gust Speed', ' m/s'), ('VPD', ' kPa'),
+                ('Wind Direction', ' °'), ('Vapor Pressure', ' kPa'), ('Max Precip Rate', ' mm/h')]
+
+
+def write_export(path, records, block=50_000):
+    # Newest first like the API's default order, one row per measurement
+    with open(path, 'w') as export:
+        export.write('timestamp_utc,tz_offset,mrid,measurement,value,units,port_num,sensor_sn\n')
+        rng = np.random.default_rng(0)
+        for first in range(records, 0, -block):
+            mrids = np.arange(first, max(first - block, 0), -1)
+            frame = pd.DataFrame({
+                'timestamp_utc': np.repeat(1_640_995_200 + (mrids - 1) * 300, len(MEASUREMENTS)),
+                'tz_offset': 7200,
+                'mrid': np.repeat(mrids, len(MEASUREMENTS)),
+                'measurement': np.tile([m for m, _ in MEASUREMENTS], len(mrids)),
+                'value': rng.normal(10, 3, len(mrids) * len(MEASUREMENTS)).round(2),
+                'units': np.tile([u for _, u in MEASUREMENTS], len(mrids)),
+                'port_num': 1,
+                'sensor_sn': 'A4100209',
+            })
+            frame.to_csv(export, index=False, header=False)
+
+
+def in_memory(export, output, chunksize):
+    # The former roof_mqtt.py conversion
+    df = pd.read_csv(export)
+    grouped_df = df.groupby(['timestamp_utc', 'sensor_sn', 'measurement', 'units']).agg({'value': 'sum'}).reset_index()
+    pivot_df = grouped_df.pivot_table(index=['timestamp_utc', 'sensor_sn'], columns='measurement',
+                                      values='value').reset_index()
+    for measurement in pivot_df.columns[2:]:
+        unit = grouped_df.loc[grouped_df['measurement'] == measurement, 'units'].iloc[0]
+        pivot_df.rename(columns={measurement: f'{measurement} ({unit})'}, inplace=True)
+    pivot_df.columns = pivot_df.columns.str.replace(' ', '_')
+    pivot_df.columns = pivot_df.columns.str.replace(r'_[\(\[].*?[\)\]]', '', regex=True)
+    pivot_df.to_csv(output, index=False)
+
+
+def streaming(export, output, chunksize):
+    pivot = RooftopPivot(output, chunksize, tmp_dir=os.path.dirname(output))
+    pivot.add_csv(export)
+    pivot.finish()
+
+
+def measure(method, export, output, chunksize, results):
+    start = time.perf_counter()
+    method(export, output, chunksize)
+    # ru_maxrss is in kB on Linux
+    results.put((time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    args = parser.parse_args()
+
+    records = int(args.years * 365 * 288)
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        export = os.path.join(tmp, 'export.csv')
+        process = context.Process(target=write_export, args=(export, records))
+        process.start()
+        process.join()
+        print(f"export       {records * len(MEASUREMENTS)} rows, {os.path.getsize(export) / 1e6:.0f} MB")
+
+        outputs = {}
+        for name, method in [('in-memory', in_memory), ('streaming', streaming)]:
+            outputs[name] = os.path.join(tmp, f'{name}.csv')
+            results = context.Queue()
+            process = context.Process(target=measure, args=(method, export, outputs[name], args.chunksize, results))
+            process.start()
+            seconds, peak_mb = results.get()
+            process.join()
+            print(f"{name:<12} {seconds:>6.1f} s   peak RSS {peak_mb:>7.0f} MB")
+
+        reference, streamed = pd.read_csv(outputs['in-memory']), pd.read_csv(outputs['streaming'])
+        same = list(reference.rename(columns={'timestamp_utc': 'timestamp'}).columns) == list(streamed.columns) and \
+            np.allclose(reference.iloc[:, 2:].to_numpy(), streamed.iloc[:, 2:].to_numpy())
+        print(f"same output  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Rooftop sync (roof_mqtt.py) against the local Zentra stand-in (zentra_stub.py).
+
+For each number of workers, a full sync of --records records runs into an empty directory,
+with --latency-s per request and --fail-rate of the requests failing with a 503. The report
+shows the wall time, the requests made (retries included) and whether every record arrived.
+A resumed sync then fetches the --new-records added to the station meanwhile.
+
+Run from the repository root:
+    python final/benchmarks/bench_roof_sync.py [--records 20000] [--latency-s 0.1] [--workers 1 4 8]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MQTT Client'))
+os.environ.setdefault('ALERTS', 'off')
+import roof_mqtt  # noqa: E402
+from zentra_stub import ZentraStub, MEASUREMENTS, serve  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20_000)
+    parser.add_argument('--new-records', type=int, default=500)
+    parser.add_argument('--per-page', type=int, default=1000)
+    parser.add_argument('--latency-s', type=float, default=0.1)
+    parser.add_argument('--fail-rate', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+    # The retry warnings are expected with a failure rate
+    logging.getLogger().setLevel(logging.ERROR)
+
+    roof_mqtt.per_page = args.per_page
+    roof_mqtt.backoff_s = 0.05
+    header = f"{'workers':>7} {'full sync s':>11} {'requests':>8} {'records':>8} {'complete':>8} " \
+             f"{'resume s':>8} {'resumed':>7} {'complete':>8}"
+    print(header)
+    print('-' * len(header))
+    cwd = os.getcwd()
+    for workers in args.workers:
+        stub = ZentraStub(args.records, latency_s=args.latency_s, fail_rate=args.fail_rate)
+        server = serve(stub, port=0)
+        roof_mqtt.url = f"http://127.0.0.1:{server.server_port}/api/v3/get_readings/"
+        roof_mqtt.workers = workers
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                start = time.perf_counter()
+                roof_mqtt.sync()
+                full_s = time.perf_counter() - start
+                requests = stub.requests
+                stored = pd.read_csv(roof_mqtt.output_file_path)
+                complete = len(stored) == args.records and stored.notna().all().all() and \
+                    len(stored.columns) == len(MEASUREMENTS) + 2
+
+                stub.add_records(args.new_records)
+                start = time.perf_counter()
+                resumed = roof_mqtt.sync()
+                resume_s = time.perf_counter() - start
+                stored = pd.read_csv(roof_mqtt.output_file_path)
+                resumed_complete = len(stored) == args.records + args.new_records and stored['timestamp'].is_unique
+            finally:
+                os.chdir(cwd)
+                server.shutdown()
+        print(f"{workers:>7} {full_s:>11.2f} {requests:>8} {len(stored) - args.new_records:>8} {str(complete):>8} "
+              f"{resume_s:>8.2f} {resumed:>7} {str(resumed_complete):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Time to get the joint angles of the robot arm trajectories: the former readlines + float() per
+value parser of open_window.py, the vectorized parse of traj_loader.py, and the memory-mapped
+sidecar cache of later runs.
+
+The trajectories are copied to a temporary directory, so the cache is written there.
+
+Run from the repository root:
+    python final/benchmarks/bench_traj_loader.py [--repeat 20]
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+ROBOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Robot_Manipulator')
+sys.path.insert(0, ROBOT_DIR)
+from traj_loader import parse_traj_file, load_trajectory  # noqa: E402
+
+
+def readlines_parser(file_path):
+    # The former parse_traj_file of open_window.py
+    trajectory_data = []
+    frequency = 250.0
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+        if lines[0].startswith("# frequency="):
+            frequency = float(lines[0].split('=')[1].strip())
+        for line in lines[1:]:
+            line = line.strip().rstrip(',')
+            if line:
+                trajectory_data.append(list(map(float, line.split(','))))
+    return trajectory_data, frequency
+
+
+def best_ms(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    header = f"{'trajectory':<24} {'steps':>6} {'readlines ms':>12} {'loadtxt ms':>10} {'first load ms':>13} " \
+             f"{'cached ms':>9} {'same':>5}"
+    print(header)
+    print('-' * len(header))
+    with tempfile.TemporaryDirectory() as tmp:
+        for source in sorted(glob.glob(os.path.join(ROBOT_DIR, 'trajectories', '*.traj'))):
+            file_path = shutil.copy(source, tmp)
+            readlines_ms, (reference, reference_frequency) = best_ms(lambda: readlines_parser(file_path), args.repeat)
+            loadtxt_ms, _ = best_ms(lambda: parse_traj_file(file_path), args.repeat)
+            # Parse + write of the sidecars, once
+            first_ms, _ = best_ms(lambda: load_trajectory(file_path), 1)
+            cached_ms, (trajectory, frequency) = best_ms(lambda: load_trajectory(file_path), args.repeat)
+            same = isinstance(trajectory, np.memmap) and frequency == reference_frequency and \
+                np.array_equal(trajectory, np.array(reference)[:, :7])
+            print(f"{os.path.basename(source):<24} {len(trajectory):>6} {readlines_ms:>12.2f} {loadtxt_ms:>10.2f} "
+                  f"{first_ms:>13.2f} {cached_ms:>9.3f} {str(same):>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Playback timing of a robot arm trajectory on the offline stand-in arm (fake_xarm.py), for a few
+durations of the SDK call: the former send + sleep(1 / frequency) loop of open_window.py vs the
+deadline-scheduled TrajectoryStreamer (traj_streamer.py), in position and servo mode.
+
+Run from the repository root:
+    python final/benchmarks/bench_traj_streamer.py [--steps 1000] [--latency-ms 0.5 2 6]
+"""
+import os
+import sys
+import time
+import argparse
+
+ROBOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Robot_Manipulator')
+sys.path.insert(0, ROBOT_DIR)
+from fake_xarm import FakeXArmAPI  # noqa: E402
+from traj_loader import load_trajectory  # noqa: E402
+from traj_streamer import TrajectoryStreamer, playback_stats  # noqa: E402
+
+
+def sleep_loop(arm, trajectory, frequency):
+    # The former perform_movement of open_window.py
+    time_step = 1.0 / frequency
+    start = time.perf_counter()
+    for data_point in trajectory.tolist():
+        arm.set_servo_angle(angle=data_point[:7], wait=False, is_radian=True)
+        time.sleep(time_step)
+    send_times = [received for received, _, _ in arm.commands]
+    return playback_stats(send_times, list(range(len(send_times))), start, frequency, len(trajectory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trajectory', default=os.path.join(ROBOT_DIR, 'trajectories', 'Opening_Window.traj'))
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, nargs='+', default=[0.5, 2.0, 6.0])
+    parser.add_argument('--jitter-ms', type=float, default=0.5)
+    args = parser.parse_args()
+
+    trajectory, frequency = load_trajectory(args.trajectory, cache=False)
+    trajectory = trajectory[:args.steps]
+    print(f"{len(trajectory)} points at {frequency:.0f} Hz, nominal {(len(trajectory) - 1) / frequency:.2f} s\n")
+    header = f"{'call ms':>7} {'playback':<17} {'duration s':>10} {'speed':>6} {'rate Hz':>7} {'skipped':>7} " \
+             f"{'late p99 ms':>11} {'late max ms':>11} {'jitter p99 ms':>13}"
+    print(header)
+    print('-' * len(header))
+    for latency_ms in args.latency_ms:
+        runs = [
+            ('sleep loop', lambda arm: sleep_loop(arm, trajectory, frequency)),
+            ('deadline position', lambda arm: TrajectoryStreamer(arm, frequency, 'position').stream(trajectory)),
+            ('deadline servo', lambda arm: TrajectoryStreamer(arm, frequency, 'servo', settle_s=0).stream(trajectory)),
+        ]
+        for name, run in runs:
+            stats = run(FakeXArmAPI(latency_s=latency_ms / 1000, jitter_s=args.jitter_ms / 1000))
+            print(f"{latency_ms:>7.1f} {name:<17} {stats['duration_s']:>10.2f} {stats['playback_speed']:>6.3f} "
+                  f"{stats['rate_hz']:>7.1f} {stats['skipped']:>7} {stats['lateness_p99_ms']:>11.1f} "
+                  f"{stats['lateness_max_ms']:>11.1f} {stats['jitter_p99_ms']:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+CHART_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def chart_id(df, spec):
+    """
+    Content address of a chart: a SHA-256 over the result data (values and column names) and the chart spec.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    digest.update(json.dumps(spec, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ChartStore:
+    """
+    Size-bounded, content-addressed store of rendered charts.
+
+    Charts are saved as <chart id>.png, so an identical (data, spec) pair is rendered only
+    once and concurrent requests can never overwrite each other's image. When the total size
+    exceeds max_bytes, the least recently used charts are deleted.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._charts = OrderedDict()  # chart id -> size, least recently used first
+        self._bytes = 0
+        self._stats = {"hits": 0, "renders": 0, "evictions": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            stem, extension = os.path.splitext(name)
+            if extension == '.png' and CHART_ID_PATTERN.match(stem):
+                stat = os.stat(os.path.join(directory, name))
+                existing.append((stat.st_mtime, stem, stat.st_size))
+        for _, stem, size in sorted(existing):
+            self._charts[stem] = size
+            self._bytes += size
+
+    def path(self, chart_id):
+        """
+        Returns the file of a stored chart, or None if the id is unknown or malformed.
+        """
+        if not CHART_ID_PATTERN.match(chart_id or ''):
+            return None
+        with self._lock:
+            if chart_id not in self._charts:
+                return None
+        return os.path.join(self.directory, chart_id + '.png')
+
+    def get_or_render(self, df, spec, render):
+        """
+        Returns the id of the chart for (df, spec), rendering it only if it is not stored yet.
+
+        Args:
+            df (DataFrame): Result rows of the query.
+            spec (dict): Chart spec.
+            render (callable): render(df, spec, img_path), writes the PNG to img_path.
+
+        Returns:
+            str: The chart id.
+        """
+        key = chart_id(df, spec)
+        final_path = os.path.join(self.directory, key + '.png')
+        with self._lock:
+            if key in self._charts and os.path.exists(final_path):
+                self._charts.move_to_end(key)
+                self._stats["hits"] += 1
+                return key
+
+        # Render to a private file, then move it into place atomically
+        tmp_path = os.path.join(self.directory, f'.{key}.{threading.get_ident()}.png')
+        render(df, spec, tmp_path)
+        os.replace(tmp_path, final_path)
+        size = os.path.getsize(final_path)
+
+        with self._lock:
+            self._bytes += size - self._charts.pop(key, 0)
+            self._charts[key] = size
+            self._stats["renders"] += 1
+            while self._bytes > self.max_bytes and len(self._charts) > 1:
+                old_key, old_size = self._charts.popitem(last=False)
+                self._bytes -= old_size
+                self._stats["evictions"] += 1
+                try:
+                    os.remove(os.path.join(self.directory, old_key + '.png'))
+                except FileNotFoundError:
+                    pass
+        return key
+
+    def stats(self):
+        """
+        Returns the hit/render/eviction counters and the current size of the store.
+        """
+        with self._lock:
+            return dict(self._stats, charts=len(self._charts), bytes=self._bytes)
@@ -0,0 +1,110 @@
+import threading
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # No GUI backend in the server process
+from matplotlib.colors import is_color_like
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Column names recognized as the time axis
+TIME_COLUMN_NAMES = ('timestamp', 'time', 'datetime', 'date', 'timestamp_utc')
+
+# Longest title and y axis label kept, so a long question or style hint cannot overflow the chart
+MAX_TITLE_LENGTH = 100
+MAX_LABEL_LENGTH = 40
+
+# One figure reused for every chart. It is not registered with pyplot, so nothing accumulates
+# in pyplot's figure manager; it is cleared after each render and guarded by a lock because
+# Flask serves requests from several threads.
+_figure = Figure(figsize=(10, 5), dpi=100)
+FigureCanvasAgg(_figure)
+_figure_lock = threading.Lock()
+
+
+def find_time_column(df):
+    """
+    Returns the name of the column holding timestamps, or None if the DataFrame has none.
+    """
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            return column
+    for column in df.columns:
+        if str(column).lower() in TIME_COLUMN_NAMES:
+            return column
+    return None
+
+
+def chart_spec(df, input_query='', style=None):
+    """
+    Derives what to plot from the DataFrame: the time column on the x axis and every numeric
+    column on the y axis.
+
+    Args:
+        df (DataFrame): Result rows of the query.
+        input_query (str): The user question, used as the default title.
+        style (dict, optional): Styling hints ("title", "y_label", "color") overriding the defaults.
+
+    Returns:
+        dict: The chart spec, or None if there is nothing numeric to plot.
+    """
+    x = find_time_column(df)
+    y = [column for column in df.columns
+         if column != x and pd.to_numeric(df[column], errors='coerce').notna().any()]
+    if not y:
+        return None
+
+    spec = {
+        "x": x,
+        "y": y,
+        "title": _shorten(input_query.strip() or ', '.join(y), MAX_TITLE_LENGTH),
+        "x_label": x or 'index',
+        "y_label": _shorten(y[0] if len(y) == 1 else 'value', MAX_LABEL_LENGTH),
+        "color": None,
+    }
+    style = {key: value.strip() for key, value in (style or {}).items() if isinstance(value, str) and value.strip()}
+    if "title" in style:
+        spec["title"] = _shorten(style["title"], MAX_TITLE_LENGTH)
+    if "y_label" in style:
+        spec["y_label"] = _shorten(style["y_label"], MAX_LABEL_LENGTH)
+    # An invalid colour name would make the plot fail; the default colour is used instead
+    if "color" in style and is_color_like(style["color"]):
+        spec["color"] = style["color"]
+    return spec
+
+
+def _shorten(label, max_length):
+    return label if len(label) <= max_length else label[:max_length - 1].rstrip() + '…'
+
+
+def render_line_chart(df, spec, img_path):
+    """
+    Renders a line chart of the DataFrame following the spec and saves it as PNG.
+
+    Args:
+        df (DataFrame): Result rows of the query.
+        spec (dict): Chart spec returned by chart_spec.
+        img_path (str): Where to save the image.
+
+    Returns:
+        str: The image path.
+    """
+    x_values = pd.to_datetime(df[spec["x"]]) if spec["x"] is not None else df.index
+    with _figure_lock:
+        try:
+            ax = _figure.add_subplot(1, 1, 1)
+            for column in spec["y"]:
+                ax.plot(x_values, pd.to_numeric(df[column], errors='coerce'), label=column,
+                        color=spec["color"] if len(spec["y"]) == 1 and is_color_like(spec["color"]) else None,
+                        linewidth=1)
+            ax.set_title(spec["title"])
+            ax.set_xlabel(spec["x_label"])
+            ax.set_ylabel(spec["y_label"])
+            ax.grid(True, alpha=0.3)
+            if len(spec["y"]) > 1:
+                ax.legend()
+            _figure.autofmt_xdate()
+            _figure.savefig(img_path, format='png')
+        finally:
+            # Release the axes and their data before the next request
+            _figure.clf()
+    return img_path
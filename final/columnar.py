@@ -0,0 +1,492 @@
+"""
+Columnar, time-partitioned copy of the room and rooftop tables, for reads of a few columns over a
+time range (e.g. the co2 of one room over a month) that would otherwise scan every column of
+every row of a wide SQLite table.
+
+Layout: <root>/<table>/<period>.<seq>.ccol, the files of a table per month (or day). Each sync
+adds a file (segment) with the rows it copied, and segments are merged once a period has many of
+them, so a sync writes the new rows rather than the whole period. A file holds one contiguous
+typed array per column, 64-byte aligned, followed by a JSON footer with the number of rows, the
+min/max timestamp and rowid, the dtype and offset of each column and, for a merged file, the
+first sequence number it covers:
+
+    [column 0][column 1]...[footer JSON][footer length, uint64 LE][MAGIC]
+
+Timestamps are int64 epoch ms, sorted within a file and across the files of a period; numeric
+columns are float64, text columns (Status, DeviceID, sensor_sn) int32 codes into a list of
+categories kept in the footer. Reads
+only open the files whose [min_ts, max_ts] overlaps the requested range, and memory-map the
+requested columns only, from the first to the last row in range.
+"""
+import os
+import json
+import time
+import struct
+import logging
+import threading
+import functools
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+MAGIC = b'CCOLUMN1'
+TRAILER = struct.Struct('<Q')
+ALIGNMENT = 64
+TIMESTAMP_COLUMN = 'timestamp'
+# SQLite rowid of each row, so copying the same rows twice (after a crash) never duplicates them
+ROWID_COLUMN = '_rowid'
+PARTITION_UNITS = {'month': 'M', 'day': 'D'}
+PARTITION_SUFFIX = '.ccol'
+# Files of a period past which the trailing segments are merged
+MAX_SEGMENTS = 16
+# Seconds a file replaced by a merge is kept for the reads that listed it before the merge
+RETIRED_GRACE_S = 30.0
+# Per table, the last SQLite rowid copied into the store
+SYNC_FILE = '_sync.json'
+
+
+def _encode(values):
+    """
+    Returns (array, categories) of a column: float64 for numbers, int32 codes (-1 for null) and
+    their categories for text.
+    """
+    if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        # A column read back as objects (e.g. null in every row so far) stays numeric if its values are
+        numbers = pd.to_numeric(values, errors='coerce')
+        if numbers.notna().sum() == values.notna().sum():
+            values = numbers
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.to_numpy(dtype='float64', na_value=np.nan), None
+    codes, categories = pd.factorize(values.astype(object).where(values.notna(), None), use_na_sentinel=True)
+    return codes.astype('int32'), [str(category) for category in categories]
+
+
+def _decode(array, categories):
+    if categories is None:
+        return np.asarray(array)
+    return pd.Categorical.from_codes(np.asarray(array), categories=categories).astype(object)
+
+
+def _write_partition(path, frame, covers=None):
+    """
+    Writes a frame sorted by timestamp (epoch ms) as a partition file, atomically. A merged file
+    gives the first sequence number of the files it replaces as covers.
+    """
+    columns = []
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as partition:
+        for name in frame.columns:
+            array, categories = _encode(frame[name]) if name not in (TIMESTAMP_COLUMN, ROWID_COLUMN) else \
+                (frame[name].to_numpy(dtype='int64'), None)
+            partition.write(b'\0' * (-partition.tell() % ALIGNMENT))
+            entry = {"name": name, "dtype": array.dtype.str, "offset": partition.tell()}
+            if categories is not None:
+                entry["categories"] = categories
+            partition.write(np.ascontiguousarray(array).tobytes())
+            columns.append(entry)
+        ts = frame[TIMESTAMP_COLUMN]
+        footer = {"rows": len(frame), "min_ts": int(ts.iloc[0]), "max_ts": int(ts.iloc[-1]),
+                  "max_rowid": int(frame[ROWID_COLUMN].max()), "columns": columns}
+        if covers is not None:
+            footer["covers"] = covers
+        footer = json.dumps(footer).encode()
+        partition.write(footer)
+        partition.write(TRAILER.pack(len(footer)))
+        partition.write(MAGIC)
+    os.replace(tmp_path, path)
+
+
+def _read_footer(path):
+    with open(path, 'rb') as partition:
+        partition.seek(-(TRAILER.size + len(MAGIC)), os.SEEK_END)
+        trailer = partition.read(TRAILER.size + len(MAGIC))
+        if trailer[TRAILER.size:] != MAGIC:
+            raise ValueError(f"{path} is not a columnar partition")
+        (length,) = TRAILER.unpack(trailer[:TRAILER.size])
+        partition.seek(-(TRAILER.size + len(MAGIC) + length), os.SEEK_END)
+        footer = json.loads(partition.read(length))
+    footer["by_name"] = {entry["name"]: entry for entry in footer["columns"]}
+    return footer
+
+
+def _parse_name(name):
+    # '2024-09.000012.ccol' -> ('2024-09', 12); files of older stores, '2024-09.ccol', are sequence 0
+    period, _, seq = name[:-len(PARTITION_SUFFIX)].partition('.')
+    return period, int(seq) if seq else 0
+
+
+def _retry_on_vanished(method):
+    # A file replaced by a merge may be deleted between the listing of a read and its mapping;
+    # a new listing then has the file replacing it
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        for attempt in range(3):
+            try:
+                return method(self, *args, **kwargs)
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+    return wrapper
+
+
+class ColumnarStore:
+    """
+    The columnar copy of the tables under one root directory.
+
+    Rows get in by sync_table, which copies the rows added to a SQLite table since the previous
+    sync into a new segment of each period they fall into. Rows older than the end of a period
+    are merged with the segments after them, to keep the period in time order. Syncs run after
+    each load and on a background thread, never on a request: readers take the rows past
+    synced_rowid from SQLite.
+
+    Syncs are serialized by their own lock; the footer cache, read by the request threads, is
+    guarded by the store's lock. Files are never modified: readers never see a partial file, as
+    every file appears in one rename, and the files replaced by a merge are only deleted by a
+    sync RETIRED_GRACE_S later, so a read that listed them can still map them (and lists the
+    files again if one is gone anyway).
+    """
+
+    def __init__(self, root, partition='month'):
+        if partition not in PARTITION_UNITS:
+            raise ValueError(f"Unknown partitioning {partition!r}, expected one of {sorted(PARTITION_UNITS)}")
+        self.root = root
+        self.partition = partition
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._footers = {}  # Path -> (mtime_ns, size, footer)
+        self._retired = {}  # Table -> {path of a file replaced by a merge: time.monotonic() it was replaced}
+        self._stop = threading.Event()
+        self._sync_thread = None
+
+    def tables(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def partitions(self, table):
+        """
+        Returns the (path, footer) of every partition file of a table, oldest first.
+        """
+        live, _ = self._files(table)
+        return [(path, footer) for period in sorted(live) for _, path, footer in live[period]]
+
+    def _files(self, table):
+        """
+        Returns ({period: [(seq, path, footer)], oldest first}, paths of the files replaced by a merge).
+        """
+        directory = os.path.join(self.root, table)
+        if not os.path.isdir(directory):
+            return {}, []
+        by_period = {}
+        for name in os.listdir(directory):
+            if name.endswith(PARTITION_SUFFIX):
+                period, seq = _parse_name(name)
+                by_period.setdefault(period, []).append((seq, os.path.join(directory, name)))
+
+        live, replaced = {}, []
+        for period, files in by_period.items():
+            # Newest first: a merged file replaces every file from its covers up to itself
+            kept, floor = [], None
+            for seq, path in sorted(files, reverse=True):
+                if floor is not None and seq >= floor:
+                    replaced.append(path)
+                    continue
+                footer = self._footer(path)
+                if footer is None:
+                    continue  # Deleted since the listing, as replaced by a merge
+                kept.append((seq, path, footer))
+                floor = footer.get("covers", seq)
+            live[period] = kept[::-1]
+        return live, replaced
+
+    def _footer(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._footers.get(path)
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            cached = (stat.st_mtime_ns, stat.st_size, _read_footer(path))
+            with self._lock:
+                self._footers[path] = cached
+        return cached[2]
+
+    def max_ts(self, table):
+        """
+        Returns the latest timestamp (epoch ms) of a table, from the footer of its last partition.
+        """
+        partitions = self.partitions(table)
+        return partitions[-1][1]["max_ts"] if partitions else None
+
+    def _overlapping(self, table, start_ms, end_ms):
+        # Partitions holding rows in [start_ms, end_ms), with the slice of their rows in range
+        for path, footer in self.partitions(table):
+            if (start_ms is not None and footer["max_ts"] < start_ms) or (end_ms is not None and footer["min_ts"] >= end_ms):
+                continue
+            ts = self._map(path, footer, TIMESTAMP_COLUMN, 0, footer["rows"])
+            lo = 0 if start_ms is None else int(np.searchsorted(ts, start_ms, side='left'))
+            hi = footer["rows"] if end_ms is None else int(np.searchsorted(ts, end_ms, side='left'))
+            if lo < hi:
+                yield path, footer, lo, hi
+
+    @staticmethod
+    def _map(path, footer, name, lo, hi):
+        entry = footer["by_name"][name]
+        dtype = np.dtype(entry["dtype"])
+        return np.memmap(path, dtype=dtype, mode='r', offset=entry["offset"] + lo * dtype.itemsize, shape=(hi - lo,))
+
+    def _column(self, path, footer, name, lo, hi):
+        # A column added to the table after this partition was written reads as null
+        entry = footer["by_name"].get(name)
+        if entry is None:
+            return np.full(hi - lo, np.nan)
+        return _decode(self._map(path, footer, name, lo, hi), entry.get("categories"))
+
+    @_retry_on_vanished
+    def read(self, table, columns=None, start_ms=None, end_ms=None):
+        """
+        Reads some columns of a table over a time range.
+
+        Args:
+            table (str): Table name, e.g. room_QRITA.
+            columns (list): Columns to read besides the timestamp; all of them if None.
+            start_ms (int): Start of the range (epoch ms, inclusive), or None.
+            end_ms (int): End of the range (epoch ms, exclusive), or None.
+
+        Returns:
+            pd.DataFrame: The timestamp (datetime64[ms]) and the columns, oldest row first.
+        """
+        frames = []
+        for path, footer, lo, hi in self._overlapping(table, start_ms, end_ms):
+            names = columns if columns is not None else \
+                [entry["name"] for entry in footer["columns"] if entry["name"] not in (TIMESTAMP_COLUMN, ROWID_COLUMN)]
+            data = {TIMESTAMP_COLUMN: np.array(self._map(path, footer, TIMESTAMP_COLUMN, lo, hi)).astype('datetime64[ms]')}
+            data.update((name, self._column(path, footer, name, lo, hi)) for name in names)
+            frames.append(pd.DataFrame(data))
+        if not frames:
+            # Typed like a read with rows, so callers can use the datetime accessors either way
+            empty = {TIMESTAMP_COLUMN: np.array([], dtype='datetime64[ms]')}
+            empty.update((name, np.array([], dtype='float64')) for name in columns or [])
+            return pd.DataFrame(empty)
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    @_retry_on_vanished
+    def aggregate(self, table, column, start_ms=None, end_ms=None):
+        """
+        Returns (count, sum, min, max) of the non-null values of a numeric column over a time
+        range, computed on the mapped arrays without copying them.
+        """
+        count, total, minimum, maximum = 0, 0.0, None, None
+        for path, footer, lo, hi in self._overlapping(table, start_ms, end_ms):
+            if column not in footer["by_name"]:
+                continue
+            values = self._map(path, footer, column, lo, hi)
+            valid = values[~np.isnan(values)]
+            if len(valid):
+                count += len(valid)
+                total += float(valid.sum())
+                minimum = float(valid.min()) if minimum is None else min(minimum, float(valid.min()))
+                maximum = float(valid.max()) if maximum is None else max(maximum, float(valid.max()))
+        return count, total, minimum, maximum
+
+    @_retry_on_vanished
+    def latest(self, table, column, start_ms=None, end_ms=None):
+        """
+        Returns (epoch ms, value) of the last non-null value of a column over a time range, or None.
+        """
+        for path, footer, lo, hi in reversed(list(self._overlapping(table, start_ms, end_ms))):
+            if column not in footer["by_name"]:
+                continue
+            values = self._column(path, footer, column, lo, hi)
+            present = np.flatnonzero(pd.notna(values))
+            if len(present):
+                ts = self._map(path, footer, TIMESTAMP_COLUMN, lo, hi)
+                return int(ts[present[-1]]), values[present[-1]]
+        return None
+
+    def _period(self, ts_ms):
+        # '2024-09' (month) or '2024-09-05' (day) of each epoch ms timestamp
+        return np.asarray(ts_ms, dtype='int64').astype('datetime64[ms]').astype(
+            f'datetime64[{PARTITION_UNITS[self.partition]}]').astype(str)
+
+    def _max_rowid(self, path, footer):
+        # Files written before the footer had max_rowid read it from the rowid column
+        if "max_rowid" in footer:
+            return footer["max_rowid"]
+        return int(self._map(path, footer, ROWID_COLUMN, 0, footer["rows"]).max())
+
+    def _frame(self, path, footer):
+        return pd.DataFrame({entry["name"]: self._column(path, footer, entry["name"], 0, footer["rows"])
+                             for entry in footer["columns"]})
+
+    def _append(self, table, frame):
+        """
+        Adds rows (with epoch ms timestamps and their SQLite rowids) to the periods they fall into,
+        as a new segment of each. Rows whose rowid a period already holds are skipped.
+        """
+        directory = os.path.join(self.root, table)
+        os.makedirs(directory, exist_ok=True)
+        live, replaced = self._files(table)
+        # Left over by a sync that stopped between a merge and the next sync
+        retired = self._retired.setdefault(table, {})
+        for path in replaced:
+            retired.setdefault(path, time.monotonic())
+        periods = self._period(frame[TIMESTAMP_COLUMN])
+        for period in np.unique(periods):
+            rows = frame[periods == period]
+            files = live.get(period, [])
+            if files and (rows[ROWID_COLUMN] <= max(self._max_rowid(path, footer) for _, path, footer in files)).any():
+                # Copied again after a crash: skip the rows already stored
+                stored = np.concatenate([self._map(path, footer, ROWID_COLUMN, 0, footer["rows"]) for _, path, footer in files])
+                rows = rows[~rows[ROWID_COLUMN].isin(stored)]
+                if rows.empty:
+                    continue
+            # Stable, so rows with equal timestamps keep their insertion order
+            rows = rows.sort_values(TIMESTAMP_COLUMN, kind='stable')
+
+            # The files with rows later than the first new row are merged with the new rows, so the
+            # files of the period stay in time order; usually there are none and the rows are appended
+            first_ts = rows[TIMESTAMP_COLUMN].iloc[0]
+            start = next((i for i, (_, _, footer) in enumerate(files) if footer["max_ts"] > first_ts), len(files))
+            if start >= MAX_SEGMENTS:
+                # Too many files: also merge the trailing ones no larger than what is merged after them,
+                # so every row is rewritten a logarithmic number of times
+                start -= 1
+                merged = len(rows) + sum(footer["rows"] for _, _, footer in files[start:])
+                while start > 0 and files[start - 1][2]["rows"] <= merged:
+                    start -= 1
+                    merged += files[start][2]["rows"]
+
+            merge = files[start:]
+            covers = None
+            if merge:
+                covers = merge[0][2].get("covers", merge[0][0])
+                rows = pd.concat([self._frame(path, footer) for _, path, footer in merge] + [rows], ignore_index=True) \
+                    .sort_values(TIMESTAMP_COLUMN, kind='stable')
+            seq = max([seq for seq, _, _ in files] + [0]) + 1
+            _write_partition(os.path.join(directory, f"{period}.{seq:06d}{PARTITION_SUFFIX}"),
+                             rows.reset_index(drop=True), covers)
+            retired.update((path, time.monotonic()) for _, path, _ in merge)
+
+    def _delete_retired(self, table):
+        retired = self._retired.get(table, {})
+        for path, retired_at in list(retired.items()):
+            if time.monotonic() - retired_at < RETIRED_GRACE_S:
+                continue
+            del retired[path]
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._footers.pop(path, None)
+
+    def synced_rowid(self, table):
+        """
+        Returns the last SQLite rowid of a table copied into the store; later rows are only in SQLite.
+        """
+        path = os.path.join(self.root, table, SYNC_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path) as sync_file:
+            return json.load(sync_file)["rowid"]
+
+    def _save_synced_rowid(self, table, rowid):
+        path = os.path.join(self.root, table, SYNC_FILE)
+        with open(path + '.tmp', 'w') as sync_file:
+            json.dump({"rowid": rowid}, sync_file)
+        os.replace(path + '.tmp', path)
+
+    def sync_table(self, conn, table, chunksize=100_000):
+        """
+        Copies the rows added to a SQLite table since the previous sync, by the loader or by the
+        rooms MQTT client writing to the database directly. Rows are appended to SQLite tables,
+        so they are found by rowid without scanning the table.
+
+        Args:
+            conn (Connection): SQLAlchemy connection to the CareConnect database.
+            table (str): Table to copy.
+            chunksize (int): Rows read from SQLite at a time.
+
+        Returns:
+            int: Number of rows copied.
+        """
+        with self._sync_lock:
+            # The files replaced by earlier syncs are no longer read
+            self._delete_retired(table)
+            synced = self.synced_rowid(table)
+            last = conn.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar()
+            if last is None or last <= synced:
+                return 0
+            copied = 0
+            query = text(f'SELECT rowid AS {ROWID_COLUMN}, * FROM "{table}" WHERE rowid > :synced AND rowid <= :last '
+                         f'ORDER BY rowid')
+            for chunk in pd.read_sql(query, conn, params={"synced": synced, "last": last}, chunksize=chunksize):
+                # The wide tables store timestamps as text
+                ts = pd.to_datetime(chunk[TIMESTAMP_COLUMN], errors='coerce')
+                chunk = chunk[ts.notna()].copy()
+                chunk[TIMESTAMP_COLUMN] = ts[ts.notna()].astype('datetime64[ms]').astype('int64')
+                if not chunk.empty:
+                    self._append(table, chunk[[TIMESTAMP_COLUMN, ROWID_COLUMN] + [
+                        column for column in chunk.columns if column not in (TIMESTAMP_COLUMN, ROWID_COLUMN)]])
+                copied += len(chunk)
+            # Only once the partitions are written: a crash in between copies the rows again, and they are skipped
+            self._save_synced_rowid(table, last)
+            return copied
+
+    def sync_tables(self, engine, tables):
+        """
+        Copies the new rows of every table, see sync_table.
+
+        Returns:
+            dict: Table -> rows copied.
+        """
+        with engine.connect() as conn:
+            return {table: self.sync_table(conn, table) for table in tables}
+
+    def start_background_sync(self, engine, tables, interval_s=60.0):
+        """
+        Syncs the tables every interval_s seconds on a daemon thread, so the rows the rooms MQTT
+        client writes to the database directly get into the store between two loads, without
+        any request waiting for it.
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the CareConnect database.
+            tables (callable): Returns the tables to sync.
+            interval_s (float): Seconds between two syncs.
+        """
+        if self._sync_thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.sync_tables(engine, tables())
+                except Exception:
+                    logging.exception("Columnar store sync failed")
+
+        self._sync_thread = threading.Thread(target=run, name='columnar-sync', daemon=True)
+        self._sync_thread.start()
+
+    def stop_background_sync(self):
+        self._stop.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+            self._sync_thread = None
+
+
+def columnar_store_from_env():
+    """
+    Returns the columnar store if STORAGE_BACKEND is "columnar", else None.
+
+    Environment:
+        STORAGE_BACKEND: "sqlite" (default) or "columnar", to also keep a columnar copy of the tables.
+        COLUMNAR_DIR: Root directory of the store (default ./DataBase/columnar).
+        COLUMNAR_PARTITION: "month" (default) or "day", the period of one partition file.
+        COLUMNAR_SYNC_INTERVAL: Seconds between two background syncs of the store (default 60).
+    """
+    if os.environ.get('STORAGE_BACKEND', 'sqlite') != 'columnar':
+        return None
+    return ColumnarStore(os.environ.get('COLUMNAR_DIR', './DataBase/columnar'),
+                         os.environ.get('COLUMNAR_PARTITION', 'month'))
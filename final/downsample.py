@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from charts import find_time_column
+
+# Default number of points kept per chart; a 1000 px wide chart cannot show more anyway
+DEFAULT_TARGET_POINTS = 2000
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: picks `threshold` points of (x, y) that preserve the
+    visual shape of the line, including its peaks.
+
+    The bucket averages are computed for all buckets at once from cumulative sums, but the
+    selection is not vectorized: the triangle of each bucket is anchored on the point picked
+    in the previous bucket, so the loop runs once per output point, with NumPy operations
+    over the bucket. Its cost depends on threshold rather than on len(x). For a fully
+    vectorized decimation, use minmax_indices.
+
+    Args:
+        x (ndarray): Increasing x values (float).
+        y (ndarray): y values (float, no NaN).
+        threshold (int): Number of points to keep.
+
+    Returns:
+        ndarray: Sorted indices of the kept points.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # threshold - 2 buckets over the interior points; the first and last points are always kept
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    starts, ends = edges[:-1], edges[1:]
+    lengths = np.maximum(ends - starts, 1)
+    avg_x = (cum_x[ends] - cum_x[starts]) / lengths
+    avg_y = (cum_y[ends] - cum_y[starts]) / lengths
+    # The point after the last bucket is the last point
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = starts[i], ends[i]
+        if end <= start:
+            end = start + 1
+        # Twice the area of the triangle (selected point, candidate, next bucket average)
+        area = np.abs((x[a] - next_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, threshold):
+    """
+    Min-max decimation, fully vectorized: keeps the minimum and the maximum of each of
+    threshold // 2 equal buckets, so every peak and dip survives.
+
+    Returns:
+        ndarray: Sorted indices of the kept points.
+    """
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+
+    size = -(-n // buckets)  # ceil
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(buckets, size)
+    valid = ~np.isnan(blocks).all(axis=1)
+    offsets = np.arange(buckets)[valid] * size
+    mins = offsets + np.nanargmin(blocks[valid], axis=1)
+    maxs = offsets + np.nanargmax(blocks[valid], axis=1)
+    return np.unique(np.concatenate(([0, n - 1], mins, maxs)))
+
+
+def downsample_dataframe(df, target_points=DEFAULT_TARGET_POINTS, method='lttb'):
+    """
+    Reduces a result DataFrame to about target_points rows before it is plotted or serialized.
+
+    Points are chosen per numeric column (the point budget is shared between the columns) and
+    the rows picked for any column are kept, so each line keeps its own peaks.
+
+    Args:
+        df (DataFrame): Result rows, ordered by the time column if there is one.
+        target_points (int): Approximate number of rows to keep.
+        method (str): "lttb" or "minmax".
+
+    Returns:
+        DataFrame: The kept rows, in their original order.
+    """
+    if len(df) <= target_points:
+        return df
+
+    time_column = find_time_column(df)
+    if time_column is not None:
+        x = pd.to_datetime(df[time_column]).to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+    else:
+        x = np.arange(len(df), dtype=np.float64)
+
+    numeric = {}
+    for column in df.columns:
+        if column == time_column:
+            continue
+        values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+        if not np.isnan(values).all():
+            numeric[column] = values
+    if not numeric:
+        return df
+
+    per_column = max(3, target_points // len(numeric))
+    keep = []
+    for values in numeric.values():
+        present = np.flatnonzero(~np.isnan(values))
+        if method == 'minmax':
+            chosen = minmax_indices(values[present], per_column)
+        else:
+            chosen = lttb_indices(x[present], values[present], per_column)
+        keep.append(present[chosen])
+    return df.iloc[np.unique(np.concatenate(keep))]
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import time
+import threading
+from types import SimpleNamespace
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class Cassette:
+    """
+    Recorded LLM completions, replayed by matching the prompt.
+
+    A cassette is a JSON file:
+        {"latency": {"first_token_s": 0.4, "per_token_s": 0.01},
+         "completions": [{"match": "<regex>", "responses": ["<completion>", ...]}, ...]}
+
+    The first entry whose regex matches the prompt is used. An entry with several responses
+    replays an agent run: the n-th response answers the prompt of the agent after n tool calls
+    (n = the "Observation:" lines of its scratchpad). The latency of a completion is first_token_s
+    plus per_token_s per generated token, both overridable with REPLAY_FIRST_TOKEN_S and
+    REPLAY_PER_TOKEN_S.
+    """
+
+    def __init__(self, path):
+        with open(path) as cassette_file:
+            data = json.load(cassette_file)
+        latency = data.get("latency", {})
+        self.first_token_s = float(os.environ.get('REPLAY_FIRST_TOKEN_S', latency.get("first_token_s", 0.0)))
+        self.per_token_s = float(os.environ.get('REPLAY_PER_TOKEN_S', latency.get("per_token_s", 0.0)))
+        self.completions = [(re.compile(entry["match"], re.IGNORECASE | re.DOTALL), entry["responses"])
+                            for entry in data["completions"]]
+
+    def completion(self, prompt):
+        """
+        Returns the recorded completion of the prompt.
+
+        Raises:
+            LookupError: If no recorded completion matches the prompt.
+        """
+        # Agent prompts end with "Question: <input>" followed by the scratchpad of the previous steps
+        step = prompt.rsplit("Question:", 1)[-1].count("Observation:")
+        for pattern, responses in self.completions:
+            if pattern.search(prompt):
+                return responses[min(step, len(responses) - 1)]
+        raise LookupError(f"No recorded completion matches the prompt: {prompt[:200]!r}")
+
+
+def count_tokens(textual):
+    # Roughly 4 characters per token, close enough for synthetic latency and usage
+    return max(1, len(textual) // 4)
+
+
+def _tokens(textual):
+    # Words with their trailing whitespace, so the chunks join back to the completion
+    return re.findall(r'\S+\s*|\s+', textual)
+
+
+def _prompt_text(messages):
+    return "\n".join(str(message.content) for message in messages)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Stand-in for ChatOpenAI replaying a cassette, with synthetic latency and token usage.
+    """
+
+    cassette: Cassette
+    model_name: str = "replay"
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return "replay-chat"
+
+    def _completion(self, messages, stop):
+        textual = self.cassette.completion(_prompt_text(messages))
+        # Honor stop words like the real API, e.g. the ReAct agent stops at "\nObservation:"
+        for stop_word in stop or []:
+            textual = textual.split(stop_word, 1)[0]
+        return textual
+
+    def _usage(self, messages, textual):
+        prompt_tokens, completion_tokens = count_tokens(_prompt_text(messages)), count_tokens(textual)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        textual = self._completion(messages, stop)
+        time.sleep(self.cassette.first_token_s + self.cassette.per_token_s * count_tokens(textual))
+        usage = self._usage(messages, textual)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=textual))],
+                          llm_output={"token_usage": usage, "model_name": self.model_name})
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        textual = self._completion(messages, stop)
+        time.sleep(self.cassette.first_token_s)
+        for token in _tokens(textual):
+            time.sleep(self.cassette.per_token_s)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        usage = self._usage(messages, textual)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+            "input_tokens": usage["prompt_tokens"], "output_tokens": usage["completion_tokens"],
+            "total_tokens": usage["total_tokens"]}))
+
+
+class FakeOpenAI:
+    """
+    Stand-in for the OpenAI client replaying a cassette; supports client.chat.completions.create.
+    """
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model=None, messages=(), **kwargs):
+        prompt = "\n".join(str(message["content"]) for message in messages)
+        textual = self.cassette.completion(prompt)
+        time.sleep(self.cassette.first_token_s + self.cassette.per_token_s * count_tokens(textual))
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=textual))],
+            usage=SimpleNamespace(prompt_tokens=count_tokens(prompt), completion_tokens=count_tokens(textual)))
+
+
+_lock = threading.Lock()
+_cassettes = {}
+
+
+def load_cassette(path):
+    """
+    Returns the cassette of the file, loaded once per process.
+    """
+    with _lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
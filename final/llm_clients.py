@@ -0,0 +1,72 @@
+import os
+import threading
+import httpx
+from openai import OpenAI
+from langchain_openai import ChatOpenAI
+from fake_llm import ReplayChatModel, FakeOpenAI, load_cassette
+
+# "openai" calls the API; "replay" answers from the cassette in CARECONNECT_REPLAY_FILE (see fake_llm.py),
+# for benchmarks and tests without API access
+LLM_BACKEND = os.environ.get('CARECONNECT_LLM_BACKEND', 'openai')
+REPLAY_FILE = os.environ.get('CARECONNECT_REPLAY_FILE', './final/benchmarks/cassettes/get_data.json')
+
+# Connection pool shared by every call to the LLM endpoint
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 32))
+LLM_MAX_KEEPALIVE = int(os.environ.get('LLM_MAX_KEEPALIVE', 16))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', 60))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))
+
+_lock = threading.Lock()
+_http_client = None
+_openai_clients = {}  # API key -> OpenAI
+_chat_llms = {}  # (API key, model, temperature) -> ChatOpenAI
+
+
+def get_http_client():
+    """
+    Returns the process-wide HTTP client of the LLM calls.
+
+    Its connections are kept alive and reused across requests, so only the first call to the
+    endpoint pays for the TCP and TLS handshakes. httpx clients are thread safe.
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0))
+        return _http_client
+
+
+def get_openai_client(api_key=None):
+    """
+    Returns the OpenAI client of the given key (default: OPENAI_API_KEY), created once per key.
+    """
+    if LLM_BACKEND == 'replay':
+        return FakeOpenAI(load_cassette(REPLAY_FILE))
+    api_key = api_key or os.environ.get('OPENAI_API_KEY')
+    http_client = get_http_client()
+    with _lock:
+        if api_key not in _openai_clients:
+            _openai_clients[api_key] = OpenAI(api_key=api_key, http_client=http_client)
+        return _openai_clients[api_key]
+
+
+def get_chat_llm(model="gpt-4o-mini", temperature=0.1):
+    """
+    Returns the ChatOpenAI of the given model and temperature, created once per API key.
+
+    The key is read from OPENAI_API_KEY, so a changed key (see load_openai_key) gets a new client.
+    """
+    if LLM_BACKEND == 'replay':
+        return ReplayChatModel(cassette=load_cassette(REPLAY_FILE), model_name=model)
+    key = (os.environ.get('OPENAI_API_KEY'), model, temperature)
+    http_client = get_http_client()
+    with _lock:
+        if key not in _chat_llms:
+            # stream_usage: streamed calls also report their token usage (see metrics.py)
+            _chat_llms[key] = ChatOpenAI(temperature=temperature, model=model, http_client=http_client,
+                                         stream_usage=True)
+        return _chat_llms[key]
@@ -0,0 +1,284 @@
+import os
+import io
+import glob
+import hashlib
+import pandas as pd
+from sqlalchemy import text, inspect
+
+from rollups import ensure_rollups
+
+# Table keeping one high-water mark per loaded table
+STATE_TABLE = '_ingest_state'
+
+# Number of bytes before the stored offset that must be unchanged for the file to be tailed
+TAIL_CHECK_BYTES = 256
+
+# Long-format copy of every numeric reading of every room and the rooftop: one row per
+# (source table, metric, epoch ms). Questions across rooms become one indexed range scan,
+# and a new room or sensor field needs no schema change.
+READINGS_TABLE = 'readings'
+
+# Sources whose existing rows have been copied into the readings table
+READINGS_BACKFILL_TABLE = '_readings_backfill'
+
+# Columns of the wide tables that are not sensor metrics
+NON_METRIC_COLUMNS = {'timestamp', 'Status', 'DeviceID', 'sensor_sn'}
+
+
+def discover_sources(rooms_dir, rooftop_file):
+    """
+    Lists the CSV sources to load, picking up any new room file that appears in the rooms directory.
+
+    Args:
+        rooms_dir (str): Directory holding the airQ<NAME>.csv files written by the rooms MQTT client.
+        rooftop_file (str): Path of the pivoted rooftop CSV.
+
+    Returns:
+        dict: Table name -> (CSV path, unit of the timestamp column).
+    """
+    sources = {}
+    for file_path in sorted(glob.glob(os.path.join(rooms_dir, 'airQ*.csv'))):
+        device = os.path.splitext(os.path.basename(file_path))[0]  # e.g. airQRITA
+        sources['room_' + device[3:]] = (file_path, 'ms')  # e.g. room_QRITA
+    sources['rooftop'] = (rooftop_file, 's')
+    return sources
+
+
+def _ensure_state_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            file_path TEXT,
+            file_id TEXT,
+            byte_offset INTEGER,
+            tail_hash TEXT,
+            header TEXT,
+            last_ts INTEGER,
+            row_count INTEGER
+        )
+    """))
+
+
+def _ensure_readings_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {READINGS_TABLE} (
+            source TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            ts_epoch_ms INTEGER NOT NULL,
+            value REAL,
+            PRIMARY KEY (source, metric, ts_epoch_ms)
+        ) WITHOUT ROWID
+    """))
+    # Cross-source scans of one metric over a time range
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {READINGS_TABLE}_metric_ts ON {READINGS_TABLE} (metric, ts_epoch_ms)"))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {READINGS_BACKFILL_TABLE} (source TEXT PRIMARY KEY)"))
+
+
+def _append_readings(conn, table, df, ts_ms):
+    """
+    Copies the numeric values of freshly loaded wide rows into the readings table.
+    """
+    metrics = [column for column in df.columns if column not in NON_METRIC_COLUMNS]
+    valid = ts_ms.notna()
+    values = df.loc[valid, metrics].apply(pd.to_numeric, errors='coerce')
+    values.index = ts_ms[valid].astype('int64').to_numpy()
+    # One (ts, metric, value) row per non-null cell
+    stacked = values.stack().dropna()
+    rows = [(table, metric, int(ts), float(value)) for (ts, metric), value in stacked.items()]
+    if rows:
+        # Duplicate readings (same source, metric and time) keep the first value
+        conn.exec_driver_sql(f"INSERT OR IGNORE INTO {READINGS_TABLE} VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def _backfill_readings(conn, table):
+    """
+    Copies the rows a wide table already holds into the readings table, once per table.
+    """
+    if conn.execute(text(f"SELECT 1 FROM {READINGS_BACKFILL_TABLE} WHERE source = :t"), {"t": table}).first():
+        return
+    columns = {column['name']: str(column['type']) for column in inspect(conn).get_columns(table)}
+    # The wide tables store timestamps as text; julianday() converts them to epoch ms in SQL
+    ts_epoch_ms = "CAST(ROUND((julianday(\"timestamp\") - 2440587.5) * 86400000) AS INTEGER)"
+    for column, sql_type in columns.items():
+        if column in NON_METRIC_COLUMNS or sql_type.upper() == 'TEXT':
+            continue
+        conn.execute(text(f"""
+            INSERT OR IGNORE INTO {READINGS_TABLE} (source, metric, ts_epoch_ms, value)
+            SELECT :source, :metric, {ts_epoch_ms}, CAST("{column}" AS REAL) FROM "{table}"
+            WHERE "{column}" IS NOT NULL AND "timestamp" IS NOT NULL
+        """), {"source": table, "metric": column})
+    conn.execute(text(f"INSERT INTO {READINGS_BACKFILL_TABLE} (source) VALUES (:t)"), {"t": table})
+
+
+def _read_state(conn, table):
+    row = conn.execute(text(f"SELECT * FROM {STATE_TABLE} WHERE table_name = :t"), {"t": table}).mappings().first()
+    return dict(row) if row else None
+
+
+def _write_state(conn, state):
+    conn.execute(text(f"""
+        INSERT OR REPLACE INTO {STATE_TABLE}
+            (table_name, file_path, file_id, byte_offset, tail_hash, header, last_ts, row_count)
+        VALUES (:table_name, :file_path, :file_id, :byte_offset, :tail_hash, :header, :last_ts, :row_count)
+    """), state)
+
+
+def _tail_hash(file, offset):
+    # Hash of the bytes right before the offset, used to detect a file rewritten in place
+    start = max(0, offset - TAIL_CHECK_BYTES)
+    file.seek(start)
+    return hashlib.sha1(file.read(offset - start)).hexdigest()
+
+
+def _to_epoch_ms(values, unit):
+    return pd.to_numeric(values, errors='coerce') * (1000 if unit == 's' else 1)
+
+
+def _existing_max_ts(conn, table, existing_tables):
+    # Seeds the high-water mark of a table that was loaded before the state table existed
+    if table not in existing_tables:
+        return None, 0
+    max_ts, count = conn.execute(text(f'SELECT MAX("timestamp"), COUNT(*) FROM "{table}"')).first()
+    if max_ts is None:
+        return None, count
+    return int(pd.Timestamp(max_ts).value // 1_000_000), count
+
+
+def _add_missing_columns(conn, table, df, existing_columns):
+    # New sensor fields show up as new CSV columns; extend the table instead of rebuilding it
+    for column in df.columns:
+        if column not in existing_columns:
+            sql_type = 'REAL' if pd.api.types.is_numeric_dtype(df[column]) else 'TEXT'
+            conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {sql_type}'))
+
+
+def _load_source(conn, table, file_path, unit, existing_tables):
+    """
+    Appends the rows of one CSV that are newer than the table's high-water mark.
+
+    The file is tailed from the byte offset reached by the previous load. If the file was
+    replaced, truncated or rewritten in place, it is re-read from the start and only rows
+    with a timestamp above the high-water mark are kept.
+
+    Returns:
+        tuple: (number of appended rows, whether the table schema changed)
+    """
+    state = _read_state(conn, table)
+    stat = os.stat(file_path)
+    file_id = f"{stat.st_dev}:{stat.st_ino}"
+
+    with open(file_path, 'rb') as file:
+        if state is None:
+            last_ts, row_count = _existing_max_ts(conn, table, existing_tables)
+            state = {"table_name": table, "file_path": file_path, "file_id": file_id, "byte_offset": 0,
+                     "tail_hash": None, "header": None, "last_ts": last_ts, "row_count": row_count}
+        elif (state["file_id"] != file_id or state["file_path"] != file_path
+              or stat.st_size < state["byte_offset"]
+              or _tail_hash(file, state["byte_offset"]) != state["tail_hash"]):
+            # Rotated, truncated or rewritten: start over and rely on the timestamp filter
+            state.update(file_path=file_path, file_id=file_id, byte_offset=0, header=None)
+
+        if stat.st_size == state["byte_offset"]:
+            return 0, False
+
+        restarted = state["byte_offset"] == 0
+        file.seek(state["byte_offset"])
+        if restarted:
+            header_line = file.readline()
+            if not header_line.endswith(b'\n'):
+                return 0, False  # Header still being written
+            state["header"] = header_line.decode().strip()
+            state["byte_offset"] = len(header_line)
+
+        # Only consume complete lines; a partially written last line is picked up next time
+        chunk = file.read(stat.st_size - state["byte_offset"])
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        state["byte_offset"] += len(complete)
+        state["tail_hash"] = _tail_hash(file, state["byte_offset"])
+
+    appended, schema_changed = 0, False
+    if complete.strip():
+        df = pd.read_csv(io.BytesIO(complete), header=None, names=state["header"].split(','))
+        ts_ms = _to_epoch_ms(df['timestamp'], unit)
+        if restarted and state["last_ts"] is not None:
+            df, ts_ms = df[ts_ms > state["last_ts"]], ts_ms[ts_ms > state["last_ts"]]
+
+        if not df.empty:
+            df = df.copy()
+            df['timestamp'] = pd.to_datetime(df['timestamp'], unit=unit)  # Convert to datetime
+            if table in existing_tables:
+                existing_columns = {c['name'] for c in inspect(conn).get_columns(table)}
+                schema_changed = not set(df.columns) <= existing_columns
+                _add_missing_columns(conn, table, df, existing_columns)
+            else:
+                schema_changed = True
+            df.to_sql(table, con=conn, if_exists='append', index=False)
+            _append_readings(conn, table, df, ts_ms)
+            appended = len(df)
+            state["last_ts"] = int(max(ts_ms.max(), state["last_ts"] or 0))
+            state["row_count"] = (state["row_count"] or 0) + appended
+
+    _write_state(conn, state)
+    return appended, schema_changed
+
+
+def load_incremental(engine, sources):
+    """
+    Appends the new rows of every source to its table in a single transaction, so readers
+    never see a table half loaded.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the CareConnect database.
+        sources (dict): Table name -> (CSV path, timestamp unit), see discover_sources.
+
+    Returns:
+        dict: {"appended": {table: new rows}, "schema_changed": bool}
+    """
+    report = {"appended": {}, "schema_changed": False}
+    with engine.begin() as conn:
+        _ensure_state_table(conn)
+        _ensure_readings_table(conn)
+        # Before any new readings are inserted, so the rollup trigger sees all of them
+        ensure_rollups(conn, READINGS_TABLE)
+        existing_tables = set(inspect(conn).get_table_names())
+        tracked = {row[0] for row in conn.execute(text(f"SELECT table_name FROM {STATE_TABLE}"))}
+        for table in sorted(existing_tables & (tracked | set(sources))):
+            # Rows loaded (or written by the rooms MQTT client) before the readings table existed
+            _backfill_readings(conn, table)
+        for table, (file_path, unit) in sources.items():
+            if not os.path.exists(file_path):
+                continue
+            appended, schema_changed = _load_source(conn, table, file_path, unit, existing_tables)
+            report["appended"][table] = appended
+            report["schema_changed"] |= schema_changed
+    return report
+
+
+def loaded_tables(engine):
+    """
+    Returns the names of the tables that hold loaded data.
+    """
+    with engine.connect() as conn:
+        _ensure_state_table(conn)
+        rows = conn.execute(text(f"""
+            SELECT s.table_name FROM {STATE_TABLE} s
+            JOIN sqlite_master m ON m.name = s.table_name AND m.type = 'table'
+            ORDER BY s.table_name
+        """)).all()
+        conn.commit()
+    return [row[0] for row in rows]
+
+
+def table_version(engine, table):
+    """
+    Returns the data version of a table: its high-water mark and row count, which change
+    whenever new rows are appended by the loader or by the rooms MQTT client. The readings
+    table changes with any source, so its version covers all of them.
+    """
+    with engine.connect() as conn:
+        if table == READINGS_TABLE:
+            row = conn.execute(text(f"SELECT MAX(last_ts), SUM(row_count) FROM {STATE_TABLE}")).first()
+        else:
+            row = conn.execute(text(f"SELECT last_ts, row_count FROM {STATE_TABLE} WHERE table_name = :t"), {"t": table}).first()
+    return tuple(row) if row else None
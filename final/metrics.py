@@ -0,0 +1,128 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Latency buckets (seconds) from a cached answer up to a long agent run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram('careconnect_stage_seconds', 'Duration of a stage of the question pipeline',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter('careconnect_requests_total', 'Questions answered, by the path that answered them',
+                   ['served_by'])
+AGENT_ITERATIONS = Histogram('careconnect_agent_iterations', 'Reasoning steps of the SQL agent per question',
+                             buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15))
+TOOL_CALLS = Counter('careconnect_agent_tool_calls_total', 'Tool calls of the SQL agent', ['tool'])
+LLM_CALLS = Counter('careconnect_llm_calls_total', 'LLM calls', ['purpose'])
+LLM_TOKENS = Counter('careconnect_llm_tokens_total', 'LLM tokens', ['purpose', 'kind'])
+SQL_SECONDS = Histogram('careconnect_sql_seconds', 'Execution time of a SQL query', buckets=LATENCY_BUCKETS)
+SQL_ROWS = Histogram('careconnect_sql_rows', 'Rows returned by a SQL query',
+                     buckets=(0, 1, 10, 100, 1000, 10_000, 100_000, 1_000_000))
+
+# Breakdown of the request being answered, if one is traced (see request_trace)
+_current_trace = contextvars.ContextVar('careconnect_request_trace', default=None)
+_trace_lock = threading.Lock()
+
+
+@contextmanager
+def request_trace():
+    """
+    Collects the stage timings, SQL, LLM and agent counts of one request into the yielded dict.
+
+    Work submitted to other threads is included if it is submitted with submit_in_context.
+    """
+    trace = {"stages": {}, "sql_queries": 0, "sql_rows": 0, "llm_calls": 0, "prompt_tokens": 0,
+             "completion_tokens": 0, "agent_iterations": 0, "tool_calls": 0}
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def _add_to_trace(**counts):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    with _trace_lock:
+        for key, value in counts.items():
+            trace[key] += value
+
+
+def submit_in_context(executor, fn, *args):
+    """
+    Submits fn to the executor so that it runs in the current context, i.e. adds to the same trace.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Times the block as the given stage of the pipeline.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            with _trace_lock:
+                trace["stages"][stage] = round(trace["stages"].get(stage, 0.0) + seconds, 6)
+
+
+def observe_sql(seconds, rows):
+    """
+    Records the execution time and the row count of one SQL query.
+    """
+    SQL_SECONDS.observe(seconds)
+    SQL_ROWS.observe(rows)
+    _add_to_trace(sql_queries=1, sql_rows=rows)
+
+
+def observe_llm_usage(purpose, prompt_tokens, completion_tokens):
+    """
+    Records one LLM call and its token usage.
+    """
+    LLM_CALLS.labels(purpose).inc()
+    LLM_TOKENS.labels(purpose, 'prompt').inc(prompt_tokens)
+    LLM_TOKENS.labels(purpose, 'completion').inc(completion_tokens)
+    _add_to_trace(llm_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback recording the token usage of every LLM call and, for agents, the
+    reasoning steps and tool calls. Create one per request: the step count is kept on the handler.
+    """
+
+    def __init__(self, purpose):
+        self.purpose = purpose
+        self.iterations = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage')
+        if usage:
+            prompt_tokens, completion_tokens = usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+        else:
+            # Streamed calls report their usage on the message instead
+            message = getattr(response.generations[0][0], 'message', None) if response.generations else None
+            metadata = getattr(message, 'usage_metadata', None) or {}
+            prompt_tokens, completion_tokens = metadata.get('input_tokens', 0), metadata.get('output_tokens', 0)
+        observe_llm_usage(self.purpose, prompt_tokens or 0, completion_tokens or 0)
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        TOOL_CALLS.labels((serialized or {}).get('name', 'unknown')).inc()
+        _add_to_trace(tool_calls=1)
+
+    def on_agent_action(self, action, **kwargs):
+        self.iterations += 1
+
+    def on_agent_finish(self, finish, **kwargs):
+        self.iterations += 1
+        AGENT_ITERATIONS.observe(self.iterations)
+        _add_to_trace(agent_iterations=self.iterations)
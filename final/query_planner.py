@@ -0,0 +1,431 @@
+import re
+import pandas as pd
+from sqlalchemy import text
+
+from loader import READINGS_TABLE, NON_METRIC_COLUMNS
+from rollups import aggregate_range, locate_extreme
+from columnar import ROWID_COLUMN
+
+# Words identifying each aggregate; "series" returns every reading in the window
+AGGREGATE_WORDS = {
+    'avg': ['average', 'mean', 'avg'],
+    'min': ['minimum', 'min', 'lowest', 'smallest'],
+    'max': ['maximum', 'max', 'highest', 'peak', 'largest'],
+    'latest': ['latest', 'current', 'currently', 'now', 'most recent', 'last reading', 'last value'],
+    'series': ['entire set', 'all', 'full', 'series', 'values', 'trend', 'history', 'over time',
+               'chart', 'plot', 'graph', 'visualize', 'visualization'],
+}
+
+# Extra names users give to the sensor columns, on top of the column name itself
+COLUMN_SYNONYMS = {
+    'temperature': ['temp', 'air temperature', 'air temp'],
+    'Air_Temperature': ['temperature', 'temp', 'air temp'],
+    'humidity': ['relative humidity'],
+    'humidity_abs': ['absolute humidity'],
+    'co2': ['carbon dioxide', 'co 2'],
+    'co': ['carbon monoxide'],
+    'no2': ['nitrogen dioxide'],
+    'h2s': ['hydrogen sulfide', 'hydrogen sulphide'],
+    'o3': ['ozone'],
+    'tvoc': ['voc', 'vocs', 'volatile organic compounds'],
+    'pm2_5': ['pm2.5', 'pm 2.5', 'pm25'],
+    'pm10': ['pm 10'],
+    'pm1': ['pm 1'],
+    'dewpt': ['dew point', 'dewpoint'],
+    'sound': ['noise', 'noise level', 'sound level'],
+    'pressure': ['air pressure'],
+    'Atmospheric_Pressure': ['pressure', 'air pressure'],
+    'Solar_Radiation': ['radiation', 'solar', 'sunlight'],
+    'Precipitation': ['rain', 'rainfall'],
+    'Wind_Speed': ['wind'],
+    'VPD': ['vapor pressure deficit', 'vapour pressure deficit'],
+    'Vapor_Pressure': ['vapour pressure'],
+}
+
+# Questions containing any of these need reasoning the templates do not cover (filters, grouping, comparisons)
+UNSUPPORTED_WORDS = ['when', 'which', 'where', 'why', 'how many', 'compare', 'comparison', 'between', 'versus', 'vs',
+                     'above', 'below', 'greater', 'less', 'more than', 'exceed', 'per', 'each', 'by hour', 'by day',
+                     'hourly', 'daily', 'weekly', 'monthly', 'difference', 'change', 'correlat', 'and', 'or',
+                     # Judgements and comparisons to a baseline, which a single value does not answer
+                     'safe', 'unsafe', 'ever', 'usual', 'usually', 'normal', 'normally', 'dangerous', 'danger', 'ok',
+                     'okay', 'good', 'bad', 'healthy', 'unhealthy', 'higher than', 'lower than']
+
+# Phrases asking about all rooms at once; these are answered from the long-format readings table
+CROSS_ROOM_PHRASES = ['which room', 'which rooms', 'what room', 'all rooms', 'all the rooms', 'every room',
+                      'each room', 'across rooms', 'across the rooms', 'any room']
+
+UNIT_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 7 * 86400, 'month': 30 * 86400, 'year': 365 * 86400}
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def _normalize(textual):
+    # Lower case words separated by single spaces; dots are kept only inside numbers (pm2.5)
+    textual = re.sub(r'(?<!\d)\.|\.(?!\d)', ' ', textual.lower())
+    return ' ' + re.sub(r'[^a-z0-9.]+', ' ', textual).strip() + ' '
+
+
+def _contains(normalized_query, phrase):
+    return _normalize(phrase) in normalized_query
+
+
+def _match_column(normalized_query, columns):
+    matches = []
+    for column in columns:
+        for rank, name in enumerate([column.replace('_', ' ')] + COLUMN_SYNONYMS.get(column, [])):
+            phrase = _normalize(name)
+            if phrase in normalized_query:
+                matches.append((phrase, column, rank == 0))
+    if not matches:
+        return None
+
+    # The longest phrase wins, so "max air temperature" beats "air temperature"; on a tie a column's
+    # own name beats another column's synonym ("temperature" across rooms is not Air_Temperature)
+    best_phrase, best_column, _ = max(matches, key=lambda match: (len(match[0]), match[2]))
+    # A phrase outside the winning one names a second metric, which the templates do not handle
+    if any(column != best_column and phrase not in best_phrase for phrase, column, _ in matches):
+        return None
+    return best_column
+
+
+def _match_aggregate(normalized_query):
+    found = [aggregate for aggregate, words in AGGREGATE_WORDS.items()
+             if aggregate != 'series' and any(_contains(normalized_query, word) for word in words)]
+    if len(found) > 1:
+        return 'ambiguous'
+    if found:
+        return found[0]
+    if any(_contains(normalized_query, word) for word in AGGREGATE_WORDS['series']):
+        return 'series'
+    return None
+
+
+def _match_window(normalized_query):
+    """
+    Returns (seconds, calendar_day_offset): a trailing window length, or for "today"/"yesterday"
+    the calendar day relative to the latest reading. (None, None) means no window in the question.
+    """
+    if _contains(normalized_query, 'today'):
+        return None, 0
+    if _contains(normalized_query, 'yesterday'):
+        return None, 1
+    match = re.search(r' (?:last|past|previous) (\d+ |a |one )?(minute|hour|day|week|month|year)s? ', normalized_query)
+    if match:
+        count = match.group(1).strip() if match.group(1) else '1'
+        count = 1 if count in ('a', 'one') else int(count)
+        return count * UNIT_SECONDS[match.group(2)], None
+    return None, None
+
+
+def plan_query(input_query, table, columns, wants_series=False):
+    """
+    Recognizes formulaic sensor questions: an aggregate of one known column of the room's table
+    over an optional relative time window.
+
+    Args:
+        input_query (str): The user question.
+        table (str): Table of the selected room (e.g. "room_QRITA" or "rooftop").
+        columns (list): Column names of that table.
+        wants_series (bool): Whether the user asked for a visualization, which implies the full series.
+
+    Returns:
+        dict: The query plan, or None if the question does not fit the templates.
+    """
+    normalized_query = _normalize(input_query)
+    if any(_contains(normalized_query, word) for word in UNSUPPORTED_WORDS):
+        return None
+
+    column = _match_column(normalized_query, [c for c in columns if c not in NON_METRIC_COLUMNS])
+    if column is None:
+        return None
+
+    aggregate = _match_aggregate(normalized_query)
+    window_seconds, day_offset = _match_window(normalized_query)
+    if aggregate == 'ambiguous':
+        return None
+    if wants_series and aggregate in (None, 'latest') or aggregate is None and (window_seconds or day_offset is not None):
+        aggregate = 'series'
+    if aggregate is None:
+        # A metric with no aggregate, latest or series word and no window is not a question the templates parse
+        return None
+
+    return {"table": table, "column": column, "aggregate": aggregate,
+            "window_seconds": window_seconds, "day_offset": day_offset}
+
+
+def is_cross_room(input_query):
+    """
+    Whether the question compares or covers all rooms rather than the selected one.
+    """
+    normalized_query = _normalize(input_query)
+    return any(_contains(normalized_query, phrase) for phrase in CROSS_ROOM_PHRASES)
+
+
+def plan_cross_room(input_query, metrics):
+    """
+    Recognizes formulaic questions across rooms: an aggregate (avg/min/max/latest) of one metric
+    per room, over an optional relative time window.
+
+    Args:
+        input_query (str): The user question.
+        metrics (iterable): Known metric names (the sensor columns of the wide tables).
+
+    Returns:
+        dict: The query plan on the readings table, or None if the question does not fit.
+    """
+    normalized_query = _normalize(input_query)
+    remainder = normalized_query
+    for phrase in CROSS_ROOM_PHRASES:
+        remainder = remainder.replace(_normalize(phrase), ' ')
+    if remainder == normalized_query or any(_contains(remainder, word) for word in UNSUPPORTED_WORDS):
+        return None
+
+    column = _match_column(remainder, sorted(set(metrics) - NON_METRIC_COLUMNS))
+    aggregate = _match_aggregate(remainder)
+    if column is None or aggregate in (None, 'ambiguous', 'series'):
+        return None
+    window_seconds, day_offset = _match_window(remainder)
+    return {"table": READINGS_TABLE, "column": column, "aggregate": aggregate,
+            "window_seconds": window_seconds, "day_offset": day_offset, "cross_room": True}
+
+
+def _epoch_ms(timestamp):
+    return timestamp.value // 1_000_000
+
+
+def _format_ms(ts_ms):
+    return pd.Timestamp(ts_ms, unit='ms').strftime(TIMESTAMP_FORMAT)
+
+
+def _rollup_rows(conn, metric, aggregate, start_ms, end_ms, source=None):
+    """
+    Runs an avg/min/max over [start_ms, end_ms) on the rollups of the readings table.
+
+    Returns:
+        tuple: (SQL, params, rows), rows being (source, avg, count) for an average and
+        (source, extreme, epoch ms of its first occurrence) for a minimum or maximum.
+    """
+    sql, params, sums = aggregate_range(conn, metric, start_ms, end_ms, source=source, readings_table=READINGS_TABLE)
+    if aggregate == 'avg':
+        return sql, params, [(source, total / count, count) for source, count, total, _, _ in sums if count]
+    column = 'value_min' if aggregate == 'min' else 'value_max'
+    rows = []
+    for source, count, _, minimum, maximum in sums:
+        if count:
+            value = minimum if aggregate == 'min' else maximum
+            rows.append((source, value, locate_extreme(conn, source, metric, value, start_ms, end_ms, column,
+                                                       readings_table=READINGS_TABLE)))
+    return sql, params, rows
+
+
+def _source_label(source):
+    # room_QRITA -> RITA, rooftop -> ROOF, as the rooms are named in the frontend
+    if source == 'rooftop':
+        return 'ROOF'
+    return source[len('room_Q'):] if source.startswith('room_Q') else source
+
+
+def _run_cross_room(engine, plan, input_query):
+    """
+    Runs a cross-room plan: averages and extremes from the rollups of the readings table, the
+    latest readings as one range scan of its (metric, ts_epoch_ms) index.
+    """
+    metric, aggregate = plan["column"], plan["aggregate"]
+    with engine.connect() as conn:
+        latest_ms = conn.execute(text(f"SELECT MAX(ts_epoch_ms) FROM {READINGS_TABLE} WHERE metric = :metric"),
+                                 {"metric": metric}).scalar()
+        start = end = None
+        if latest_ms is not None:
+            latest = pd.Timestamp(latest_ms, unit='ms')
+            if plan["day_offset"] is not None:
+                start = latest.normalize() - pd.Timedelta(days=plan["day_offset"])
+                end = start + pd.Timedelta(days=1)
+            elif plan["window_seconds"]:
+                start = latest - pd.Timedelta(seconds=plan["window_seconds"])
+
+        if latest_ms is None:
+            sql, params, rows = None, {}, []
+        elif aggregate in ('avg', 'min', 'max'):
+            start_ms = 0 if start is None else _epoch_ms(start)
+            end_ms = latest_ms + 1 if end is None else _epoch_ms(end)
+            sql, params, rows = _rollup_rows(conn, metric, aggregate, start_ms, end_ms)
+            rows.sort(key=lambda row: row[1], reverse=aggregate != 'min')
+        else:
+            conditions, params = ["metric = :metric"], {"metric": metric}
+            if start is not None:
+                conditions.append("ts_epoch_ms >= :start")
+                params["start"] = _epoch_ms(start)
+            if end is not None:
+                conditions.append("ts_epoch_ms < :end")
+                params["end"] = _epoch_ms(end)
+            # With MAX(), SQLite takes the other bare columns from the row holding the maximum
+            sql = (f"SELECT source, value AS latest_{metric}, MAX(ts_epoch_ms) AS ts_epoch_ms FROM {READINGS_TABLE} "
+                   f"WHERE {' AND '.join(conditions)} GROUP BY source ORDER BY 2 DESC")
+            rows = [tuple(row) for row in conn.execute(text(sql), params).all()]
+
+    # Rooms by their frontend name, times as text (not a time axis: the rows are a ranking, not a series)
+    columns = ['room', f"{aggregate}_{metric}", 'readings' if aggregate == 'avg' else 'measured_at']
+    rows = [(_source_label(row[0]), row[1], _format_ms(row[2]) if aggregate != 'avg' else row[2]) for row in rows]
+    return {"input": input_query, "output": _format_cross_room_output(plan, rows, start, end),
+            "sql": sql, "params": params, "columns": columns, "rows": rows}
+
+
+def _format_cross_room_output(plan, rows, start, end):
+    metric = plan["column"]
+    if not rows:
+        return f"There is no {metric} data in any room for the requested period."
+    period = f" between {start} and {end}" if start is not None and end is not None else \
+        f" since {start}" if start is not None else ""
+    label = {'avg': 'average', 'min': 'minimum', 'max': 'maximum', 'latest': 'latest'}[plan["aggregate"]]
+    ranking = ', '.join(f"{row[0]} {row[1]:.2f}" for row in rows)
+    first = rows[0]
+    return (f"{first[0]} had the {'lowest' if plan['aggregate'] == 'min' else 'highest'} {label} {metric}{period}"
+            f" ({first[1]:.2f}). All rooms: {ranking}.")
+
+
+def _window_bounds(conn, plan):
+    # Relative windows are anchored at the latest reading, since the sensor history can lag behind "now"
+    latest = conn.execute(text(f'SELECT MAX("timestamp") FROM "{plan["table"]}"')).scalar()
+    return _relative_window(latest, plan)
+
+
+def _relative_window(latest, plan):
+    if latest is None:
+        return None, None, None
+    latest = pd.Timestamp(latest)
+    if plan["day_offset"] is not None:
+        start = latest.normalize() - pd.Timedelta(days=plan["day_offset"])
+        return latest, start, start + pd.Timedelta(days=1)
+    if plan["window_seconds"]:
+        return latest, latest - pd.Timedelta(seconds=plan["window_seconds"]), None
+    return latest, None, None
+
+
+def _run_columnar(conn, store, plan, input_query):
+    """
+    Runs a series or latest plan on the columnar store: only the files of the window and only
+    the timestamp and the asked column are read. The rows written to the table since the store
+    was last synced (e.g. by the rooms MQTT client) are taken from SQLite, by rowid.
+    """
+    table, column, aggregate = plan["table"], plan["column"], plan["aggregate"]
+    synced = store.synced_rowid(table)
+    tail = pd.DataFrame(conn.execute(text(f'SELECT "timestamp", "{column}" FROM "{table}" WHERE rowid > :synced'),
+                                     {"synced": synced}).all(), columns=['timestamp', column])
+    tail['timestamp'] = pd.to_datetime(tail['timestamp'], errors='coerce')
+    tail = tail.dropna(subset=['timestamp'])
+
+    max_ts = store.max_ts(table)
+    candidates = [pd.Timestamp(max_ts, unit='ms')] if max_ts is not None else []
+    candidates += [tail['timestamp'].max()] if not tail.empty else []
+    latest, start, end = _relative_window(max(candidates) if candidates else None, plan)
+    params = {"start": None if start is None else start.strftime(TIMESTAMP_FORMAT),
+              "end": None if end is None else end.strftime(TIMESTAMP_FORMAT)}
+    start_ms = None if start is None else _epoch_ms(start)
+    end_ms = None if end is None else _epoch_ms(end)
+    in_window = tail[column].notna()
+    if start is not None:
+        in_window &= tail['timestamp'] >= start
+    if end is not None:
+        in_window &= tail['timestamp'] < end
+    tail = tail[in_window]
+
+    columns = ['timestamp', column]
+    if latest is None:
+        rows = []
+    elif aggregate == 'latest':
+        # The later of the last stored value and the last value written since
+        found = []
+        stored = store.latest(table, column, start_ms, end_ms)
+        if stored is not None:
+            found.append((pd.Timestamp(stored[0], unit='ms'), stored[1]))
+        if not tail.empty:
+            last = tail.loc[tail['timestamp'].idxmax()]
+            found.append((last['timestamp'], last[column]))
+        rows = []
+        if found:
+            ts, value = max(found, key=lambda candidate: candidate[0])
+            rows = [(ts.strftime(TIMESTAMP_FORMAT), float(value))]
+    else:
+        frame = store.read(table, [column, ROWID_COLUMN], start_ms, end_ms)
+        # Rows synced after `synced` was read are in the tail too
+        frame = frame[frame[ROWID_COLUMN] <= synced].dropna(subset=[column])[['timestamp', column]]
+        if not tail.empty:
+            frame = pd.concat([frame, tail], ignore_index=True).sort_values('timestamp', kind='stable')
+        rows = list(zip(frame['timestamp'].dt.strftime(TIMESTAMP_FORMAT), frame[column].astype(float).tolist()))
+    return {"input": input_query, "output": _format_output(plan, columns, rows, start, end if end is not None else latest),
+            "sql": f"columnar {aggregate} of {table}.{column}", "params": params, "columns": columns, "rows": rows}
+
+
+def run_plan(engine, plan, input_query, store=None):
+    """
+    Runs a query plan with parameterized SQL, or on the columnar store if one is given.
+
+    Args:
+        store (ColumnarStore, optional): Columnar copy of the tables, which then serves the series
+            and latest plans of a room; it is read as is, never synced on the request.
+
+    Returns:
+        dict: Same shape as the agent result ("input", "output" as prose), plus the executed
+        "sql", the result "columns" and "rows".
+    """
+    if plan.get("cross_room"):
+        return _run_cross_room(engine, plan, input_query)
+
+    table, column, aggregate = plan["table"], plan["column"], plan["aggregate"]
+    if store is not None and aggregate in ('series', 'latest'):
+        with engine.connect() as conn:
+            return _run_columnar(conn, store, plan, input_query)
+
+    with engine.connect() as conn:
+        latest, start, end = _window_bounds(conn, plan)
+        if aggregate in ('avg', 'min', 'max') and latest is not None:
+            # The rollups answer a year of readings from a few hundred rows; the result has the same shape
+            start_ms = 0 if start is None else _epoch_ms(start)
+            end_ms = _epoch_ms(latest) + 1 if end is None else _epoch_ms(end)
+            sql, params, rows = _rollup_rows(conn, column, aggregate, start_ms, end_ms, source=table)
+            if aggregate == 'avg':
+                columns, rows = [f"avg_{column}", 'readings'], [row[1:] for row in rows] or [(None, 0)]
+            else:
+                columns, rows = ['timestamp', column], [(_format_ms(row[2]), row[1]) for row in rows]
+            return {"input": input_query,
+                    "output": _format_output(plan, columns, rows, start, end if end is not None else latest),
+                    "sql": sql, "params": params, "columns": columns, "rows": rows}
+
+        conditions, params = [f'"{column}" IS NOT NULL'], {}
+        if start is not None:
+            conditions.append('"timestamp" >= :start')
+            params["start"] = start.strftime(TIMESTAMP_FORMAT)
+        if end is not None:
+            conditions.append('"timestamp" < :end')
+            params["end"] = end.strftime(TIMESTAMP_FORMAT)
+        where = ' AND '.join(conditions)
+
+        if aggregate == 'avg':
+            sql = f'SELECT AVG("{column}") AS avg_{column}, COUNT("{column}") AS readings FROM "{table}" WHERE {where}'
+        elif aggregate in ('min', 'max'):
+            order = 'ASC' if aggregate == 'min' else 'DESC'
+            sql = f'SELECT "timestamp", "{column}" FROM "{table}" WHERE {where} ORDER BY "{column}" {order} LIMIT 1'
+        elif aggregate == 'latest':
+            sql = f'SELECT "timestamp", "{column}" FROM "{table}" WHERE {where} ORDER BY "timestamp" DESC LIMIT 1'
+        else:
+            sql = f'SELECT "timestamp", "{column}" FROM "{table}" WHERE {where} ORDER BY "timestamp"'
+        result = conn.execute(text(sql), params)
+        columns = list(result.keys())
+        rows = [tuple(row) for row in result.all()]
+
+    return {"input": input_query, "output": _format_output(plan, columns, rows, start, end if end is not None else latest),
+            "sql": sql, "params": params, "columns": columns, "rows": rows}
+
+
+def _format_output(plan, columns, rows, start, end):
+    column = plan["column"]
+    if not rows or rows[0][0] is None or (plan["aggregate"] == 'avg' and rows[0][1] == 0):
+        return f"There is no {column} data in {plan['table']} for the requested period."
+    period = f" between {start} and {end}" if start is not None else ""
+    if plan["aggregate"] == 'series':
+        # The rows themselves are returned separately and charted
+        return f"Here are the {len(rows)} {column} readings of {plan['table']}{period}, from {rows[0][0]} to {rows[-1][0]}."
+    if plan["aggregate"] == 'avg':
+        return f"The average {column} in {plan['table']}{period} was {rows[0][0]:.2f} (over {rows[0][1]} readings)."
+    label = {'min': 'minimum', 'max': 'maximum', 'latest': 'latest'}[plan["aggregate"]]
+    return f"The {label} {column} in {plan['table']}{period} was {rows[0][1]} at {rows[0][0]}."
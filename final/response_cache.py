@@ -0,0 +1,93 @@
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(input_query):
+    """
+    Normalizes a user question so trivially different spellings share a cache entry:
+    lower case, single spaces and no trailing punctuation.
+    """
+    return re.sub(r'\s+', ' ', input_query.strip().lower()).rstrip(' ?.!')
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of /get_data responses.
+
+    Keys are (normalized query, room, data version of the room's table), so an entry can
+    only be hit while the table holds exactly the rows it was computed from. When a lookup
+    sees a newer data version, the entries of the older versions of that table are dropped.
+
+    The cache is bounded both by number of entries and by the approximate size of the
+    cached responses; the least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, response)
+        self._versions = {}  # table -> latest data version seen
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, input_query, room_choice, table, version):
+        """
+        Returns the cached response for the question, or None on a miss.
+        """
+        key = (normalize_query(input_query), room_choice, table, version)
+        with self._lock:
+            self._drop_stale(table, version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return dict(entry[2])
+
+    def put(self, input_query, room_choice, table, version, response):
+        """
+        Stores a response, evicting least recently used entries to stay within the caps.
+        """
+        key = (normalize_query(input_query), room_choice, table, version)
+        size = len(json.dumps(response, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop_stale(table, version)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, dict(response))
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        """
+        Returns the hit/miss/eviction counters and the current size of the cache.
+        """
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+
+    def _drop_stale(self, table, version):
+        # New rows were ingested for the table: entries of older versions can never be hit again
+        if self._versions.get(table) == version:
+            return
+        self._versions[table] = version
+        for key in [k for k in self._entries if k[2] == table and k[3] != version]:
+            self._remove(key)
+            self._stats["invalidations"] += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,151 @@
+from sqlalchemy import text
+
+# Rollups of the readings table, coarsest first: (table, bucket size in ms). Each row holds the
+# count, sum, min and max of one metric of one source over one bucket.
+ROLLUPS = [('readings_1d', 86_400_000), ('readings_1h', 3_600_000), ('readings_5m', 300_000)]
+
+ROLLUP_TRIGGER = 'readings_rollup'
+
+
+def ensure_rollups(conn, readings_table='readings'):
+    """
+    Creates the rollup tables and the trigger keeping them up to date.
+
+    The first time, the rollups are computed from the readings already stored, in the same
+    transaction as the trigger creation. From then on, every row inserted into the readings
+    table, by the CSV loader or by the rooms MQTT client, is added to its bucket of each rollup
+    by the trigger. Rows skipped by INSERT OR IGNORE are not inserted, so they are not counted.
+    """
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+                          {"name": ROLLUP_TRIGGER}).first()
+    if exists:
+        return
+
+    upserts = []
+    for table, size in ROLLUPS:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                source TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                bucket_ms INTEGER NOT NULL,
+                value_count INTEGER NOT NULL,
+                value_sum REAL NOT NULL,
+                value_min REAL NOT NULL,
+                value_max REAL NOT NULL,
+                PRIMARY KEY (source, metric, bucket_ms)
+            ) WITHOUT ROWID
+        """))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {table}_metric_bucket ON {table} (metric, bucket_ms)"))
+        conn.execute(text(f"DELETE FROM {table}"))
+        conn.execute(text(f"""
+            INSERT INTO {table} (source, metric, bucket_ms, value_count, value_sum, value_min, value_max)
+            SELECT source, metric, ts_epoch_ms - ts_epoch_ms % {size}, COUNT(*), SUM(value), MIN(value), MAX(value)
+            FROM {readings_table} WHERE value IS NOT NULL
+            GROUP BY source, metric, ts_epoch_ms - ts_epoch_ms % {size}
+        """))
+        upserts.append(f"""
+            INSERT INTO {table} (source, metric, bucket_ms, value_count, value_sum, value_min, value_max)
+            VALUES (NEW.source, NEW.metric, NEW.ts_epoch_ms - NEW.ts_epoch_ms % {size}, 1, NEW.value, NEW.value, NEW.value)
+            ON CONFLICT (source, metric, bucket_ms) DO UPDATE SET
+                value_count = value_count + 1,
+                value_sum = value_sum + excluded.value_sum,
+                value_min = MIN(value_min, excluded.value_min),
+                value_max = MAX(value_max, excluded.value_max);""")
+
+    conn.execute(text(f"""
+        CREATE TRIGGER {ROLLUP_TRIGGER} AFTER INSERT ON {readings_table}
+        WHEN NEW.value IS NOT NULL
+        BEGIN
+            {''.join(upserts)}
+        END
+    """))
+
+
+def decompose(start_ms, end_ms, rollups=ROLLUPS):
+    """
+    Splits [start_ms, end_ms) into segments answered by the coarsest table that covers them
+    exactly: whole days from the daily rollup, the remaining whole hours from the hourly one,
+    whole 5-minute buckets from the 5-minute one and the ragged edges from the raw readings.
+
+    Returns:
+        list: (table or None for the raw readings, segment start, segment end), in time order.
+    """
+    if start_ms >= end_ms:
+        return []
+    if not rollups:
+        return [(None, start_ms, end_ms)]
+    (table, size), finer = rollups[0], rollups[1:]
+    first = -(-start_ms // size) * size  # First bucket boundary at or after the start
+    last = end_ms // size * size
+    if first >= last:
+        return decompose(start_ms, end_ms, finer)
+    return decompose(start_ms, first, finer) + [(table, first, last)] + decompose(last, end_ms, finer)
+
+
+def _segments_sql(segments, readings_table, source):
+    parts, params = [], {}
+    # With a source, each segment is a primary key range; without, a (metric, time) index range
+    source_filter = ' AND source = :source' if source is not None else ''
+    for i, (table, lo, hi) in enumerate(segments):
+        params[f"lo{i}"], params[f"hi{i}"] = lo, hi
+        if table is None:
+            parts.append(f"SELECT source, 1 AS n, value AS s, value AS mn, value AS mx FROM {readings_table} "
+                         f"WHERE metric = :metric{source_filter} AND ts_epoch_ms >= :lo{i} AND ts_epoch_ms < :hi{i} "
+                         f"AND value IS NOT NULL")
+        else:
+            parts.append(f"SELECT source, value_count AS n, value_sum AS s, value_min AS mn, value_max AS mx FROM {table} "
+                         f"WHERE metric = :metric{source_filter} AND bucket_ms >= :lo{i} AND bucket_ms < :hi{i}")
+    return ' UNION ALL '.join(parts), params
+
+
+def aggregate_range(conn, metric, start_ms, end_ms, source=None, readings_table='readings'):
+    """
+    Exact count/sum/min/max of a metric per source over [start_ms, end_ms), read mostly from
+    the rollups: a year of 5-minute readings costs about 365 daily rows plus a few hundred
+    finer ones instead of 100k raw rows per source.
+
+    Returns:
+        tuple: (SQL, params, rows), rows being (source, count, sum, min, max) per source.
+    """
+    segments = decompose(start_ms, end_ms)
+    if not segments:
+        return None, {}, []
+    union, params = _segments_sql(segments, readings_table, source)
+    params["metric"] = metric
+    if source is not None:
+        params["source"] = source
+    sql = (f"SELECT source, SUM(n) AS value_count, SUM(s) AS value_sum, MIN(mn) AS value_min, MAX(mx) AS value_max "
+           f"FROM ({union}) GROUP BY source")
+    return sql, params, [tuple(row) for row in conn.execute(text(sql), params).all()]
+
+
+def locate_extreme(conn, source, metric, value, start_ms, end_ms, column='value_max',
+                   readings_table='readings', rollups=ROLLUPS):
+    """
+    Returns the first time (epoch ms) in [start_ms, end_ms) at which the metric of the source
+    took the value, an extreme found by aggregate_range. It drills down from the bucket holding
+    it at the coarsest level to the raw reading, each step being a primary key range lookup.
+
+    Args:
+        column (str): 'value_max' for a maximum, 'value_min' for a minimum.
+    """
+    for table, lo, hi in decompose(start_ms, end_ms, rollups):
+        params = {"source": source, "metric": metric, "value": value, "lo": lo, "hi": hi}
+        if table is None:
+            ts = conn.execute(text(
+                f"SELECT MIN(ts_epoch_ms) FROM {readings_table} WHERE source = :source AND metric = :metric "
+                f"AND ts_epoch_ms >= :lo AND ts_epoch_ms < :hi AND value = :value"), params).scalar()
+            if ts is not None:
+                return ts
+            continue
+        bucket = conn.execute(text(
+            f"SELECT MIN(bucket_ms) FROM {table} WHERE source = :source AND metric = :metric "
+            f"AND bucket_ms >= :lo AND bucket_ms < :hi AND {column} = :value"), params).scalar()
+        if bucket is not None:
+            level = [name for name, _ in rollups].index(table)
+            size = rollups[level][1]
+            ts = locate_extreme(conn, source, metric, value, bucket, bucket + size, column,
+                                readings_table, rollups[level + 1:])
+            if ts is not None:
+                return ts
+    return None
@@ -0,0 +1,92 @@
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
+
+from charts import find_time_column
+from metrics import observe_sql
+
+# Rows of a query result shown to the agent; the full result is captured for the chart
+LLM_ROW_LIMIT = 20
+
+
+class CapturingSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase that keeps the rows of the last query the agent executed.
+
+    Inside a capture() block, every query run through the SQL tool records its column names
+    and rows, so the visualization stage gets the actual result instead of re-parsing the
+    LLM's text. The agent itself only sees the first LLM_ROW_LIMIT rows of long results.
+    Captures are per thread, so concurrent requests do not see each other's rows.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    @contextmanager
+    def capture(self, on_execute=None):
+        """
+        Records the queries executed in the block; yields a dict whose "columns", "rows" and
+        "sql" keys describe the last one.
+
+        Args:
+            on_execute (callable, optional): Called with the dict after each captured query,
+                e.g. to report progress while the agent is still running.
+        """
+        captured = {"columns": None, "rows": None, "sql": None}
+        self._local.captured = captured
+        self._local.on_execute = on_execute
+        try:
+            yield captured
+        finally:
+            self._local.captured = None
+            self._local.on_execute = None
+
+    def _execute(self, command, fetch="all", **kwargs):
+        start = time.perf_counter()
+        result = super()._execute(command, fetch, **kwargs)
+        observe_sql(time.perf_counter() - start, len(result) if isinstance(result, list) else 1)
+        captured = getattr(self._local, "captured", None)
+        if captured is not None and fetch == "all":
+            captured["sql"] = str(command)
+            captured["columns"] = list(result[0].keys()) if result else []
+            captured["rows"] = [tuple(row.values()) for row in result]
+            if self._local.on_execute is not None:
+                self._local.on_execute(captured)
+        return result
+
+    def run(self, command, fetch="all", include_columns=False, **kwargs):
+        if fetch != "all":
+            return super().run(command, fetch, include_columns, **kwargs)
+
+        result = self._execute(command, fetch, **kwargs)
+        # Formatted like SQLDatabase.run: long text values truncated, dicts when include_columns is set
+        shown = [{column: truncate_word(value, length=self._max_string_length) for column, value in row.items()}
+                 for row in result[:LLM_ROW_LIMIT]]
+        if not include_columns:
+            shown = [tuple(row.values()) for row in shown]
+        if not shown:
+            return ""
+        if len(result) > LLM_ROW_LIMIT:
+            return f"{shown} ... ({len(result)} rows in total, all of them are charted for the user)"
+        return str(shown)
+
+
+def build_result_frame(columns, rows):
+    """
+    Builds the typed DataFrame of a query result once: the time column is parsed to
+    datetimes and the other columns keep the types returned by SQLite.
+
+    Returns:
+        DataFrame: The result, or None if there are no rows.
+    """
+    if not rows:
+        return None
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    time_column = find_time_column(df)
+    if time_column is not None:
+        df[time_column] = pd.to_datetime(df[time_column], errors='coerce')
+    return df